@@ -0,0 +1,7 @@
+# Database helpers referenced from settings.py
+
+
+def reset_search_path(connection):
+    """psycopg_pool reset callback: drop a tenant's search_path before reuse."""
+    connection.autocommit = True
+    connection.execute("RESET search_path")
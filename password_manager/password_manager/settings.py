@@ -1,4 +1,5 @@
 import os
+import json
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -35,10 +36,12 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "users.instrumentation.InstrumentationMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "users.tenancy.TenantMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -75,12 +78,64 @@ DATABASES = {
         "PASSWORD": os.getenv("PASSWORD"),
         "HOST": os.getenv("HOST"),
         "PORT": os.getenv("PORT"),
+        # Check reused connections before handing them to a request
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# DB_ENGINE=sqlite swaps in a local SQLite file, e.g. for benchmarks. Per-user
+# schemas and connection pooling are PostgreSQL only and are skipped there.
+DB_ENGINE = os.getenv("DB_ENGINE", "postgresql")
+
+if DB_ENGINE == "sqlite":
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.getenv("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+        "OPTIONS": {"timeout": 20},  # Wait for the write lock under concurrency
+    }
+
+# Connection pooling (needs psycopg 3 with psycopg[pool]).
+# Without a pool, CONN_MAX_AGE keeps one connection per worker thread alive.
+DB_POOL = os.getenv("DB_POOL", "False") == "True" and DB_ENGINE != "sqlite"
+
+if DB_POOL:
+    from password_manager.db import reset_search_path
+
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+            "max_idle": float(os.getenv("DB_POOL_MAX_IDLE", 300)),  # Seconds
+            "timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),  # Checkout wait
+            "reset": reset_search_path,
+        }
+    }
+else:
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("CONN_MAX_AGE", 60))
+
 # Custom User Model
 AUTH_USER_MODEL = "users.CustomUser"
 
+# Password Hashing. PASSWORD_HASHER picks the hasher for new hashes; the
+# others stay listed so older hashes verify and are upgraded on login
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "argon2")  # argon2, scrypt, pbkdf2
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", 2))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", 19456))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", 1))
+SCRYPT_WORK_FACTOR = int(os.getenv("SCRYPT_WORK_FACTOR", 2**14))
+PBKDF2_ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS", 870000))
+
+_PASSWORD_HASHERS = {
+    "argon2": "users.hashers.Argon2PasswordHasher",
+    "scrypt": "users.hashers.ScryptPasswordHasher",
+    "pbkdf2": "users.hashers.PBKDF2PasswordHasher",
+}
+PASSWORD_HASHERS = [
+    _PASSWORD_HASHERS[PASSWORD_HASHER],
+    *(path for name, path in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER),
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+]
+
 # Password Validators
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -110,11 +165,15 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Django REST Framework & JWT Authentication
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly"
     ],
+    # Reverse proxies in front of the app. Client IPs (rate limits) come from
+    # X-Forwarded-For only when this is set, else from REMOTE_ADDR, so clients
+    # can't pick their own IP
+    "NUM_PROXIES": int(os.getenv("NUM_PROXIES", 0)),
 }
 
 
@@ -141,8 +200,11 @@ CORS_ALLOW_HEADERS = [  # Allow these headers
     "Accept",
     "Origin",
     "X-Requested-With",
+    "X-Vault-Token",
 ]
 
+CORS_EXPOSE_HEADERS = ["X-Vault-Token"]  # Lets the frontend read the issued token
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
@@ -165,3 +227,142 @@ EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS")
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL")
+
+#  Face recognition worker pool (users/face_pool.py)
+
+FACE_POOL_WORKERS = int(os.getenv("FACE_POOL_WORKERS", 2))  # 0 runs face work inline
+FACE_POOL_MAX_QUEUE = int(os.getenv("FACE_POOL_MAX_QUEUE", 4))  # Jobs allowed to wait
+FACE_POOL_QUEUE_TIMEOUT = float(os.getenv("FACE_POOL_QUEUE_TIMEOUT", 0.5))  # Seconds
+FACE_POOL_TIMEOUT = float(os.getenv("FACE_POOL_TIMEOUT", 10))  # Seconds per job
+FACE_POOL_RETRY_AFTER = int(os.getenv("FACE_POOL_RETRY_AFTER", 5))  # Seconds
+FACE_POOL_START_METHOD = os.getenv("FACE_POOL_START_METHOD", "spawn")
+FACE_POOL_PREWARM = os.getenv("FACE_POOL_PREWARM", "False") == "True"
+
+# Pre-detection stage run before dlib encoding: "haar" (fast) or "hog"
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "haar")
+FACE_DETECT_MAX_EDGE = int(os.getenv("FACE_DETECT_MAX_EDGE", 640))  # Pixels
+
+# Face image uploads are normalized before storage (users/imaging.py)
+FACE_UPLOAD_MAX_BYTES = int(os.getenv("FACE_UPLOAD_MAX_BYTES", 15 * 1024 * 1024))
+FACE_IMAGE_MAX_EDGE = int(os.getenv("FACE_IMAGE_MAX_EDGE", 1024))  # Pixels
+FACE_IMAGE_FORMAT = os.getenv("FACE_IMAGE_FORMAT", "JPEG")  # JPEG, WEBP or PNG
+FACE_IMAGE_QUALITY = int(os.getenv("FACE_IMAGE_QUALITY", 85))
+FACE_UPLOAD_KEEP_ORIGINAL = os.getenv("FACE_UPLOAD_KEEP_ORIGINAL", "False") == "True"
+
+# Face matching
+FACE_MATCH_TOLERANCE = float(os.getenv("FACE_MATCH_TOLERANCE", 0.6))  # Max distance
+FACE_BATCH_MAX_FRAMES = int(os.getenv("FACE_BATCH_MAX_FRAMES", 10))
+# Share of a batch's frames that must match; frames without a usable face count as misses
+FACE_BATCH_MIN_MATCH_RATIO = float(os.getenv("FACE_BATCH_MIN_MATCH_RATIO", 0.5))
+FACE_MATCH_POLICY = os.getenv("FACE_MATCH_POLICY", "min")  # "min" or "mean" over templates
+FACE_MAX_TEMPLATES = int(os.getenv("FACE_MAX_TEMPLATES", 5))  # Images per user
+FACE_TEMPLATE_CACHE_TIMEOUT = int(os.getenv("FACE_TEMPLATE_CACHE_TIMEOUT", 3600))
+
+# Tenant (per-user schema) resolution, see users/tenancy.py
+TENANT_SCHEMA_CACHE_SIZE = int(os.getenv("TENANT_SCHEMA_CACHE_SIZE", 10000))
+TENANT_SCHEMA_CACHE_TTL = int(os.getenv("TENANT_SCHEMA_CACHE_TTL", 300))  # Seconds
+
+# Outbound mail queue (users/mail.py)
+MAIL_QUEUE_DISPATCH_IN_PROCESS = (
+    os.getenv("MAIL_QUEUE_DISPATCH_IN_PROCESS", "True") == "True"
+)  # Set False when `manage.py send_queued_mail --loop` runs separately
+MAIL_QUEUE_BATCH_SIZE = int(os.getenv("MAIL_QUEUE_BATCH_SIZE", 50))
+MAIL_QUEUE_POLL_INTERVAL = float(os.getenv("MAIL_QUEUE_POLL_INTERVAL", 2))  # Seconds
+MAIL_QUEUE_MAX_ATTEMPTS = int(os.getenv("MAIL_QUEUE_MAX_ATTEMPTS", 5))
+MAIL_QUEUE_RETRY_BASE = int(os.getenv("MAIL_QUEUE_RETRY_BASE", 10))  # Seconds
+MAIL_QUEUE_RETRY_MAX = int(os.getenv("MAIL_QUEUE_RETRY_MAX", 600))  # Seconds
+# Seconds a claimed batch may take to send before other dispatchers retry it
+MAIL_QUEUE_LEASE = int(os.getenv("MAIL_QUEUE_LEASE", 300))
+
+# Vault listing
+VAULT_PAGE_SIZE = int(os.getenv("VAULT_PAGE_SIZE", 100))
+VAULT_MAX_PAGE_SIZE = int(os.getenv("VAULT_MAX_PAGE_SIZE", 1000))
+VAULT_STREAM_CHUNK_SIZE = int(os.getenv("VAULT_STREAM_CHUNK_SIZE", 500))  # ?stream=ndjson
+
+# Bulk password import/export
+VAULT_IMPORT_MAX_BYTES = int(os.getenv("VAULT_IMPORT_MAX_BYTES", 20 * 1024 * 1024))
+VAULT_IMPORT_BATCH_SIZE = int(os.getenv("VAULT_IMPORT_BATCH_SIZE", 500))
+VAULT_IMPORT_MAX_ERRORS = int(os.getenv("VAULT_IMPORT_MAX_ERRORS", 100))  # Reported rows
+
+# Delta sync (users/sync.py)
+VAULT_SYNC_MAX_CHANGES = int(os.getenv("VAULT_SYNC_MAX_CHANGES", 500))  # Per response
+VAULT_SYNC_SETTLE_SECONDS = int(os.getenv("VAULT_SYNC_SETTLE_SECONDS", 5))
+VAULT_TOMBSTONE_RETENTION_DAYS = int(os.getenv("VAULT_TOMBSTONE_RETENTION_DAYS", 90))
+
+# Vault encryption (users/vault_crypto.py). Set VAULT_MASTER_KEY to 32 random
+# bytes, urlsafe base64 encoded; without it the master key is derived from
+# SECRET_KEY once per process with PBKDF2
+VAULT_MASTER_KEY = os.getenv("VAULT_MASTER_KEY", "")
+VAULT_KDF_ITERATIONS = int(os.getenv("VAULT_KDF_ITERATIONS", 600000))
+VAULT_KEY_CACHE_SIZE = int(os.getenv("VAULT_KEY_CACHE_SIZE", 1024))  # Unwrapped keys
+VAULT_KEY_CACHE_TTL = int(os.getenv("VAULT_KEY_CACHE_TTL", 300))
+
+# Request instrumentation (users/instrumentation.py). QUERY_BUDGETS maps URL
+# names to the most queries the view may run, overriding query_budget on the
+# view class. Over budget is a warning, or an error with QUERY_BUDGET_STRICT
+INSTRUMENTATION_SERVER_TIMING = (
+    os.getenv("INSTRUMENTATION_SERVER_TIMING", str(DEBUG)) == "True"
+)
+QUERY_BUDGETS = json.loads(os.getenv("QUERY_BUDGETS", "{}"))
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "False") == "True"
+
+# Prometheus metrics at /metrics (users/metrics.py). Under gunicorn, point
+# PROMETHEUS_MULTIPROC_DIR at an empty directory so all workers are reported.
+# With METRICS_TOKEN set, scrapers must send it as a bearer token
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Rate limiting (users/ratelimit.py). Sliding windows per client IP and per
+# account for each throttle scope; RATE_LIMITS can be replaced with JSON.
+# The local store counts per process; use redis to share counts
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "True") == "True"
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "local")  # local or redis
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_LOCAL_MAX_KEYS = int(os.getenv("RATE_LIMIT_LOCAL_MAX_KEYS", 100000))
+RATE_LIMITS = json.loads(
+    os.getenv(
+        "RATE_LIMITS",
+        json.dumps(
+            {
+                "login": {"ip": "30/min", "user": "10/min"},
+                "otp": {"ip": "120/min", "user": "60/min"},
+                "otp_send": {"ip": "30/min", "user": "5/min"},
+                "face": {"ip": "30/min", "user": "10/min"},
+            }
+        ),
+    )
+)
+
+# Email OTPs (users/otp.py): codes change every OTP_INTERVAL seconds and are
+# accepted up to OTP_VALID_WINDOW intervals early or late, once each.
+# OTP_MAX_FAILURES wrong codes in a row lock OTP checks for OTP_LOCKOUT seconds
+OTP_INTERVAL = int(os.getenv("OTP_INTERVAL", 30))
+OTP_VALID_WINDOW = int(os.getenv("OTP_VALID_WINDOW", 2))  # Codes last 60-90s
+OTP_MAX_FAILURES = int(os.getenv("OTP_MAX_FAILURES", 5))
+OTP_LOCKOUT = int(os.getenv("OTP_LOCKOUT", 900))  # Seconds
+
+# Vault unlock tokens (users/vault_session.py), issued after an OTP or Face ID
+# check and sent back in the X-Vault-Token header to skip further OTPs
+VAULT_TOKEN_LIFETIME = int(os.getenv("VAULT_TOKEN_LIFETIME", 300))  # Seconds
+
+# Async views (users/async_views.py) for login, OTP email, vault listing and
+# Face ID, used when serving password_manager.asgi under uvicorn
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "False") == "True"
+
+# Authentication caches (users/authentication.py): validated access tokens and
+# their users are kept per process for JWT_CACHE_TTL seconds. Read-only views
+# that only need the user's id get a user built from the token claims
+# (JWT_LEAN_USERS)
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", 10000))
+JWT_CACHE_TTL = int(os.getenv("JWT_CACHE_TTL", 60))  # Seconds
+JWT_LEAN_USERS = os.getenv("JWT_LEAN_USERS", "True") == "True"
+
+# Face encoding backend (users/face_backends.py): "inprocess" uses the face
+# pool above, "remote" a run_face_worker service at FACE_BACKEND_URL
+# ("http://host:port" or "unix:///path/to/socket")
+FACE_BACKEND = os.getenv("FACE_BACKEND", "inprocess")
+FACE_BACKEND_URL = os.getenv("FACE_BACKEND_URL", "http://127.0.0.1:8765")
+FACE_BACKEND_TIMEOUT = float(os.getenv("FACE_BACKEND_TIMEOUT", 15))  # Seconds
+FACE_WORKER_TOKEN = os.getenv("FACE_WORKER_TOKEN", "")  # Shared bearer token
+# run_face_worker closes a batch after this many frames or seconds
+FACE_WORKER_BATCH_SIZE = int(os.getenv("FACE_WORKER_BATCH_SIZE", 8))
+FACE_WORKER_BATCH_WAIT = float(os.getenv("FACE_WORKER_BATCH_WAIT", 0.01))
@@ -20,6 +20,7 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from users.views import ApiRootView
+from users.metrics import metrics_view
 from . import views  # Import home view
 from rest_framework_simplejwt.views import TokenRefreshView
 
@@ -38,6 +39,8 @@ urlpatterns = [
     # Home route (for your non-API view)
     path("", views.home, name="home"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
+    # Prometheus scrape endpoint
+    path("metrics", metrics_view, name="metrics"),
     path(
         "", include(router.urls)
     ),  # Automatically lists all registered APIs from viewsets
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'password_manager.settings')
 
 application = get_wsgi_application()
+
+# Start the face recognition workers at boot when FACE_POOL_PREWARM is set
+# (only with the in-process FACE_BACKEND)
+from users import face_backends  # noqa: E402
+
+face_backends.prewarm()
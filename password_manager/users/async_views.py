@@ -0,0 +1,319 @@
+import asyncio
+import json
+import logging
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password, verify_password
+from django.db.models.functions import Lower
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views import View
+from rest_framework.request import Request
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import face_backends, metrics
+from .authentication import CachedJWTAuthentication
+from .face import FaceDetectionError, face_distances, reduce_distances
+from .face_backends import FaceBackendError
+from .face_pool import FacePoolBusy
+from .face_templates import get_template_matrix
+from .imaging import MaxSizeUploadHandler
+from .instrumentation import query_budget
+from .mail import aqueue_mail
+from .models import Password
+from .otp import acurrent_otp, averify_otp, code_lifetime
+from .pagination import VaultCursorPagination
+from .ratelimit import RateLimitThrottle, account_key, check_limits
+from .serializers import PasswordSerializer
+from .streaming import async_ndjson_response
+from .vault_crypto import decrypt_many
+from .vault_session import VAULT_TOKEN_HEADER, has_vault_access, issue_vault_token
+
+# Async versions of the I/O-bound endpoints, served instead of the DRF views
+# when ASYNC_VIEWS is on (see users/urls.py). DRF's APIView runs synchronously,
+# so these are plain Django views: they authenticate, throttle and answer in
+# the same shapes as their DRF counterparts, and hand blocking work (password
+# hashing, dlib, DRF pagination) to threads or the face pool.
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+_jwt = CachedJWTAuthentication()
+
+
+async def aauthenticate(request):
+    """Async JWTAuthentication: the user for the bearer token, or None without one.
+
+    Shares the token and user caches of the DRF views. Raises InvalidToken or
+    AuthenticationFailed like JWTAuthentication does.
+    """
+    header = _jwt.get_header(request)
+    if header is None:
+        return None
+    raw_token = _jwt.get_raw_token(header)
+    if raw_token is None:
+        return None
+    return await _jwt.aget_user(_jwt.get_validated_token(raw_token))
+
+
+def error_response(detail, status, **kwargs):
+    return JsonResponse({"error": detail}, status=status, **kwargs)
+
+
+class AsyncAPIView(View):
+    """Authentication and rate limiting for the async views.
+
+    Set authenticated = False for views open to anonymous clients and
+    throttle_scope to a RATE_LIMITS key, as on the DRF views.
+    """
+
+    authenticated = True
+    throttle_scope = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True  # Token authenticated, like the DRF views
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        if self.authenticated:
+            try:
+                user = await aauthenticate(request)
+            except (InvalidToken, AuthenticationFailed) as e:
+                # Same body as DRF's 401 for these exceptions
+                detail = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+                return JsonResponse(detail, status=401)
+            if user is None:
+                return JsonResponse(
+                    {"detail": "Authentication credentials were not provided."},
+                    status=401,
+                )
+            request.user = user
+
+        if self.throttle_scope:
+            retry_after = await self.check_throttle(request)
+            if retry_after:
+                wait = math.ceil(retry_after)
+                return JsonResponse(
+                    {
+                        "detail": "Request was throttled. "
+                        f"Expected available in {wait} seconds."
+                    },
+                    status=429,
+                    headers={"Retry-After": str(wait)},
+                )
+        return await super().dispatch(request, *args, **kwargs)
+
+    async def check_throttle(self, request):
+        ip = RateLimitThrottle().get_ident(request)
+        account = self.get_account(request)
+        if settings.RATE_LIMIT_STORE == "redis":
+            # The Redis round trip would block the event loop
+            return await asyncio.to_thread(check_limits, self.throttle_scope, ip, account)
+        return check_limits(self.throttle_scope, ip, account)
+
+    def get_account(self, request):
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return account_key(user=user)
+        return None
+
+    def get_data(self, request):
+        # JSON bodies, or form data as DRF's parsers would accept
+        if request.content_type == "application/json":
+            try:
+                data = json.loads(request.body or b"{}")
+            except ValueError:
+                return {}
+            return data if isinstance(data, dict) else {}
+        return request.POST
+
+
+@query_budget(2)
+class AsyncLoginView(AsyncAPIView):
+    authenticated = False
+    throttle_scope = "login"
+
+    def get_account(self, request):
+        return account_key(email=self.get_data(request).get("email"))
+
+    async def post(self, request):
+        data = self.get_data(request)
+        email = data.get("email") or ""
+        email = email.strip().lower() if isinstance(email, str) else ""
+        password = data.get("password")
+
+        if not email or not password:
+            metrics.LOGIN_ATTEMPTS.labels("missing_fields").inc()
+            return error_response("Email and Password are required!", 400)
+
+        user = (
+            await User.objects.alias(email_lower=Lower("email"))
+            .filter(email_lower=email)
+            .afirst()
+        )
+
+        # Hashing is CPU bound and releases the GIL; keep it off the event loop
+        with metrics.LOGIN_PASSWORD_CHECK_SECONDS.time():
+            if user is None:
+                await asyncio.to_thread(make_password, password)
+                password_valid = False
+            else:
+                password_valid, must_update = await asyncio.to_thread(
+                    verify_password, password, user.password
+                )
+                if password_valid and must_update:
+                    await asyncio.to_thread(user.set_password, password)
+                    await user.asave(update_fields=["password"])
+        if not password_valid:
+            metrics.LOGIN_ATTEMPTS.labels("invalid_credentials").inc()
+            return error_response("Invalid credentials!", 400)
+
+        metrics.LOGIN_ATTEMPTS.labels("success").inc()
+
+        refresh = RefreshToken.for_user(user)
+        return JsonResponse(
+            {
+                "message": "Login successful!",
+                "token": str(refresh.access_token),
+                "refresh": str(refresh),
+                "token_expires_in": refresh.access_token.payload["exp"],
+                "user": {
+                    "id": user.id,
+                    "username": user.username,
+                    "email": user.email,
+                },
+            }
+        )
+
+
+@query_budget(3)
+class AsyncSendOtpEmailView(AsyncAPIView):
+    throttle_scope = "otp_send"
+
+    async def get(self, request, *args, **kwargs):
+        user = request.user
+        try:
+            generated_otp = await acurrent_otp(user)
+            delivery = await aqueue_mail(
+                "Your OTP for Password Access",
+                f"Your OTP for accessing your passwords is: {generated_otp}",
+                user.email,
+                user=user,
+                expires_at=timezone.now() + code_lifetime(),
+            )
+        except Exception as e:
+            return error_response(str(e), 400)
+        metrics.OTP_SENT.inc()
+
+        return JsonResponse(
+            {
+                "message": "OTP is being sent to your email!",
+                "delivery_id": str(delivery.id),
+                "user": {"email": user.email},
+            },
+            status=202,
+        )
+
+
+@query_budget(3)
+class AsyncVerifyOtpView(AsyncAPIView):
+    throttle_scope = "otp"
+
+    async def get(self, request, *args, **kwargs):
+        vault_token = None
+        if not has_vault_access(request):
+            otp = request.GET.get("otp")
+            if not otp:
+                metrics.OTP_VERIFICATIONS.labels("missing").inc()
+                return error_response("OTP is required", 400)
+            outcome = await averify_otp(request.user, otp)
+            metrics.OTP_VERIFICATIONS.labels(outcome).inc()
+            if outcome == "locked":
+                return error_response("Too many invalid OTPs, try again later.", 429)
+            if outcome != "valid":
+                return error_response("Invalid OTP", 400)
+            vault_token = issue_vault_token(request.user, "otp")
+
+        passwords = Password.objects.filter(user=request.user)
+        if request.GET.get("stream", "").lower() in ("1", "true", "ndjson"):
+            response = async_ndjson_response(
+                passwords.order_by("updated_at", "id"),
+                PasswordSerializer(),
+                prepare=sync_to_async(self.decrypt_chunk),
+            )
+        else:
+            response = JsonResponse(await sync_to_async(self.get_page)(request))
+
+        if vault_token is not None:
+            response[VAULT_TOKEN_HEADER] = vault_token
+        return response
+
+    def decrypt_chunk(self, chunk):
+        decrypt_many(chunk, self.request.user)
+
+    def get_page(self, request):
+        # DRF's paginator is synchronous and wants a DRF request
+        paginator = VaultCursorPagination()
+        passwords = Password.objects.filter(user=request.user)
+        page = paginator.paginate_queryset(passwords, Request(request), view=self)
+        decrypt_many(page, request.user)
+        data = PasswordSerializer(page, many=True).data
+        return paginator.get_paginated_response(data).data
+
+
+@query_budget(3)
+class AsyncVerifyFaceId(AsyncAPIView):
+    throttle_scope = "face"
+
+    async def post(self, request, *args, **kwargs):
+        user = request.user
+        request.upload_handlers.insert(
+            0, MaxSizeUploadHandler(request, settings.FACE_UPLOAD_MAX_BYTES)
+        )
+        if "image" not in request.FILES:
+            if getattr(request, "upload_too_large", False):
+                return error_response("Image is too large.", 413)
+            return error_response("No image provided.", 400)
+
+        try:
+            templates = await sync_to_async(get_template_matrix)(user.id)
+            if not len(templates):
+                metrics.FACE_VERIFICATIONS.labels("no_face_id").inc()
+                return error_response("No face ID enrolled.", 404)
+
+            # The event loop keeps serving other requests while dlib runs
+            face_encoding = await face_backends.aencode(request.FILES["image"].read())
+        except FacePoolBusy:
+            metrics.FACE_VERIFICATIONS.labels("busy").inc()
+            return error_response(
+                "Face recognition is busy, please retry shortly.",
+                503,
+                headers={"Retry-After": str(settings.FACE_POOL_RETRY_AFTER)},
+            )
+        except FaceBackendError as e:
+            metrics.FACE_VERIFICATIONS.labels("backend_error").inc()
+            logger.error("Face recognition service error: %s", e)
+            return error_response("Face recognition failed, please try again.", 502)
+        except FaceDetectionError as e:
+            metrics.FACE_VERIFICATIONS.labels("error").inc()
+            return error_response(str(e), 400)
+
+        distances = face_distances(templates, face_encoding)
+        distance = reduce_distances(distances, settings.FACE_MATCH_POLICY)[0]
+        metrics.FACE_DISTANCE.observe(distance)
+
+        if distance <= settings.FACE_MATCH_TOLERANCE:
+            metrics.FACE_VERIFICATIONS.labels("match").inc()
+            response = JsonResponse({"status": True})
+            response[VAULT_TOKEN_HEADER] = issue_vault_token(user, "face")
+            return response
+
+        metrics.FACE_VERIFICATIONS.labels("no_match").inc()
+        return JsonResponse({"status": False}, status=400)
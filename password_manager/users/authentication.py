@@ -0,0 +1,120 @@
+import copy
+import time
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .lru import TTLCache
+
+# Validated access tokens by their raw value, so each token's signature is
+# checked once per TTL instead of on every request
+_tokens = TTLCache(maxsize=settings.JWT_CACHE_SIZE, ttl=settings.JWT_CACHE_TTL)
+
+# Users by id, dropped whenever the user is saved or deleted (users/signals.py)
+_users = TTLCache(maxsize=settings.JWT_CACHE_SIZE, ttl=settings.JWT_CACHE_TTL)
+
+
+def forget_user(user_id):
+    """Drop the cached user, e.g. after its row was changed with update()."""
+    _users.delete(str(user_id))
+
+
+def clear_caches():
+    _tokens.clear()
+    _users.clear()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication with process-local caches for tokens and users.
+
+    A cached user still goes through the is_active and revoked token checks,
+    and each request gets its own copy of it. Views with lean_user = True
+    only need the user's id: when the user isn't cached, their read-only
+    requests get a TokenUser built from the token's claims, without a query.
+    Writes always load the user, so a deactivated user can't change data.
+    """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+
+        view = (getattr(request, "parser_context", None) or {}).get("view")
+        if (
+            settings.JWT_LEAN_USERS
+            and getattr(view, "lean_user", False)
+            and request.method in SAFE_METHODS
+        ):
+            return self.get_lean_user(validated_token), validated_token
+        return self.get_user(validated_token), validated_token
+
+    def get_validated_token(self, raw_token):
+        validated_token = _tokens.get(raw_token)
+        if validated_token is None:
+            validated_token = super().get_validated_token(raw_token)
+            # Never serve a token from the cache past its expiry
+            ttl = min(_tokens.ttl, validated_token["exp"] - time.time())
+            if ttl > 0:
+                _tokens.set(raw_token, validated_token, ttl=ttl)
+        return validated_token
+
+    def get_user_id(self, validated_token):
+        try:
+            return str(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+    def check_user(self, user, validated_token):
+        # The checks JWTAuthentication.get_user() makes on a freshly fetched user
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(
+                "The user's password has been changed.", code="password_changed"
+            )
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        user = _users.get(user_id)
+        if user is None:
+            try:
+                user = self.user_model.objects.get(
+                    **{api_settings.USER_ID_FIELD: user_id}
+                )
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed("User not found", code="user_not_found")
+            _users.set(user_id, user)
+        self.check_user(user, validated_token)
+        return copy.copy(user)  # Views may change attributes of request.user
+
+    async def aget_user(self, validated_token):
+        """Async get_user(), for the async views."""
+        user_id = self.get_user_id(validated_token)
+        user = _users.get(user_id)
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(
+                    **{api_settings.USER_ID_FIELD: user_id}
+                )
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed("User not found", code="user_not_found")
+            _users.set(user_id, user)
+        self.check_user(user, validated_token)
+        return copy.copy(user)
+
+    def get_lean_user(self, validated_token):
+        user = _users.get(self.get_user_id(validated_token))
+        if user is not None:
+            self.check_user(user, validated_token)
+            return copy.copy(user)
+        return api_settings.TOKEN_USER_CLASS(validated_token)
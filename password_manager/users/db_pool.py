@@ -0,0 +1,39 @@
+from django.db import connections
+
+from .tenancy import DEFAULT_SCHEMA, resolve_schema
+
+
+def is_pooled(connection):
+    return connection.vendor == "postgresql" and bool(
+        connection.settings_dict.get("OPTIONS", {}).get("pool")
+    )
+
+
+def pool_stats(alias="default"):
+    """Return psycopg_pool statistics for this process, or None without a pool.
+
+    Includes checkout counts (requests_num), time spent waiting for a
+    connection (requests_wait_ms) and the current pool size.
+    """
+    connection = connections[alias]
+    if not is_pooled(connection):
+        return None
+    return connection.pool.get_stats()
+
+
+def set_tenant_search_path(sender, connection, **kwargs):
+    """Point a freshly checked-out pooled connection at the request's schema.
+
+    Connected to connection_created, which the pool fires on every checkout;
+    password_manager.db.reset_search_path undoes it when the connection goes
+    back to the pool.
+    """
+    if not is_pooled(connection):
+        return
+    schema_name = resolve_schema()
+    if schema_name == DEFAULT_SCHEMA:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SET search_path TO {connection.ops.quote_name(schema_name)}, public"
+        )
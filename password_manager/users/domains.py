@@ -0,0 +1,45 @@
+import ipaddress
+from urllib.parse import urlsplit
+
+import tldextract
+
+# Registrable domains come from the Public Suffix List snapshot bundled with
+# tldextract, never fetched at runtime. The private section is included, so
+# tenants of shared hosts (victim.vercel.app, attacker.vercel.app) count as
+# different sites and never share autofill entries.
+_extract = tldextract.TLDExtract(
+    cache_dir=None, suffix_list_urls=(), include_psl_private_domains=True
+)
+
+
+def hostname_of(value):
+    """Return the lowercased host of a URL or bare host name, or ""."""
+    value = (value or "").strip()
+    if not value:
+        return ""
+    if "//" not in value:
+        value = f"//{value}"  # Let urlsplit treat a bare host as the netloc
+    try:
+        host = urlsplit(value).hostname or ""
+    except ValueError:
+        return ""
+    return host.rstrip(".")
+
+
+def registrable_domain(value):
+    """Reduce a URL or host to the domain a user registers, e.g. example.co.uk.
+
+    IP addresses, single-label hosts (localhost) and hosts with no known
+    public suffix are returned unchanged.
+    """
+    host = hostname_of(value)
+    if not host:
+        return ""
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        pass
+    else:
+        return host
+
+    return _extract(host).top_domain_under_public_suffix or host
@@ -0,0 +1,193 @@
+import io
+from functools import lru_cache
+
+import numpy as np
+
+# cv2 and face_recognition (which loads the dlib models) are imported inside
+# the functions that use them: only the face pool workers, or the web process
+# when FACE_POOL_WORKERS = 0, pay for them, and only once a face is processed.
+
+# Face encodings are stored as raw float32 bytes (128 * 4 = 512 bytes)
+ENCODING_DTYPE = np.float32
+ENCODING_SIZE = 128
+
+# Haar Cascade used for the cheap pre-detection stage, in cv2.data.haarcascades
+CASCADE_FILE = "haarcascade_frontalface_default.xml"
+
+# Extra context kept around the detected face when cropping, as a share of its height
+CROP_MARGIN = 0.25
+
+# Faces taller than this (in pixels) are shrunk before encoding
+FACE_CROP_MAX_HEIGHT = 400
+
+
+class FaceDetectionError(Exception):
+    """Raised when an image does not contain exactly one usable face."""
+
+
+class NoFaceFound(FaceDetectionError):
+    def __init__(self, message="No face detected in image."):
+        super().__init__(message)
+
+
+class MultipleFacesFound(FaceDetectionError):
+    def __init__(self, message="More than one face detected in image."):
+        super().__init__(message)
+
+
+class UnreadableImage(FaceDetectionError):
+    def __init__(self, message="Uploaded file is not a valid image."):
+        super().__init__(message)
+
+
+@lru_cache(maxsize=None)
+def get_face_cascade():
+    # Loaded once per process, on first use
+    import cv2
+
+    return cv2.CascadeClassifier(cv2.data.haarcascades + CASCADE_FILE)
+
+
+def _downscale(image, max_edge):
+    """Shrink an image so its longest edge is at most max_edge; return (image, scale)."""
+    height, width = image.shape[:2]
+    scale = min(1.0, max_edge / max(height, width))
+    if scale == 1.0:
+        return image, scale
+    import cv2
+
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+
+def _detect_haar(image):
+    import cv2
+
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    # Pad the frame so close-up selfies, where the face touches the edges, still match
+    pad = max(gray.shape) // 4
+    gray = cv2.copyMakeBorder(gray, pad, pad, pad, pad, cv2.BORDER_REPLICATE)
+    faces = get_face_cascade().detectMultiScale(
+        gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)
+    )
+    return [(y - pad, x + w - pad, y + h - pad, x - pad) for (x, y, w, h) in faces]
+
+
+def _detect_hog(image):
+    import face_recognition
+
+    return face_recognition.face_locations(image)
+
+
+# Detectors return (top, right, bottom, left) boxes like face_recognition does
+DETECTORS = {
+    "haar": _detect_haar,
+    "hog": _detect_hog,
+}
+
+
+def locate_face(image, detector="haar", max_edge=640):
+    """Find the single face in an RGB image using a downscaled copy.
+
+    Returns its (top, right, bottom, left) box in full-resolution coordinates.
+    """
+    small, scale = _downscale(image, max_edge)
+    locations = DETECTORS[detector](small)
+    if not locations:
+        raise NoFaceFound()
+    if len(locations) > 1:
+        raise MultipleFacesFound()
+
+    height, width = image.shape[:2]
+    top, right, bottom, left = (round(v / scale) for v in locations[0])
+    return max(0, top), min(width, right), min(height, bottom), max(0, left)
+
+
+def encode_face(file, detector="haar", max_edge=640):
+    """Return the encoding of the single face in an image file.
+
+    The face is found on a downscaled copy first, so dlib only sees a crop
+    around it and never runs its own detector on the full frame.
+    """
+    import face_recognition
+    from PIL import Image
+
+    try:
+        image = face_recognition.load_image_file(file)
+    except (OSError, Image.DecompressionBombError):  # OSError includes UnidentifiedImageError
+        raise UnreadableImage()
+    top, right, bottom, left = locate_face(image, detector, max_edge)
+
+    margin = round((bottom - top) * CROP_MARGIN)
+    crop_top, crop_left = max(0, top - margin), max(0, left - margin)
+    crop = image[crop_top : bottom + margin, crop_left : right + margin]
+
+    location = (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+
+    # dlib aligns the face to a 150px chip, so a huge crop only costs time
+    crop, scale = _downscale(crop, round(FACE_CROP_MAX_HEIGHT * (1 + 2 * CROP_MARGIN)))
+    location = tuple(round(v * scale) for v in location)
+    return face_recognition.face_encodings(crop, known_face_locations=[location])[0]
+
+
+def encode_face_bytes(data, **options):
+    """Encode the face in raw image bytes. Runs inside face_pool workers."""
+    return encode_face(io.BytesIO(data), **options)
+
+
+def encode_faces_bytes(frames, **options):
+    """Encode several probe frames in one worker call.
+
+    Returns one (encoding, error message) pair per frame, so a frame without
+    a usable face doesn't fail the whole batch.
+    """
+    results = []
+    for data in frames:
+        try:
+            results.append((encode_face_bytes(data, **options), None))
+        except FaceDetectionError as e:
+            results.append((None, str(e)))
+    return results
+
+
+def face_distances(known, probes):
+    """Euclidean distances between every probe and every known encoding.
+
+    known is a (templates, 128) or (128,) array and probes a (frames, 128)
+    array; the result is a (frames, templates) matrix computed in one pass.
+    """
+    known = np.atleast_2d(np.asarray(known, dtype=ENCODING_DTYPE))
+    probes = np.atleast_2d(np.asarray(probes, dtype=ENCODING_DTYPE))
+    return np.linalg.norm(probes[:, None, :] - known[None, :, :], axis=2)
+
+
+def reduce_distances(distances, policy="min"):
+    """Collapse a (frames, templates) distance matrix to one distance per frame.
+
+    "min" matches against the closest enrolled template, "mean" against all
+    of them on average.
+    """
+    if policy == "mean":
+        return distances.mean(axis=1)
+    return distances.min(axis=1)
+
+
+def warm_up():
+    """Load the dlib models and the Haar cascade in the current process."""
+    import face_recognition  # noqa: F401
+
+    get_face_cascade()
+    return True
+
+
+def encoding_to_bytes(encoding):
+    """Serialize a face encoding for the Image.encoding column."""
+    return np.asarray(encoding, dtype=ENCODING_DTYPE).tobytes()
+
+
+def encoding_from_bytes(data):
+    """Load a face encoding stored with encoding_to_bytes."""
+    encoding = np.frombuffer(bytes(data), dtype=ENCODING_DTYPE)
+    if encoding.shape != (ENCODING_SIZE,):
+        raise ValueError("Stored face encoding has an unexpected size.")
+    return encoding
@@ -0,0 +1,199 @@
+import abc
+import asyncio
+import base64
+import http.client
+import json
+import socket
+import threading
+from functools import lru_cache
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+
+from . import face, face_pool, metrics
+from .face_pool import FacePoolBusy
+from .face_worker import ENCODE_PATH, FRAME_SIZES_HEADER
+from .instrumentation import timed
+
+# Where face images are encoded, chosen with FACE_BACKEND:
+#   "inprocess": the face pool of this process (users/face_pool.py)
+#   "remote":    a run_face_worker service at FACE_BACKEND_URL, so API and
+#                vision workers can be scaled separately
+# Both raise FacePoolBusy when no encoding can be had in time, and
+# FaceDetectionError when an image has no usable face. The remote backend
+# raises FaceBackendError when the service rejects a request or fails.
+
+
+class FaceBackendError(Exception):
+    """Raised when the face recognition service answers with an error."""
+
+
+class FaceBackend(abc.ABC):
+    @abc.abstractmethod
+    def encode(self, data):
+        """Return the encoding of the single face in raw image bytes."""
+
+    @abc.abstractmethod
+    def encode_many(self, frames):
+        """Return one (encoding, error message) pair per raw image."""
+
+    async def aencode(self, data):
+        return await asyncio.to_thread(self.encode, data)
+
+    def prewarm(self):
+        pass
+
+
+class InProcessFaceBackend(FaceBackend):
+    def encode(self, data):
+        return face_pool.run(
+            face.encode_face_bytes, data, **face_pool.detector_options()
+        )
+
+    def encode_many(self, frames):
+        return face_pool.run(
+            face.encode_faces_bytes, frames, **face_pool.detector_options()
+        )
+
+    async def aencode(self, data):
+        return await face_pool.arun(
+            face.encode_face_bytes, data, **face_pool.detector_options()
+        )
+
+    def prewarm(self):
+        face_pool.prewarm()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class RemoteFaceBackend(FaceBackend):
+    """Encode faces in a run_face_worker service over HTTP or a unix socket.
+
+    url is "http://host:port" or "unix:///path/to/socket". Each thread keeps
+    one keep-alive connection to the service.
+    """
+
+    def __init__(self, url, timeout, token=""):
+        self.url = urlsplit(url)
+        self.timeout = timeout
+        self.token = token
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self.url.scheme == "unix":
+                connection = UnixHTTPConnection(self.url.path, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(
+                    self.url.hostname, self.url.port or 80, timeout=self.timeout
+                )
+            self._local.connection = connection
+        return connection
+
+    def _post(self, frames):
+        path = f"{ENCODE_PATH}?{urlencode(face_pool.detector_options())}"
+        headers = {
+            FRAME_SIZES_HEADER: ",".join(str(len(data)) for data in frames),
+            "Content-Type": "application/octet-stream",
+        }
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        body = b"".join(frames)
+
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request("POST", path, body=body, headers=headers)
+                response = connection.getresponse()
+                payload = response.read()
+                break
+            except (
+                http.client.RemoteDisconnected,
+                ConnectionResetError,
+                BrokenPipeError,
+            ):
+                # The worker closed an idle keep-alive connection; retry once
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise FacePoolBusy("Face recognition service is unavailable.")
+            except OSError:  # Refused, timed out, no such socket
+                connection.close()
+                self._local.connection = None
+                raise FacePoolBusy("Face recognition service is unavailable.")
+
+        if response.status in (429, 503):
+            raise FacePoolBusy("Face recognition is busy.")
+        if response.status != 200:
+            try:
+                error = json.loads(payload)["error"]
+            except (ValueError, KeyError, TypeError):
+                error = "no details"
+            raise FaceBackendError(
+                f"Face recognition service answered {response.status}: {error}"
+            )
+
+        return [
+            (
+                face.encoding_from_bytes(base64.b64decode(result["encoding"])),
+                None,
+            )
+            if "encoding" in result
+            else (None, result["error"])
+            for result in json.loads(payload)["results"]
+        ]
+
+    def encode(self, data):
+        with timed("face"):
+            encoding, error = self._post([data])[0]
+        if error is not None:
+            raise face.FaceDetectionError(error)
+        return encoding
+
+    def encode_many(self, frames):
+        with timed("face"):
+            return self._post(frames)
+
+
+@lru_cache(maxsize=1)
+def get_backend():
+    if settings.FACE_BACKEND == "remote":
+        return RemoteFaceBackend(
+            settings.FACE_BACKEND_URL,
+            timeout=settings.FACE_BACKEND_TIMEOUT,
+            token=settings.FACE_WORKER_TOKEN,
+        )
+    return InProcessFaceBackend()
+
+
+def encode(data):
+    """Encode the single face in raw image bytes with the configured backend."""
+    with metrics.FACE_ENCODE_SECONDS.labels("encode").time():
+        return get_backend().encode(data)
+
+
+def encode_many(frames):
+    """Encode a list of raw images in one backend call."""
+    with metrics.FACE_ENCODE_SECONDS.labels("encode_many").time():
+        return get_backend().encode_many(frames)
+
+
+async def aencode(data):
+    """Async encode()."""
+    with metrics.FACE_ENCODE_SECONDS.labels("encode").time():
+        return await get_backend().aencode(data)
+
+
+def prewarm():
+    get_backend().prewarm()
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from . import face
+from .instrumentation import timed
+
+
+class FacePoolBusy(Exception):
+    """Raised when the face recognition pool cannot take or finish a job in time."""
+
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_slots = None
+
+
+def _create_pool():
+    workers = settings.FACE_POOL_WORKERS
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(settings.FACE_POOL_START_METHOD),
+        initializer=face.warm_up,
+    )
+    # Running jobs plus waiting jobs; anything beyond this is turned away
+    slots = threading.BoundedSemaphore(workers + settings.FACE_POOL_MAX_QUEUE)
+    return pool, slots
+
+
+def get_pool():
+    """Return this process's executor, creating it on first use (or after a fork)."""
+    global _pool, _pool_pid, _slots
+
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool, _slots = _create_pool()
+            _pool_pid = os.getpid()
+        return _pool, _slots
+
+
+def reset_pool():
+    """Drop the current executor, e.g. after a worker process died."""
+    global _pool, _pool_pid, _slots
+
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = _pool_pid = _slots = None
+
+
+def prewarm(force=False):
+    """Start every worker now so the first verification doesn't pay for model loading."""
+    if not (force or settings.FACE_POOL_PREWARM) or settings.FACE_POOL_WORKERS <= 0:
+        return
+    pool, _ = get_pool()
+    for _ in range(settings.FACE_POOL_WORKERS):
+        pool.submit(face.warm_up)
+
+
+def run(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) in the face recognition pool and return its result.
+
+    With FACE_POOL_WORKERS = 0 the call runs inline, which is handy for
+    development and management commands.
+    """
+    with timed("face"):
+        return _run(fn, *args, **kwargs)
+
+
+def _run(fn, *args, **kwargs):
+    if settings.FACE_POOL_WORKERS <= 0:
+        return fn(*args, **kwargs)
+
+    pool, slots = get_pool()
+    if not slots.acquire(timeout=settings.FACE_POOL_QUEUE_TIMEOUT):
+        raise FacePoolBusy("Face recognition pool is saturated.")
+    future = _submit(pool, slots, fn, *args, **kwargs)
+
+    try:
+        return future.result(timeout=settings.FACE_POOL_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise FacePoolBusy("Face recognition timed out.")
+    except BrokenProcessPool:
+        reset_pool()
+        raise FacePoolBusy("Face recognition pool is restarting.")
+
+
+def _submit(pool, slots, fn, *args, **kwargs):
+    # The caller holds a slot; it is given back once the job is done
+    try:
+        future = pool.submit(fn, *args, **kwargs)
+    except (BrokenProcessPool, RuntimeError):
+        slots.release()
+        reset_pool()
+        raise FacePoolBusy("Face recognition pool is restarting.")
+    future.add_done_callback(lambda f: slots.release())
+    return future
+
+
+async def arun(fn, *args, **kwargs):
+    """Async run(): awaits the worker without tying up a thread meanwhile."""
+    with timed("face"):
+        if settings.FACE_POOL_WORKERS <= 0:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+        pool, slots = get_pool()
+        deadline = time.monotonic() + settings.FACE_POOL_QUEUE_TIMEOUT
+        while not slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                raise FacePoolBusy("Face recognition pool is saturated.")
+            await asyncio.sleep(0.05)
+        future = _submit(pool, slots, fn, *args, **kwargs)
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), settings.FACE_POOL_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise FacePoolBusy("Face recognition timed out.")
+        except BrokenProcessPool:
+            reset_pool()
+            raise FacePoolBusy("Face recognition pool is restarting.")
+
+
+def detector_options():
+    # Worker processes don't read Django settings, so options travel with each job
+    return {
+        "detector": settings.FACE_DETECTOR,
+        "max_edge": settings.FACE_DETECT_MAX_EDGE,
+    }
+
@@ -0,0 +1,48 @@
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .face import ENCODING_DTYPE, ENCODING_SIZE, FaceDetectionError, encoding_from_bytes
+from .models import Image
+
+
+def _cache_key(user_id):
+    # Adding or deleting an image changes the count or the highest id, so a
+    # changed set of templates is never read from a stale entry, whichever
+    # process (and local cache) the change was made in
+    version = Image.objects.filter(user_id=user_id).aggregate(
+        count=Count("id"), last=Max("id")
+    )
+    return f"face_templates:{user_id}:{version['count']}:{version['last']}"
+
+
+def get_template_matrix(user_id):
+    """Return every enrolled encoding of a user as one (templates, 128) float32 matrix.
+
+    The matrix is cached as raw bytes under a key that changes whenever an
+    image of the user is added or removed.
+    """
+    key = _cache_key(user_id)
+    data = cache.get(key)
+    if data is None:
+        data = _build_template_matrix(user_id).tobytes()
+        cache.set(key, data, settings.FACE_TEMPLATE_CACHE_TIMEOUT)
+    return np.frombuffer(data, dtype=ENCODING_DTYPE).reshape(-1, ENCODING_SIZE)
+
+
+def _build_template_matrix(user_id):
+    encodings = []
+    for image in Image.objects.filter(user_id=user_id).order_by("id"):
+        if image.encoding:
+            encodings.append(encoding_from_bytes(image.encoding))
+            continue
+        # Images enrolled before encodings were stored
+        try:
+            encodings.append(image.get_encoding())
+        except FaceDetectionError:
+            continue
+
+    if not encodings:
+        return np.empty((0, ENCODING_SIZE), dtype=ENCODING_DTYPE)
+    return np.ascontiguousarray(np.stack(encodings), dtype=ENCODING_DTYPE)
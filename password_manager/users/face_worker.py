@@ -0,0 +1,262 @@
+import base64
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+from . import face, face_pool
+from .face_pool import FacePoolBusy
+
+logger = logging.getLogger(__name__)
+
+# The face worker service (run_face_worker) and its wire format, shared with
+# RemoteFaceBackend in users/face_backends.py:
+#   POST /encode?detector=haar&max_edge=640
+#     body: the raw image files, back to back
+#     X-Frame-Sizes: size of each file in bytes, comma separated
+#   -> 200 {"results": [{"encoding": base64 float32 bytes} or {"error": "..."}]}
+#   -> 400 {"error": "..."} for a malformed request
+#   -> 503 with Retry-After when the pool is saturated
+#   -> 500 {"error": "..."} when encoding fails unexpectedly
+#   GET /health -> 200 {"status": "ok"}
+
+ENCODE_PATH = "/encode"
+HEALTH_PATH = "/health"
+FRAME_SIZES_HEADER = "X-Frame-Sizes"
+
+
+class EncodeBatcher:
+    """Collect frames from concurrent requests and encode them in batches.
+
+    A batch is closed after batch_size frames or batch_wait seconds and split
+    into one job per pool worker, so under load the pool gets a few larger
+    jobs instead of one per request, while every worker stays busy. Frames
+    with different detector options never share a job.
+    """
+
+    def __init__(self, batch_size, batch_wait):
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue = queue.Queue()
+        # One thread per job that may run or wait in the pool at a time. Jobs
+        # beyond that are turned away as busy rather than queued without bound
+        jobs = max(1, settings.FACE_POOL_WORKERS) + settings.FACE_POOL_MAX_QUEUE
+        self._slots = threading.BoundedSemaphore(jobs)
+        self._executor = ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix="face-batch"
+        )
+        self._thread = threading.Thread(target=self._collect, daemon=True)
+        self._thread.start()
+
+    def encode(self, frames, options):
+        """Encode frames; returns one (encoding, error message) pair per frame."""
+        key = tuple(sorted(options.items()))
+        futures = []
+        for data in frames:
+            future = Future()
+            self._queue.put((key, data, future))
+            futures.append(future)
+
+        timeout = (
+            self.batch_wait + settings.FACE_POOL_QUEUE_TIMEOUT + settings.FACE_POOL_TIMEOUT
+        )
+        try:
+            return [future.result(timeout=timeout) for future in futures]
+        except FutureTimeoutError:
+            raise FacePoolBusy("Face recognition timed out.")
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            groups = defaultdict(list)
+            for item in batch:
+                groups[item[0]].append(item)
+            for key, items in groups.items():
+                jobs = max(1, min(settings.FACE_POOL_WORKERS, len(items)))
+                for i in range(jobs):
+                    self._submit(dict(key), items[i::jobs])
+
+    def _submit(self, options, items):
+        if not self._slots.acquire(blocking=False):
+            busy = FacePoolBusy("Face recognition pool is saturated.")
+            for _, _, future in items:
+                future.set_exception(busy)
+            return
+        job = self._executor.submit(self._encode_batch, options, items)
+        job.add_done_callback(lambda job: self._slots.release())
+
+    def _encode_batch(self, options, items):
+        try:
+            results = face_pool.run(
+                face.encode_faces_bytes, [data for _, data, _ in items], **options
+            )
+        except FacePoolBusy as e:
+            for _, _, future in items:
+                future.set_exception(e)
+            return
+        except Exception:
+            # The job mixes frames of several requests; encode them one by one
+            # so a frame that breaks the encoder only fails its own request
+            logger.exception("Encoding a job of %d frame(s) failed", len(items))
+            for _, data, future in items:
+                try:
+                    future.set_result(
+                        face_pool.run(face.encode_faces_bytes, [data], **options)[0]
+                    )
+                except Exception as e:
+                    future.set_exception(e)
+            return
+        logger.debug("Encoded a job of %d frame(s)", len(items))
+        for (_, _, future), result in zip(items, results):
+            future.set_result(result)
+
+
+class FaceWorkerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so API workers reuse connections
+
+    def do_GET(self):
+        if urlsplit(self.path).path != HEALTH_PATH:
+            return self.send_json(404, {"error": "Not found."})
+        return self.send_json(200, {"status": "ok", "pid": os.getpid()})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        # Requests turned away before their body is read can't leave the
+        # connection open
+        if url.path != ENCODE_PATH:
+            self.close_connection = True
+            return self.send_json(404, {"error": "Not found."})
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            return self.send_json(400, {"error": "Malformed request."})
+        if length > self.server.max_bytes:
+            self.close_connection = True
+            return self.send_json(413, {"error": "Request is too large."})
+        body = self.rfile.read(length)
+
+        token = self.server.token
+        if token and not constant_time_compare(
+            self.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            return self.send_json(403, {"error": "Invalid token."})
+
+        try:
+            sizes = [
+                int(size)
+                for size in self.headers.get(FRAME_SIZES_HEADER, str(length)).split(",")
+            ]
+            query = parse_qs(url.query)
+            options = {
+                "detector": query.get("detector", [settings.FACE_DETECTOR])[0],
+                "max_edge": int(
+                    query.get("max_edge", [settings.FACE_DETECT_MAX_EDGE])[0]
+                ),
+            }
+        except ValueError:
+            return self.send_json(400, {"error": "Malformed request."})
+        if (
+            sum(sizes) != length
+            or options["detector"] not in face.DETECTORS
+            or options["max_edge"] <= 0
+        ):
+            return self.send_json(400, {"error": "Malformed request."})
+
+        frames, offset = [], 0
+        for size in sizes:
+            frames.append(body[offset : offset + size])
+            offset += size
+
+        try:
+            results = self.server.batcher.encode(frames, options)
+        except FacePoolBusy as e:
+            return self.send_json(
+                503,
+                {"error": str(e)},
+                headers={"Retry-After": str(settings.FACE_POOL_RETRY_AFTER)},
+            )
+        except face.FaceDetectionError as e:
+            return self.send_json(400, {"error": str(e)})
+        except Exception:
+            logger.exception("Face encoding failed")
+            return self.send_json(500, {"error": "Face encoding failed."})
+
+        return self.send_json(
+            200,
+            {
+                "results": [
+                    {"error": error}
+                    if error is not None
+                    else {
+                        "encoding": base64.b64encode(
+                            face.encoding_to_bytes(encoding)
+                        ).decode()
+                    }
+                    for encoding, error in results
+                ]
+            },
+        )
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(batcher, address=None, socket_path=None, token="", verbose=False):
+    """Build the face worker's HTTP server on (host, port) or a unix socket."""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # Left over from an earlier run
+        server = ThreadingUnixHTTPServer(socket_path, FaceWorkerHandler)
+    else:
+        server = ThreadingHTTPServer(address, FaceWorkerHandler)
+    server.batcher = batcher
+    server.token = token
+    server.verbose = verbose
+    server.max_bytes = settings.FACE_UPLOAD_MAX_BYTES * settings.FACE_BATCH_MAX_FRAMES
+    return server
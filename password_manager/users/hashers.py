@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+# Django's hashers with their cost read from settings. The algorithm names
+# are unchanged, so existing hashes still verify, and changing a cost makes
+# must_update() true: the hash is upgraded the next time the user logs in.
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    time_cost = settings.ARGON2_TIME_COST
+    memory_cost = settings.ARGON2_MEMORY_COST  # KiB
+    parallelism = settings.ARGON2_PARALLELISM
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    work_factor = settings.SCRYPT_WORK_FACTOR
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    iterations = settings.PBKDF2_ITERATIONS
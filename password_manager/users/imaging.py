@@ -0,0 +1,74 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from PIL import Image as PILImage, ImageOps, UnidentifiedImageError
+
+# HEIC/HEIF uploads (iPhone cameras) are only readable with pillow-heif installed
+try:
+    from pillow_heif import register_heif_opener
+except ImportError:
+    pass
+else:
+    register_heif_opener()
+
+
+EXTENSIONS = {
+    "JPEG": "jpg",
+    "WEBP": "webp",
+    "PNG": "png",
+}
+
+
+class InvalidImage(ValueError):
+    """Raised when an upload cannot be decoded as an image."""
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """Stop reading a multipart upload as soon as a file grows past max_bytes.
+
+    Sets request.upload_too_large so the view can answer 413 instead of
+    "No image provided.".
+    """
+
+    def __init__(self, request=None, max_bytes=None):
+        super().__init__(request)
+        self.max_bytes = max_bytes
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.max_bytes is not None and start + len(raw_data) > self.max_bytes:
+            self.request.upload_too_large = True
+            raise StopUpload(connection_reset=True)
+        return raw_data  # Let the default handlers store the chunk
+
+    def file_complete(self, file_size):
+        return None
+
+
+def normalize_image(file, max_edge=None, format=None, quality=None):
+    """Decode an uploaded image once and re-encode a compact derivative.
+
+    The result is rotated according to its EXIF orientation, converted to
+    RGB, shrunk to max_edge pixels on its longest side and saved without
+    any metadata. Returns a ContentFile named after the original upload.
+    """
+    max_edge = max_edge or settings.FACE_IMAGE_MAX_EDGE
+    format = (format or settings.FACE_IMAGE_FORMAT).upper()
+    quality = quality or settings.FACE_IMAGE_QUALITY
+
+    try:
+        with PILImage.open(file) as img:
+            # Let JPEG decode at a reduced scale instead of full resolution
+            img.draft("RGB", (max_edge, max_edge))
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            img.thumbnail((max_edge, max_edge), PILImage.LANCZOS)
+    except (UnidentifiedImageError, OSError, PILImage.DecompressionBombError) as e:
+        raise InvalidImage("Uploaded file is not a valid image.") from e
+
+    output = BytesIO()
+    img.save(output, format=format, quality=quality, optimize=True)
+
+    stem = os.path.splitext(os.path.basename(getattr(file, "name", "") or "face"))[0]
+    return ContentFile(output.getvalue(), name=f"{stem}.{EXTENSIONS[format]}")
@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Sections timed besides the database, in Server-Timing order
+SECTIONS = ("face", "email")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in strict mode when a view runs more queries than its budget."""
+
+
+class RequestMetrics:
+    """Counters collected while one request is handled."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.sections = dict.fromkeys(SECTIONS, 0.0)
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+
+_current = ContextVar("request_metrics", default=None)
+
+
+def current_metrics():
+    return _current.get()
+
+
+@contextmanager
+def timed(section):
+    """Add the time spent in the block to the current request's section."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.sections[section] += time.perf_counter() - start
+
+
+def _count_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """connection_created receiver wrapping every connection once.
+
+    The one wrapper counts into whichever request's metrics are current, so
+    async requests sharing the thread-sensitive connection each count only
+    their own queries.
+    """
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def query_budget(limit):
+    """Class decorator setting the most queries a view may run per request."""
+
+    def decorate(view_class):
+        view_class.query_budget = limit
+        return view_class
+
+    return decorate
+
+
+class _ViewStats:
+    # Process-local totals per view, served by RequestMetricsView
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view_name, metrics, total_time):
+        with self._lock:
+            stats = self._views.get(view_name)
+            if stats is None:
+                stats = self._views[view_name] = {
+                    "requests": 0,
+                    "queries": 0,
+                    "max_queries": 0,
+                    "db_ms": 0.0,
+                    "total_ms": 0.0,
+                    **{f"{section}_ms": 0.0 for section in SECTIONS},
+                }
+            stats["requests"] += 1
+            stats["queries"] += metrics.queries
+            stats["max_queries"] = max(stats["max_queries"], metrics.queries)
+            stats["db_ms"] += metrics.db_time * 1000
+            stats["total_ms"] += total_time * 1000
+            for section, seconds in metrics.sections.items():
+                stats[f"{section}_ms"] += seconds * 1000
+
+    def snapshot(self):
+        with self._lock:
+            views = {name: dict(stats) for name, stats in self._views.items()}
+        for stats in views.values():
+            requests = stats["requests"]
+            stats["avg_queries"] = round(stats["queries"] / requests, 2)
+            for key in [key for key in stats if key.endswith("_ms")]:
+                stats[f"avg_{key}"] = round(stats[key] / requests, 3)
+                stats[key] = round(stats[key], 3)
+        return views
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+view_stats = _ViewStats()
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None
+    return match.view_name or match._func_path
+
+
+def _budget_for(request):
+    view_name = _view_name(request)
+    if view_name in settings.QUERY_BUDGETS:
+        return settings.QUERY_BUDGETS[view_name]
+    match = getattr(request, "resolver_match", None)
+    view_class = getattr(getattr(match, "func", None), "view_class", None)
+    return getattr(view_class, "query_budget", None)
+
+
+def server_timing(metrics, total_time):
+    entries = [f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.queries} queries"']
+    entries += [
+        f"{section};dur={seconds * 1000:.2f}"
+        for section, seconds in metrics.sections.items()
+        if seconds
+    ]
+    entries.append(f"total;dur={total_time * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class InstrumentationMiddleware:
+    """Count queries and time the database, face and email work of each request.
+
+    Queries are counted by install_query_counter, which users/signals.py
+    connects to connection_created.
+
+    Adds a Server-Timing header when INSTRUMENTATION_SERVER_TIMING is on and
+    checks the view's query budget (QUERY_BUDGETS, or query_budget on the
+    view class). Work done while a streaming response is consumed happens
+    after the middleware returns and is not counted.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        # Queries run in sync_to_async threads, which copy this context
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        total_time = metrics.total_time
+        view_name = _view_name(request)
+        if view_name is not None:
+            view_stats.record(view_name, metrics, total_time)
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            response["Server-Timing"] = server_timing(metrics, total_time)
+
+        budget = _budget_for(request)
+        if budget is not None and metrics.queries > budget:
+            message = (
+                f"{view_name} ran {metrics.queries} queries, its budget is {budget}."
+            )
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
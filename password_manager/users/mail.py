@@ -0,0 +1,219 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .instrumentation import timed
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def queue_mail(subject, body, to, user=None, from_email=None, expires_at=None):
+    """Store a message for the dispatcher and return it; nothing is sent here.
+
+    The returned OutboundEmail id is the delivery id handed to clients. A
+    message still unsent at expires_at is dropped instead.
+    """
+    with timed("email"):
+        message = OutboundEmail.objects.create(
+            user=user,
+            to=to,
+            from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+            subject=subject,
+            body=body,
+            expires_at=expires_at,
+        )
+    if settings.MAIL_QUEUE_DISPATCH_IN_PROCESS:
+        transaction.on_commit(_dispatcher.wake)
+    return message
+
+
+async def aqueue_mail(subject, body, to, user=None, from_email=None, expires_at=None):
+    """Async queue_mail(), for use outside a transaction."""
+    with timed("email"):
+        message = await OutboundEmail.objects.acreate(
+            user=user,
+            to=to,
+            from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+            subject=subject,
+            body=body,
+            expires_at=expires_at,
+        )
+    if settings.MAIL_QUEUE_DISPATCH_IN_PROCESS:
+        _dispatcher.wake()  # Autocommit: the row is already visible
+    return message
+
+
+def _retry_delay(attempts):
+    delay = settings.MAIL_QUEUE_RETRY_BASE * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.MAIL_QUEUE_RETRY_MAX))
+
+
+def _expire_messages(now):
+    # Mail that can no longer be of use (an expired OTP) is not sent late
+    return OutboundEmail.objects.filter(
+        status__in=[OutboundEmail.STATUS_PENDING, OutboundEmail.STATUS_SENDING],
+        next_attempt_at__lte=now,
+        expires_at__lte=now,
+    ).update(
+        status=OutboundEmail.STATUS_FAILED,
+        body="",
+        last_error="Expired before it could be sent.",
+    )
+
+
+def _claim_messages(batch_size, now):
+    """Mark up to batch_size due messages as sending and return them.
+
+    Row locks are held only while claiming. next_attempt_at becomes the lease:
+    messages left sending past it, by a dispatcher that died mid-batch, are
+    claimed again. Every claim counts as an attempt.
+    """
+    lease = now + timedelta(seconds=settings.MAIL_QUEUE_LEASE)
+    with transaction.atomic():
+        messages = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(
+                status__in=[OutboundEmail.STATUS_PENDING, OutboundEmail.STATUS_SENDING],
+                next_attempt_at__lte=now,
+            )
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=[message.id for message in messages]).update(
+            status=OutboundEmail.STATUS_SENDING,
+            attempts=F("attempts") + 1,
+            next_attempt_at=lease,
+        )
+    for message in messages:
+        message.status = OutboundEmail.STATUS_SENDING
+        message.attempts += 1
+        message.next_attempt_at = lease
+    return messages
+
+
+def _record_outcome(message, **fields):
+    # A no-op if the lease ran out and another dispatcher claimed the message
+    OutboundEmail.objects.filter(
+        id=message.id,
+        status=OutboundEmail.STATUS_SENDING,
+        next_attempt_at=message.next_attempt_at,
+    ).update(**fields)
+
+
+def _record_failure(message, error):
+    now = timezone.now()
+    retry_at = now + _retry_delay(message.attempts)
+    if message.attempts >= settings.MAIL_QUEUE_MAX_ATTEMPTS or (
+        message.expires_at is not None and retry_at >= message.expires_at
+    ):
+        _record_outcome(
+            message,
+            status=OutboundEmail.STATUS_FAILED,
+            body="",
+            last_error=str(error)[:1000],
+        )
+    else:
+        _record_outcome(
+            message,
+            status=OutboundEmail.STATUS_PENDING,
+            next_attempt_at=retry_at,
+            last_error=str(error)[:1000],
+        )
+
+
+def dispatch_queued_mail(batch_size=None):
+    """Send due messages over one backend connection; return how many were sent.
+
+    Messages are claimed in a short transaction (SKIP LOCKED, so several
+    dispatchers can run at once) and sent outside of it. Failed messages are
+    retried with exponential backoff until MAIL_QUEUE_MAX_ATTEMPTS is reached
+    or they expire.
+    """
+    batch_size = batch_size or settings.MAIL_QUEUE_BATCH_SIZE
+    now = timezone.now()
+    _expire_messages(now)
+    messages = _claim_messages(batch_size, now)
+    if not messages:
+        return 0
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        logger.warning("Could not open mail connection: %s", e)
+        for message in messages:
+            _record_failure(message, e)
+        return 0
+
+    sent = 0
+    try:
+        for message in messages:
+            email = EmailMessage(
+                message.subject,
+                message.body,
+                message.from_email,
+                [message.to],
+                connection=connection,
+            )
+            try:
+                email.send()
+            except Exception as e:
+                logger.warning("Sending mail %s failed: %s", message.id, e)
+                metrics.MAIL_DELIVERIES.labels("failed").inc()
+                _record_failure(message, e)
+                continue
+            metrics.MAIL_DELIVERIES.labels("sent").inc()
+
+            _record_outcome(
+                message,
+                status=OutboundEmail.STATUS_SENT,
+                sent_at=timezone.now(),
+                body="",  # Don't keep OTPs around once delivered
+            )
+            sent += 1
+    finally:
+        connection.close()
+
+    return sent
+
+
+class _Dispatcher:
+    """Background thread that drains the queue inside a web worker process."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def wake(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="mail-dispatcher", daemon=True
+                )
+                self._thread.start()
+        self._event.set()
+
+    def _run(self):
+        while True:
+            self._event.wait(timeout=settings.MAIL_QUEUE_POLL_INTERVAL)
+            self._event.clear()
+            close_old_connections()
+            try:
+                # Keep going while full batches come back
+                while dispatch_queued_mail() >= settings.MAIL_QUEUE_BATCH_SIZE:
+                    pass
+            except Exception:
+                logger.exception("Mail dispatcher failed")
+            finally:
+                close_old_connections()
+
+
+_dispatcher = _Dispatcher()
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from users import face_pool
+from users.face import FaceDetectionError, encode_face_bytes, encoding_to_bytes
+from users.models import Image
+
+
+class Command(BaseCommand):
+    help = "Compute and store face encodings for Image rows that do not have one."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Recompute encodings for every image, not only missing ones.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=100,
+            help="Number of rows fetched from the database at a time.",
+        )
+
+    def handle(self, *args, **options):
+        images = Image.objects.only("id", "image", "encoding").order_by("id")
+        if not options["force"]:
+            images = images.filter(encoding__isnull=True)
+
+        encoded = skipped = 0
+        for image in images.iterator(chunk_size=options["chunk_size"]):
+            try:
+                with image.image.open("rb") as file:
+                    data = file.read()
+            except OSError as e:
+                self.stderr.write(f"Image {image.id}: could not be read ({e})")
+                skipped += 1
+                continue
+
+            try:
+                encoding = encode_face_bytes(data, **face_pool.detector_options())
+            except (FaceDetectionError, ValueError) as e:
+                self.stderr.write(f"Image {image.id}: {e}")
+                skipped += 1
+                continue
+
+            image.encoding = encoding_to_bytes(encoding)
+            image.save(update_fields=["encoding"])
+            encoded += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Encoded {encoded} image(s), skipped {skipped}.")
+        )
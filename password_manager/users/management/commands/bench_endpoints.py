@@ -0,0 +1,321 @@
+import itertools
+import json
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from users.face import encode_face_bytes, encoding_to_bytes
+from users.face_pool import detector_options
+from users.models import CustomUser, Image, Password
+from users.otp import current_otp
+from users.tenancy import schema_name_for
+
+BENCH_PREFIX = "bench_"
+BENCH_PASSWORD = "bench-Pa55word!"
+
+ENDPOINTS = [
+    "signup",
+    "login",
+    "me",
+    "add_password",
+    "verify_otp",
+    "send_otp_email",
+    "image_upload",
+    "verify_face_id",
+]
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile; good enough for latency reporting
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(timings, errors, wall):
+    timings = sorted(timings)
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "p50_ms": round(percentile(timings, 50), 2),
+        "p95_ms": round(percentile(timings, 95), 2),
+        "p99_ms": round(percentile(timings, 99), 2),
+        "mean_ms": round(statistics.fmean(timings), 2),
+        "throughput_rps": round(len(timings) / wall, 2) if wall else None,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the users endpoints with concurrent requests and report latency "
+        "percentiles and throughput as JSON. Seeds its own bench_* users and "
+        "removes them afterwards. Queued mail is not dispatched during the run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10, help="Seeded users.")
+        parser.add_argument(
+            "--vault-size", type=int, default=100, help="Passwords per seeded user."
+        )
+        parser.add_argument(
+            "--requests", type=int, default=50, help="Requests per endpoint."
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=4, help="Client threads per endpoint."
+        )
+        parser.add_argument(
+            "--endpoints",
+            default=",".join(ENDPOINTS),
+            help=f"Comma separated subset of: {', '.join(ENDPOINTS)}.",
+        )
+        parser.add_argument(
+            "--face-image",
+            default=None,
+            help="Image with one face, used for the face endpoints "
+            "(defaults to the first image in MEDIA_ROOT/images).",
+        )
+        parser.add_argument("--output", default=None, help="Also write JSON here.")
+        parser.add_argument(
+            "--keep", action="store_true", help="Keep the seeded users afterwards."
+        )
+
+    def handle(self, *args, **options):
+        endpoints = [name for name in options["endpoints"].split(",") if name]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+        if options["users"] < options["concurrency"]:
+            # Each client thread needs users of its own, see bench()
+            raise CommandError("--users must be at least --concurrency.")
+
+        face_endpoints = {"image_upload", "verify_face_id"} & set(endpoints)
+        self.face_image = self.load_face_image(options["face_image"]) if face_endpoints else None
+
+        with override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+            RATE_LIMIT_ENABLED=False,
+            # A dispatcher thread would compete with the clients for the database
+            MAIL_QUEUE_DISPATCH_IN_PROCESS=False,
+        ):
+            self.run_id = uuid.uuid4().hex[:8]
+            try:
+                self.users = self.seed(options)
+                results = {
+                    "config": {
+                        "database": connection.vendor,
+                        "users": options["users"],
+                        "vault_size": options["vault_size"],
+                        "requests": options["requests"],
+                        "concurrency": options["concurrency"],
+                    },
+                    "endpoints": {
+                        name: self.bench(name, options["requests"], options["concurrency"])
+                        for name in endpoints
+                    },
+                }
+            finally:
+                if not options["keep"]:
+                    self.cleanup()
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            Path(options["output"]).write_text(output)
+        self.stdout.write(output)
+
+    def load_face_image(self, path):
+        if path is None:
+            images = sorted(Path(settings.MEDIA_ROOT, "images").glob("*.*"))
+            if not images:
+                raise CommandError("No face image found, pass --face-image.")
+            path = images[0]
+        return Path(path).name, Path(path).read_bytes()
+
+    def seed(self, options):
+        """Create users with vaults, tokens and (if needed) one face template each."""
+        encoding = None
+        if self.face_image is not None:
+            encoding = encoding_to_bytes(
+                encode_face_bytes(self.face_image[1], **detector_options())
+            )
+
+        users = []
+        for i in range(options["users"]):
+            user = CustomUser(
+                username=f"{BENCH_PREFIX}{self.run_id}_{i}",
+                phone=f"b{self.run_id}{i}",
+                email=f"{BENCH_PREFIX}{self.run_id}_{i}@example.com",
+            )
+            user.set_password(BENCH_PASSWORD)
+            user.save()
+
+            passwords = []
+            for n in range(options["vault_size"]):
+                password = Password(
+                    user=user,
+                    domain_name=f"site{n}",
+                    password=f"secret-{n}",
+                    link=f"https://site{n}.example.com",
+                )
+                password.domain = "example.com"
+                password.encrypt_password()
+                passwords.append(password)
+            Password.objects.bulk_create(passwords, batch_size=500)
+
+            if encoding is not None:
+                image = Image(user=user, encoding=encoding)
+                image.image.save(self.face_image[0], ContentFile(self.face_image[1]))
+
+            user.access_token = str(RefreshToken.for_user(user).access_token)
+            users.append(user)
+        return users
+
+    def cleanup(self):
+        users = CustomUser.objects.filter(username__startswith=f"{BENCH_PREFIX}{self.run_id}_")
+        # Images first: CustomUser.face_image points back at them. Their files
+        # are removed by a post_delete receiver (users/signals.py)
+        Image.objects.filter(user__in=users).delete()
+        if connection.vendor == "postgresql":
+            # Signup provisions a schema per user
+            with connection.cursor() as cursor:
+                for user_id in users.values_list("id", flat=True):
+                    cursor.execute(
+                        "DROP SCHEMA IF EXISTS "
+                        f"{connection.ops.quote_name(schema_name_for(user_id))} CASCADE"
+                    )
+        users.delete()
+
+    def bench(self, name, count, concurrency):
+        request = getattr(self, f"request_{name}")
+        # Every user belongs to one client thread, so no two requests in flight
+        # share a user's single-use OTP or its images
+        cycles = [itertools.cycle(self.users[t::concurrency]) for t in range(concurrency)]
+        jobs = [(i, next(cycles[i % concurrency])) for i in range(count)]
+
+        def worker(chunk):
+            client = Client()
+            timings, errors = [], 0
+            try:
+                for i, user in chunk:
+                    send, after = request(client, user, i)
+                    start = time.perf_counter()
+                    response = send()
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                    timings.append((time.perf_counter() - start) * 1000)
+                    if response.status_code >= 400:
+                        errors += 1
+                    if after is not None:
+                        after()  # Untimed clean-up between requests
+            finally:
+                connections.close_all()  # Each thread owns its connections
+            return timings, errors
+
+        chunks = [jobs[i::concurrency] for i in range(concurrency)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(worker, chunks))
+        wall = time.perf_counter() - start
+
+        timings = [t for chunk_timings, _ in results for t in chunk_timings]
+        errors = sum(chunk_errors for _, chunk_errors in results)
+        self.stderr.write(f"{name}: {len(timings)} requests in {wall:.2f}s")
+        return summarize(timings, errors, wall)
+
+    # Each request_* returns (send, after): send() performs the timed request,
+    # after() (optional) undoes its side effects without being timed.
+
+    def auth(self, user):
+        return {"HTTP_AUTHORIZATION": f"Bearer {user.access_token}"}
+
+    def vault_otp(self, user):
+        # OTPs are single use: forget the last one so every request gets a fresh code
+        CustomUser.objects.filter(pk=user.pk).update(otp_last_counter=None)
+        return current_otp(CustomUser.objects.get(pk=user.pk))
+
+    def request_signup(self, client, user, i):
+        username = f"{BENCH_PREFIX}{self.run_id}_signup_{i}"
+        data = {
+            "username": username,
+            "phone": f"s{self.run_id}{i}",
+            "email": f"{username}@example.com",
+            "password": BENCH_PASSWORD,
+        }
+        return (
+            lambda: client.post(reverse("signup"), data, content_type="application/json"),
+            None,
+        )
+
+    def request_login(self, client, user, i):
+        data = {"email": user.email, "password": BENCH_PASSWORD}
+        return (
+            lambda: client.post(reverse("login"), data, content_type="application/json"),
+            None,
+        )
+
+    def request_me(self, client, user, i):
+        return lambda: client.get(reverse("user-detail"), **self.auth(user)), None
+
+    def request_add_password(self, client, user, i):
+        data = {
+            "domain_name": f"added{i}",
+            "password": f"added-secret-{i}",
+            "link": f"https://added{i}.example.com",
+        }
+        return (
+            lambda: client.post(
+                reverse("add_password"),
+                data,
+                content_type="application/json",
+                **self.auth(user),
+            ),
+            None,
+        )
+
+    def request_verify_otp(self, client, user, i):
+        otp = self.vault_otp(user)
+        return (
+            lambda: client.get(reverse("verify_otp"), {"otp": otp}, **self.auth(user)),
+            None,
+        )
+
+    def request_send_otp_email(self, client, user, i):
+        return lambda: client.get(reverse("send_otp_email"), **self.auth(user)), None
+
+    def request_image_upload(self, client, user, i):
+        name, data = self.face_image
+        existing = list(Image.objects.filter(user=user).values_list("id", flat=True))
+
+        def after():
+            Image.objects.filter(user=user).exclude(id__in=existing).delete()
+
+        return (
+            lambda: client.post(
+                reverse("image_upload"),
+                {"image": ContentFile(data, name=name)},
+                **self.auth(user),
+            ),
+            after,
+        )
+
+    def request_verify_face_id(self, client, user, i):
+        name, data = self.face_image
+        return (
+            lambda: client.post(
+                reverse("verify_face_id"),
+                {"image": ContentFile(data, name=name)},
+                **self.auth(user),
+            ),
+            None,
+        )
@@ -0,0 +1,85 @@
+import json
+import os
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from users.models import CustomUser
+
+BENCH_EMAIL = "bench-login@example.com"
+BENCH_PASSWORD = "bench-Pa55word!"
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure logins per second on one core for known and unknown emails, "
+        "and the raw cost of each configured password hasher. Runs in a "
+        "transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, default=20, help="Logins per case."
+        )
+
+    def handle(self, *args, **options):
+        with override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+            RATE_LIMIT_ENABLED=False,
+        ):
+            with transaction.atomic():
+                results = self.run(options["requests"])
+                transaction.set_rollback(True)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run(self, count):
+        user = CustomUser(username="bench-login", phone="bench-login", email=BENCH_EMAIL)
+        user.set_password(BENCH_PASSWORD)
+        user.save()
+
+        client = Client()
+        cases = {
+            "hit": {"email": BENCH_EMAIL, "password": BENCH_PASSWORD},
+            "wrong_password": {"email": BENCH_EMAIL, "password": "wrong"},
+            "unknown_email": {"email": "nobody@example.com", "password": "wrong"},
+        }
+        logins = {}
+        for name, data in cases.items():
+            timings = []
+            for _ in range(count):
+                start = time.perf_counter()
+                client.post(reverse("login"), data, content_type="application/json")
+                timings.append(time.perf_counter() - start)
+            logins[name] = {
+                "p50_ms": round(statistics.median(timings) * 1000, 2),
+                "logins_per_second": round(len(timings) / sum(timings), 2),
+            }
+        logins["miss_to_hit_ratio"] = round(
+            logins["unknown_email"]["p50_ms"] / logins["hit"]["p50_ms"], 3
+        )
+
+        hashers = {}
+        for algorithm in ("argon2", "scrypt", "pbkdf2_sha256"):
+            hasher = get_hasher(algorithm)
+            salt = hasher.salt()
+            start = time.perf_counter()
+            for _ in range(max(1, count // 4)):
+                hasher.encode(BENCH_PASSWORD, salt)
+            elapsed = (time.perf_counter() - start) / max(1, count // 4)
+            hashers[algorithm] = {
+                "ms": round(elapsed * 1000, 2),
+                "hashes_per_second": round(1 / elapsed, 2),
+            }
+
+        return {
+            "hasher": settings.PASSWORD_HASHER,
+            "cpu_count": os.cpu_count(),
+            "logins": logins,
+            "hashers": hashers,
+        }
@@ -0,0 +1,110 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules whose presence after boot means the vision stack was loaded eagerly
+HEAVY_MODULES = ["cv2", "face_recognition", "dlib", "torch", "numpy", "PIL"]
+
+# Each role runs in a fresh interpreter and prints what it loaded
+BOOT_SCRIPT = """
+import io, json, sys
+role = sys.argv[1]
+if role == "check":
+    import django
+    from django.core.management import call_command
+    django.setup()
+    call_command("check", stdout=io.StringIO())
+elif role == "wsgi":
+    from password_manager.wsgi import application
+elif role == "asgi":
+    from password_manager.asgi import application
+if role in ("wsgi", "asgi"):
+    # A worker resolves its URLconf (and so imports the views) on the first request
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+elif role == "face":
+    import django
+    django.setup()
+    from users.face import warm_up
+    warm_up()
+print(json.dumps([m for m in {heavy!r} if m in sys.modules]))
+"""
+
+ROLES = ["check", "wsgi", "asgi", "face"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure startup time and peak RSS of `manage.py check`, a WSGI or "
+        "ASGI worker boot and a face pool worker, each in a fresh process, "
+        "and list which heavy modules each one loaded. Prints JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5, help="Boots per role.")
+        parser.add_argument(
+            "--roles",
+            default=",".join(ROLES),
+            help=f"Comma separated subset of: {', '.join(ROLES)}.",
+        )
+
+    def handle(self, *args, **options):
+        roles = [role for role in options["roles"].split(",") if role]
+        unknown = set(roles) - set(ROLES)
+        if unknown:
+            raise CommandError(f"Unknown roles: {', '.join(sorted(unknown))}")
+
+        results = {}
+        for role in roles:
+            runs = [self.boot(role) for _ in range(options["runs"])]
+            wall = [run["wall_s"] for run in runs]
+            rss = [run["max_rss_mb"] for run in runs]
+            results[role] = {
+                "runs": len(runs),
+                "p50_s": round(statistics.median(wall), 3),
+                "min_s": round(min(wall), 3),
+                "max_rss_mb": round(statistics.median(rss), 1),
+                "heavy_modules": runs[-1]["heavy_modules"],
+            }
+            self.stderr.write(f"{role}: {results[role]['p50_s']}s")
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def boot(self, role):
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": os.environ.get(
+                "DJANGO_SETTINGS_MODULE", "password_manager.settings"
+            ),
+            "FACE_POOL_PREWARM": "False",  # Don't fork face workers while timing
+        }
+        script = BOOT_SCRIPT.format(heavy=HEAVY_MODULES)
+        command = [sys.executable, "-c", script, role]
+
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            command,
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        output = process.stdout.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode:
+            raise CommandError(f"{role} exited with status {process.returncode}")
+
+        # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+        divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return {
+            "wall_s": wall,
+            "max_rss_mb": usage.ru_maxrss / divisor,
+            "heavy_modules": json.loads(output),
+        }
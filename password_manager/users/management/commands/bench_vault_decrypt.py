@@ -0,0 +1,102 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users import vault_crypto
+from users.models import CustomUser, Password
+from users.serializers import PasswordSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare vault listing latency with and without the data key cache. "
+        "Works on a throwaway user inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=500, help="Vault size.")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per mode.")
+        parser.add_argument(
+            "--kdf-sample",
+            type=int,
+            default=3,
+            help="Rows timed with a KDF per row; the listing time is extrapolated.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            results = self.run(options)
+            transaction.set_rollback(True)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run(self, options):
+        rows, repeat = options["rows"], options["repeat"]
+        user = CustomUser.objects.create(
+            username="bench-vault-decrypt", phone="bench-vault", email="bench@invalid"
+        )
+        Password.objects.bulk_create(
+            [
+                self.encrypted_row(user, i)
+                for i in range(rows)
+            ]
+        )
+        wrapped = bytes(CustomUser.objects.get(pk=user.pk).vault_key)
+
+        def fetch():
+            return list(Password.objects.filter(user=user).order_by("updated_at", "id"))
+
+        def serialize(passwords):
+            return PasswordSerializer(passwords, many=True).data
+
+        def kdf_per_row():
+            # Naive scheme: derive the master key and unwrap for every row
+            passwords = fetch()[: options["kdf_sample"]]
+            for password in passwords:
+                master = vault_crypto.derive_master_key()
+                key = vault_crypto.unwrap_key(wrapped, user.pk, master)
+                password._plaintext = vault_crypto.decrypt_value(
+                    password.password, user.pk, key=key
+                )
+            serialize(passwords)
+
+        def unwrap_per_row():
+            passwords = fetch()
+            for password in passwords:
+                key = vault_crypto.unwrap_key(wrapped, user.pk)
+                password._plaintext = vault_crypto.decrypt_value(
+                    password.password, user.pk, key=key
+                )
+            serialize(passwords)
+
+        def cached_batch():
+            serialize(vault_crypto.decrypt_many(fetch(), user))
+
+        vault_crypto.get_data_key(user.pk, user)  # Warm the cache for cached_batch
+        results = {"rows": rows}
+        for name, fn in (
+            ("kdf_per_row", kdf_per_row),
+            ("unwrap_per_row", unwrap_per_row),
+            ("cached_batch", cached_batch),
+        ):
+            timings = []
+            for _ in range(1 if name == "kdf_per_row" else repeat):
+                start = time.perf_counter()
+                fn()
+                timings.append((time.perf_counter() - start) * 1000)
+            median = statistics.median(timings)
+            if name == "kdf_per_row":
+                median *= rows / max(1, min(rows, options["kdf_sample"]))
+            results[f"{name}_ms"] = round(median, 2)
+
+        vault_crypto.forget_data_key(user.pk)
+        return results
+
+    def encrypted_row(self, user, i):
+        password = Password(
+            user=user, domain_name=f"site{i}", password=f"secret-{i}", link=f"https://site{i}.com"
+        )
+        password.encrypt_password()
+        return password
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from users.models import Password
+
+
+class Command(BaseCommand):
+    help = "Encrypt Password rows that are still stored as plaintext."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Number of rows fetched and updated at a time.",
+        )
+
+    def handle(self, *args, **options):
+        passwords = (
+            Password.objects.filter(encrypted=False)
+            .only("id", "user_id", "password", "encrypted")
+            .order_by("id")
+        )
+
+        encrypted = 0
+        batch = []
+        for password in passwords.iterator(chunk_size=options["chunk_size"]):
+            password.encrypt_password()
+            batch.append(password)
+            if len(batch) >= options["chunk_size"]:
+                # bulk_update leaves updated_at alone, so sync clients see no change
+                Password.objects.bulk_update(batch, ["password", "encrypted"])
+                encrypted += len(batch)
+                batch = []
+        if batch:
+            Password.objects.bulk_update(batch, ["password", "encrypted"])
+            encrypted += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Encrypted {encrypted} password(s)."))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.sync import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete password tombstones older than VAULT_TOMBSTONE_RETENTION_DAYS."
+
+    def handle(self, *args, **options):
+        deleted = purge_tombstones()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Deleted {deleted} tombstone(s) older than "
+                f"{settings.VAULT_TOMBSTONE_RETENTION_DAYS} days."
+            )
+        )
@@ -0,0 +1,69 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users import face_pool
+from users.face_worker import EncodeBatcher, make_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the face recognition service used with FACE_BACKEND=remote. "
+        "Concurrent requests are batched and encoded in this process's face pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--bind",
+            default="127.0.0.1:8765",
+            help="host:port to listen on (ignored with --socket).",
+        )
+        parser.add_argument("--socket", default=None, help="Unix socket path.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.FACE_WORKER_BATCH_SIZE,
+            help="Most frames encoded in one pool job.",
+        )
+        parser.add_argument(
+            "--batch-wait",
+            type=float,
+            default=settings.FACE_WORKER_BATCH_WAIT,
+            help="Seconds a batch stays open for more frames.",
+        )
+        parser.add_argument(
+            "--log-requests", action="store_true", help="Log every request."
+        )
+
+    def handle(self, *args, **options):
+        address = None
+        if not options["socket"]:
+            host, _, port = options["bind"].rpartition(":")
+            if not host or not port.isdigit():
+                raise CommandError("--bind must look like host:port.")
+            address = (host, int(port))
+
+        # Load the models before the first request rather than during it
+        face_pool.prewarm(force=True)
+        server = make_server(
+            EncodeBatcher(options["batch_size"], options["batch_wait"]),
+            address=address,
+            socket_path=options["socket"],
+            token=settings.FACE_WORKER_TOKEN,
+            verbose=options["log_requests"],
+        )
+        where = options["socket"] or options["bind"]
+        self.stdout.write(
+            f"Face worker listening on {where} with {settings.FACE_POOL_WORKERS} "
+            f"pool worker(s), batches of up to {options['batch_size']} frames."
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            face_pool.reset_pool()
+            if options["socket"] and os.path.exists(options["socket"]):
+                os.unlink(options["socket"])
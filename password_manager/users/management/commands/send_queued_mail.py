@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from users.mail import dispatch_queued_mail
+
+
+class Command(BaseCommand):
+    help = "Send queued outbound email, once or continuously with --loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running and poll the queue every --interval seconds.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.MAIL_QUEUE_POLL_INTERVAL,
+            help="Seconds to wait between polls when the queue is empty.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.MAIL_QUEUE_BATCH_SIZE,
+            help="Messages sent per SMTP connection.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            sent = dispatch_queued_mail(options["batch_size"])
+            if sent:
+                self.stdout.write(f"Sent {sent} message(s).")
+            if not options["loop"]:
+                break
+            if sent < options["batch_size"]:
+                time.sleep(options["interval"])
@@ -0,0 +1,128 @@
+import os
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from .db_pool import pool_stats
+
+# With PROMETHEUS_MULTIPROC_DIR set (gunicorn), every process writes its own
+# samples to files in that directory and a scrape sums them up; otherwise the
+# values live in this process only.
+
+NAMESPACE = "password_manager"
+
+LOGIN_ATTEMPTS = Counter(
+    "login_attempts",
+    "Login attempts by outcome.",
+    ["outcome"],  # success, invalid_credentials, missing_fields
+    namespace=NAMESPACE,
+)
+LOGIN_PASSWORD_CHECK_SECONDS = Histogram(
+    "login_password_check_seconds",
+    "Time spent verifying the password hash at login.",
+    namespace=NAMESPACE,
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+OTP_SENT = Counter(
+    "otp_sent",
+    "OTP emails queued for delivery.",
+    namespace=NAMESPACE,
+)
+OTP_VERIFICATIONS = Counter(
+    "otp_verifications",
+    "Vault OTP checks by outcome.",
+    ["outcome"],  # valid, invalid, replayed, locked, missing
+    namespace=NAMESPACE,
+)
+MAIL_DELIVERIES = Counter(
+    "mail_deliveries",
+    "Queued emails handed to the mail backend, by outcome.",
+    ["outcome"],  # sent, failed
+    namespace=NAMESPACE,
+)
+FACE_ENCODE_SECONDS = Histogram(
+    "face_encode_seconds",
+    "Time to encode uploaded face images, including the wait for a worker.",
+    ["operation"],  # encode, encode_many
+    namespace=NAMESPACE,
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+FACE_DISTANCE = Histogram(
+    "face_distance",
+    "Distance between a probe face and the enrolled faceIds.",
+    namespace=NAMESPACE,
+    buckets=(0.2, 0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.7, 0.8, 1.0),
+)
+FACE_VERIFICATIONS = Counter(
+    "face_verifications",
+    "Face ID checks by outcome.",
+    ["outcome"],  # match, no_match, no_face_id, error, busy, backend_error
+    namespace=NAMESPACE,
+)
+
+RATE_LIMITED = Counter(
+    "rate_limited",
+    "Requests rejected by the rate limiter, by throttle scope.",
+    ["scope"],
+    namespace=NAMESPACE,
+)
+
+
+class DatabasePoolCollector:
+    """Report the psycopg pool of the scraped process at scrape time."""
+
+    def collect(self):
+        stats = pool_stats()
+        if stats is None:
+            return
+        pid = str(os.getpid())
+        for key, value in stats.items():
+            if isinstance(value, (int, float)):
+                gauge = GaugeMetricFamily(
+                    f"{NAMESPACE}_db_pool_{key}",
+                    f"psycopg pool statistic {key}.",
+                    labels=["pid"],
+                )
+                gauge.add_metric([pid], value)
+                yield gauge
+
+
+class _ProcessMetrics:
+    # Hands the process-global registry to a per-scrape registry
+    def collect(self):
+        return REGISTRY.collect()
+
+
+def build_registry():
+    registry = CollectorRegistry()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(_ProcessMetrics())
+    registry.register(DatabasePoolCollector())
+    return registry
+
+
+def metrics_view(request):
+    """Serve metrics in the Prometheus text format.
+
+    When METRICS_TOKEN is set the scraper must send it as a bearer token.
+    """
+    if settings.METRICS_TOKEN:
+        header = request.headers.get("Authorization", "")
+        if not constant_time_compare(header, f"Bearer {settings.METRICS_TOKEN}"):
+            return HttpResponseForbidden()
+    return HttpResponse(
+        generate_latest(build_registry()), content_type=CONTENT_TYPE_LATEST
+    )
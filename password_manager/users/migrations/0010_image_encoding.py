@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_customuser_otp_generated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='encoding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:59
+
+import users.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_image_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='original',
+            field=models.FileField(blank=True, null=True, upload_to=users.models.original_upload_to),
+        ),
+    ]
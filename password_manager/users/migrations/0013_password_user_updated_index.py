@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='password',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='users_passw_user_updated_idx'),
+        ),
+    ]
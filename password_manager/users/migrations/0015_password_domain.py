@@ -0,0 +1,97 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:09
+
+import ipaddress
+from urllib.parse import urlsplit
+
+from django.db import migrations, models
+
+# users.domains as it was when this migration was written, so later changes
+# to that module don't change what this migration does
+
+# Second-level suffixes under which registrations happen one label deeper
+# (example.co.uk, not co.uk). Not the full Public Suffix List, but it covers
+# the common country-code cases without a runtime dependency.
+MULTI_PART_SUFFIXES = frozenset(
+    {
+        "co.uk", "org.uk", "ac.uk", "gov.uk", "me.uk", "ltd.uk", "plc.uk", "net.uk",
+        "com.au", "net.au", "org.au", "edu.au", "gov.au",
+        "co.nz", "org.nz", "net.nz", "govt.nz",
+        "co.jp", "ne.jp", "or.jp", "ac.jp", "go.jp",
+        "co.in", "net.in", "org.in", "gov.in", "ac.in",
+        "com.np", "org.np", "edu.np", "gov.np", "net.np",
+        "com.br", "net.br", "org.br", "gov.br",
+        "com.cn", "net.cn", "org.cn", "gov.cn",
+        "com.hk", "com.sg", "com.my", "com.tw", "com.mx", "com.ar", "com.tr",
+        "co.za", "co.kr", "co.id", "co.il", "co.th",
+        "github.io", "herokuapp.com", "blogspot.com", "appspot.com",
+    }
+)
+
+
+def hostname_of(value):
+    """Return the lowercased host of a URL or bare host name, or ""."""
+    value = (value or "").strip()
+    if not value:
+        return ""
+    if "//" not in value:
+        value = f"//{value}"  # Let urlsplit treat a bare host as the netloc
+    try:
+        host = urlsplit(value).hostname or ""
+    except ValueError:
+        return ""
+    return host.rstrip(".")
+
+
+def registrable_domain(value):
+    """Reduce a URL or host to the domain a user registers, e.g. example.co.uk.
+
+    IP addresses and single-label hosts (localhost) are returned unchanged.
+    """
+    host = hostname_of(value)
+    if not host:
+        return ""
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        pass
+    else:
+        return host
+
+    labels = host.split(".")
+    if len(labels) <= 2:
+        return host
+    suffix_labels = 2 if ".".join(labels[-2:]) in MULTI_PART_SUFFIXES else 1
+    return ".".join(labels[-(suffix_labels + 1):])
+
+
+def backfill_domains(apps, schema_editor):
+    Password = apps.get_model("users", "Password")
+    batch = []
+    for password in Password.objects.only("id", "link").iterator(chunk_size=1000):
+        password.domain = registrable_domain(password.link)
+        batch.append(password)
+        if len(batch) >= 1000:
+            Password.objects.bulk_update(batch, ["domain"])
+            batch = []
+    if batch:
+        Password.objects.bulk_update(batch, ["domain"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_passwordtombstone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='password',
+            name='domain',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_domains, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='password',
+            index=models.Index(fields=['user', 'domain'], include=('id', 'domain_name', 'link'), name='users_passw_user_domain_idx'),
+        ),
+    ]
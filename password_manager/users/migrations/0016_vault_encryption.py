@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_password_domain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='vault_key',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='password',
+            name='password',
+            field=models.TextField(),
+        ),
+    ]
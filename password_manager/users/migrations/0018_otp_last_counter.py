@@ -0,0 +1,22 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_customuser_email_lower_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='customuser',
+            name='otp_generated',
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='otp_last_counter',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
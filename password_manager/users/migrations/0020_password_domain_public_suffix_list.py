@@ -0,0 +1,66 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:52
+
+import ipaddress
+from urllib.parse import urlsplit
+
+import tldextract
+from django.db import migrations
+
+# registrable_domain() from users.domains as of this migration, which moved
+# from a short table of suffixes to the Public Suffix List. Entries on shared
+# hosts (vercel.app, myshopify.com, ...) were reduced to the host's suffix and
+# are recomputed.
+
+_extract = tldextract.TLDExtract(
+    cache_dir=None, suffix_list_urls=(), include_psl_private_domains=True
+)
+
+
+def registrable_domain(value):
+    value = (value or "").strip()
+    if not value:
+        return ""
+    if "//" not in value:
+        value = f"//{value}"
+    try:
+        host = (urlsplit(value).hostname or "").rstrip(".")
+    except ValueError:
+        return ""
+    if not host:
+        return ""
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        pass
+    else:
+        return host
+    return _extract(host).top_domain_under_public_suffix or host
+
+
+def recompute_domains(apps, schema_editor):
+    Password = apps.get_model("users", "Password")
+    batch = []
+    for password in Password.objects.only("id", "link", "domain").iterator(
+        chunk_size=1000
+    ):
+        domain = registrable_domain(password.link)
+        if domain == password.domain:
+            continue
+        password.domain = domain
+        batch.append(password)
+        if len(batch) >= 1000:
+            Password.objects.bulk_update(batch, ["domain"])
+            batch = []
+    if batch:
+        Password.objects.bulk_update(batch, ["domain"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0019_outboundemail_lease'),
+    ]
+
+    operations = [
+        migrations.RunPython(recompute_domains, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:50
+
+import base64
+import binascii
+
+from django.db import migrations, models
+
+# Until now a value was taken to be encrypted when it started with "v1:".
+# Mark the rows holding real ciphertext ("v1:" + base64 of a 12 byte nonce and
+# at least a 16 byte tag); plaintext such as "v1:hello" stays unencrypted, and
+# encrypt_vault encrypts it.
+PREFIX = "v1:"
+MIN_BLOB_SIZE = 12 + 16
+
+
+def looks_encrypted(value):
+    if not value.startswith(PREFIX):
+        return False
+    try:
+        blob = base64.urlsafe_b64decode(value[len(PREFIX):].encode())
+    except (binascii.Error, ValueError):
+        return False
+    return len(blob) >= MIN_BLOB_SIZE
+
+
+def mark_encrypted(apps, schema_editor):
+    Password = apps.get_model("users", "Password")
+    rows = Password.objects.filter(password__startswith=PREFIX).only("id", "password")
+    ids = [row.id for row in rows.iterator(chunk_size=1000) if looks_encrypted(row.password)]
+    for start in range(0, len(ids), 1000):
+        Password.objects.filter(id__in=ids[start:start + 1000]).update(encrypted=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0020_password_domain_public_suffix_list'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='password',
+            name='encrypted',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_encrypted, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0021_password_encrypted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='otp_failures',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='otp_locked_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
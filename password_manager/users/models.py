@@ -1,20 +1,19 @@
+import uuid
 from datetime import datetime
-import numpy as np
 
-import cv2
 import re
-import pyotp  # For OTP generation
 import base64
 import hashlib
 
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.hashers import make_password
 
-
-# Load Haar Cascade for face detection
-CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-face_cascade = cv2.CascadeClassifier(CASCADE_PATH)
+from . import otp
+from .domains import registrable_domain
+from .vault_crypto import decrypt_value, encrypt_value
 
 
 # Save Face Image
@@ -25,6 +24,13 @@ def image_upload_to(instance, filename):
     return f"images/{timestamp}_{lowercase_filename}"
 
 
+# Save the untouched upload next to the normalized face image
+def original_upload_to(instance, filename):
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    lowercase_filename = filename.lower()
+    return f"images/originals/{timestamp}_{lowercase_filename}"
+
+
 class Image(models.Model):
     user = models.ForeignKey(
         "CustomUser",
@@ -32,10 +38,15 @@ class Image(models.Model):
         related_name="image",
     )
     image = models.ImageField(upload_to=image_upload_to)  # Store the actual image
+    original = models.FileField(
+        upload_to=original_upload_to, blank=True, null=True
+    )  # Raw upload, kept only with FACE_UPLOAD_KEEP_ORIGINAL
     image_url = models.CharField(
         max_length=255, blank=True, null=True
     )  # Store the URL (optional)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # 128-float face encoding computed once at enrollment (see users/face.py)
+    encoding = models.BinaryField(blank=True, null=True)
 
     class Meta:
         app_label = "users"
@@ -45,6 +56,24 @@ class Image(models.Model):
             self.image_url = self.image.url  # Set image_url to the image URL
         super().save(*args, **kwargs)
 
+    def get_encoding(self):
+        """Return the stored face encoding, computing and saving it if missing.
+
+        Raises users.face.FaceDetectionError if the image has no usable face.
+        """
+        from . import face_backends
+        from .face import encoding_from_bytes, encoding_to_bytes
+
+        if self.encoding:
+            return encoding_from_bytes(self.encoding)
+
+        with self.image.open("rb") as file:
+            encoding = face_backends.encode(file.read())
+
+        self.encoding = encoding_to_bytes(encoding)
+        self.save(update_fields=["encoding"])
+        return encoding
+
     def __str__(self):
         return f"Image {self.id}"
 
@@ -59,26 +88,32 @@ class CustomUser(AbstractUser):
         related_name="user_face_image",
     )
     otp_secret = models.CharField(max_length=255, blank=True, null=True)
-    otp_generated = models.CharField(max_length=255, blank=True, null=True)
+    # Time step of the last accepted OTP; older codes are rejected (users/otp.py)
+    otp_last_counter = models.BigIntegerField(blank=True, null=True)
+    # Wrong codes in a row, and the end of the lockout they lead to
+    otp_failures = models.PositiveSmallIntegerField(default=0)
+    otp_locked_until = models.DateTimeField(blank=True, null=True)
+    # Vault data key, wrapped with the master key (see users/vault_crypto.py)
+    vault_key = models.BinaryField(blank=True, null=True, editable=False)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Login looks users up by lower(email)
+            models.Index(Lower("email"), name="users_custo_email_lower_idx"),
+        ]
 
     # OTP related methods
     def generate_otp_secret(self):
         # Generate a secret key for OTP if not already generated.
-        if not self.otp_secret:
-            totp = pyotp.random_base32()  # Generate a new secret key for OTP
-            self.otp_secret = totp
-            self.save()
-        return self.otp_secret
+        return otp.ensure_otp_secret(self)
 
     def get_otp(self):
         # Generate OTP using the stored OTP secret.
-        totp = pyotp.TOTP(self.otp_secret)
-        return totp.now()  # Get current OTP
+        return otp.current_otp(self)  # Get current OTP
 
-    def verify_otp(self, otp):
-        # Verify if the OTP provided is correct
-        totp = pyotp.TOTP(self.otp_secret)
-        return totp.verify(otp)  # Returns True if OTP is valid, False otherwise
+    def verify_otp(self, code):
+        # Verify the OTP within the drift window; each code works only once
+        return otp.verify_otp(self, code) == "valid"
 
 
 class Password(models.Model):
@@ -86,17 +121,148 @@ class Password(models.Model):
         "CustomUser", on_delete=models.CASCADE, related_name="passwords"
     )
     domain_name = models.CharField(max_length=255)
-    password = models.CharField(max_length=255)  # Store the hashed password
+    password = models.TextField()  # Stored encrypted with the user's data key
+    # False for rows saved before vault encryption, see encrypt_vault
+    encrypted = models.BooleanField(default=False, editable=False)
     link = models.URLField()
+    # Registrable domain of link (example.co.uk), kept for autofill lookups
+    domain = models.CharField(max_length=255, blank=True, default="", editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         app_label = "users"
+        indexes = [
+            # Autofill: answered from the index alone on PostgreSQL
+            models.Index(
+                fields=["user", "domain"],
+                include=["id", "domain_name", "link"],
+                name="users_passw_user_domain_idx",
+            ),
+            # Covers vault listing: filter on user, order by (updated_at, id)
+            models.Index(
+                fields=["user", "updated_at", "id"],
+                name="users_passw_user_updated_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.domain_name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The ciphertext as read; any other value assigned later is plaintext
+        if instance.__dict__.get("encrypted"):
+            instance._ciphertext = instance.__dict__.get("password")
+        return instance
+
+    def has_ciphertext(self):
+        """Whether password holds the stored ciphertext, not plaintext."""
+        return self.password is not None and self.password == getattr(
+            self, "_ciphertext", None
+        )
+
+    def get_password(self):
+        """Return the decrypted password."""
+        if getattr(self, "_plaintext", None) is None:
+            if self.has_ciphertext():
+                self._plaintext = decrypt_value(self.password, self.user_id)
+            else:
+                self._plaintext = self.password  # Legacy or just assigned
+        return self._plaintext
+
+    def encrypt_password(self):
+        # Whatever was assigned since the row was read or last encrypted is
+        # plaintext, even if it looks like ciphertext
+        if self.has_ciphertext():
+            return
+        self._plaintext = self.password
+        self.password = encrypt_value(self.password, self.user_id)
+        self._ciphertext = self.password
+        self.encrypted = True
+
     def save(self, *args, **kwargs):
-        # Override save method to hash the password before saving.
+        # Override save method to encrypt the password before saving.
+        self.encrypt_password()
+        self.domain = registrable_domain(self.link)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            extra = set()
+            if "link" in update_fields:
+                extra.add("domain")
+            if "password" in update_fields:
+                extra.add("encrypted")
+            kwargs["update_fields"] = {*update_fields, *extra}
         super().save(*args, **kwargs)
+
+
+class OutboundEmail(models.Model):
+    # Mail waiting to be sent by the dispatcher in users/mail.py
+    STATUS_PENDING = "pending"
+    STATUS_SENDING = "sending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENDING, "Sending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        "CustomUser",
+        on_delete=models.CASCADE,
+        related_name="outbound_emails",
+        blank=True,
+        null=True,
+    )
+    to = models.EmailField()
+    from_email = models.CharField(max_length=255, blank=True, null=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()  # Cleared once the message is sent
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When the next attempt is due; while sending, when the claim lapses
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # Not sent after this (an OTP that can no longer be used)
+    expires_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        app_label = "users"
+        indexes = [
+            models.Index(
+                fields=["status", "next_attempt_at"],
+                name="users_outbo_status_due_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.to} ({self.status})"
+
+
+class PasswordTombstone(models.Model):
+    # Records a deleted Password so delta sync can tell clients to drop it
+    user = models.ForeignKey(
+        "CustomUser", on_delete=models.CASCADE, related_name="password_tombstones"
+    )
+    password_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        app_label = "users"
+        indexes = [
+            models.Index(
+                fields=["user", "deleted_at", "id"],
+                name="users_passw_tomb_user_del_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Deleted password {self.password_id}"
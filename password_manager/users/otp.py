@@ -0,0 +1,198 @@
+import time
+from datetime import timedelta
+
+import pyotp
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .authentication import forget_user
+
+# Email OTPs are plain TOTP codes computed from CustomUser.otp_secret, so
+# sending one writes nothing. A code is accepted within OTP_VALID_WINDOW
+# intervals of now, and only once: the counter (time step) of the last
+# accepted code is kept in CustomUser.otp_last_counter. After
+# OTP_MAX_FAILURES wrong codes in a row, no code is accepted for
+# OTP_LOCKOUT seconds (CustomUser.otp_failures, otp_locked_until).
+
+
+def get_totp(secret):
+    return pyotp.TOTP(secret, interval=settings.OTP_INTERVAL)
+
+
+def ensure_otp_secret(user):
+    """Return the user's OTP secret, creating it on first use."""
+    if user.otp_secret:
+        return user.otp_secret
+    secret = pyotp.random_base32()
+    manager = type(user)._default_manager
+    # Two concurrent first sends must not end up with different secrets
+    created = (
+        manager.filter(pk=user.pk)
+        .filter(Q(otp_secret__isnull=True) | Q(otp_secret=""))
+        .update(otp_secret=secret)
+    )
+    if not created:
+        secret = manager.values_list("otp_secret", flat=True).get(pk=user.pk)
+    forget_user(user.pk)  # update() sends no post_save
+    user.otp_secret = secret
+    return secret
+
+
+def current_otp(user):
+    return get_totp(ensure_otp_secret(user)).now()
+
+
+def code_lifetime():
+    """How long a code sent now can be used at most."""
+    return timedelta(seconds=(settings.OTP_VALID_WINDOW + 1) * settings.OTP_INTERVAL)
+
+
+def matching_counter(totp, otp, now=None):
+    """Return the time step whose code equals otp, or None.
+
+    The current step is tried first, then steps further and further away
+    up to OTP_VALID_WINDOW in both directions.
+    """
+    now = time.time() if now is None else now
+    if not totp.verify(otp, for_time=int(now), valid_window=settings.OTP_VALID_WINDOW):
+        return None
+    for offset in sorted(
+        range(-settings.OTP_VALID_WINDOW, settings.OTP_VALID_WINDOW + 1), key=abs
+    ):
+        for_time = int(now) + offset * totp.interval
+        if totp.verify(otp, for_time=for_time):
+            return for_time // totp.interval
+    return None
+
+
+def _not_locked(now):
+    return Q(otp_locked_until__isnull=True) | Q(otp_locked_until__lte=now)
+
+
+def _is_locked(user, now):
+    return user.otp_locked_until is not None and user.otp_locked_until > now
+
+
+def _lockout(now):
+    # Start over counting failures once they have locked the account
+    return {
+        "otp_failures": 0,
+        "otp_locked_until": now + timedelta(seconds=settings.OTP_LOCKOUT),
+    }
+
+
+def verify_otp(user, otp, now=None):
+    """Check otp for user and mark its time step as used.
+
+    Returns "valid", "invalid", "replayed" or "locked". The check-and-set is
+    a single conditional UPDATE, so two requests cannot both spend the same
+    code. A locked account answers "locked" whatever the code, so guesses
+    made during a lockout learn nothing.
+    """
+    if not otp:
+        return "invalid"
+    manager = type(user)._default_manager
+    if not user.otp_secret:
+        # The user may be cached from before another process created the secret
+        user.otp_secret = (
+            manager.filter(pk=user.pk).values_list("otp_secret", flat=True).first()
+        )
+        if not user.otp_secret:
+            return "invalid"
+    now_dt = timezone.now()
+    if _is_locked(user, now_dt):
+        return "locked"
+    counter = matching_counter(get_totp(user.otp_secret), str(otp).strip(), now)
+    if counter is None:
+        # The user may be cached from before the lockout; the row decides
+        failed = (
+            manager.filter(pk=user.pk)
+            .filter(_not_locked(now_dt))
+            .update(otp_failures=F("otp_failures") + 1)
+        )
+        if not failed:
+            return "locked"
+        lockout = _lockout(now_dt)
+        if manager.filter(
+            pk=user.pk, otp_failures__gte=settings.OTP_MAX_FAILURES
+        ).update(**lockout):
+            user.otp_locked_until = lockout["otp_locked_until"]
+        return "invalid"
+    updated = (
+        manager.filter(pk=user.pk)
+        .filter(Q(otp_last_counter__isnull=True) | Q(otp_last_counter__lt=counter))
+        .filter(_not_locked(now_dt))
+        .update(otp_last_counter=counter, otp_failures=0)
+    )
+    if not updated:
+        locked = manager.filter(pk=user.pk).exclude(_not_locked(now_dt)).exists()
+        return "locked" if locked else "replayed"
+    user.otp_last_counter = counter
+    return "valid"
+
+
+async def aensure_otp_secret(user):
+    """Async ensure_otp_secret()."""
+    if user.otp_secret:
+        return user.otp_secret
+    secret = pyotp.random_base32()
+    manager = type(user)._default_manager
+    created = await (
+        manager.filter(pk=user.pk)
+        .filter(Q(otp_secret__isnull=True) | Q(otp_secret=""))
+        .aupdate(otp_secret=secret)
+    )
+    if not created:
+        secret = await manager.values_list("otp_secret", flat=True).aget(pk=user.pk)
+    forget_user(user.pk)
+    user.otp_secret = secret
+    return secret
+
+
+async def acurrent_otp(user):
+    return get_totp(await aensure_otp_secret(user)).now()
+
+
+async def averify_otp(user, otp, now=None):
+    """Async verify_otp()."""
+    if not otp:
+        return "invalid"
+    manager = type(user)._default_manager
+    if not user.otp_secret:
+        # The user may be cached from before another process created the secret
+        user.otp_secret = await (
+            manager.filter(pk=user.pk).values_list("otp_secret", flat=True).afirst()
+        )
+        if not user.otp_secret:
+            return "invalid"
+    now_dt = timezone.now()
+    if _is_locked(user, now_dt):
+        return "locked"
+    counter = matching_counter(get_totp(user.otp_secret), str(otp).strip(), now)
+    if counter is None:
+        # The user may be cached from before the lockout; the row decides
+        failed = await (
+            manager.filter(pk=user.pk)
+            .filter(_not_locked(now_dt))
+            .aupdate(otp_failures=F("otp_failures") + 1)
+        )
+        if not failed:
+            return "locked"
+        lockout = _lockout(now_dt)
+        if await manager.filter(
+            pk=user.pk, otp_failures__gte=settings.OTP_MAX_FAILURES
+        ).aupdate(**lockout):
+            user.otp_locked_until = lockout["otp_locked_until"]
+        return "invalid"
+    updated = await (
+        manager.filter(pk=user.pk)
+        .filter(Q(otp_last_counter__isnull=True) | Q(otp_last_counter__lt=counter))
+        .filter(_not_locked(now_dt))
+        .aupdate(otp_last_counter=counter, otp_failures=0)
+    )
+    if not updated:
+        locked = await manager.filter(pk=user.pk).exclude(_not_locked(now_dt)).aexists()
+        return "locked" if locked else "replayed"
+    user.otp_last_counter = counter
+    return "valid"
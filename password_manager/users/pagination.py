@@ -0,0 +1,19 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class VaultCursorPagination(CursorPagination):
+    """Cursor pages over a vault in (updated_at, id) order.
+
+    Served by the (user, updated_at, id) index on Password, so a page costs
+    the same no matter how deep into the vault it is.
+    """
+
+    ordering = ("updated_at", "id")
+    page_size_query_param = "page_size"
+
+    def get_page_size(self, request):
+        # Read per request rather than when the module is imported
+        self.page_size = settings.VAULT_PAGE_SIZE
+        self.max_page_size = settings.VAULT_MAX_PAGE_SIZE
+        return super().get_page_size(request)
@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate):
+    """Turn "10/min" (or /s, /h, /d) into (10, 60)."""
+    count, period = rate.split("/")
+    return int(count), PERIODS[period.strip()[0]]
+
+
+class LocalStore:
+    """Sliding window counters kept in this process.
+
+    Keys are spread over shards with a lock each, so concurrent requests for
+    different clients rarely wait on each other. Limits are per process.
+    Each shard keeps its keys in least recently hit order: keys whose windows
+    have passed are dropped from the front as new hits come in, and a shard
+    never holds more than max_keys keys.
+    """
+
+    def __init__(self, shards=64, max_keys=None):
+        if max_keys is None:
+            max_keys = settings.RATE_LIMIT_LOCAL_MAX_KEYS
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+        self.max_keys = max(1, max_keys // shards)  # Per shard
+
+    def incr(self, key, window, now):
+        """Count a hit; return the (previous, current) window counts."""
+        bucket = int(now // window)
+        lock, counters = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            entry = counters.pop(key, None)
+            if entry is None or entry[1] < bucket - 1:
+                previous, current = 0, 0
+            elif entry[1] == bucket - 1:
+                previous, current = entry[3], 0
+            else:
+                previous, current = entry[2], entry[3]
+            current += 1
+            counters[key] = (window, bucket, previous, current)  # Now the newest
+
+            # Oldest first: stop at the first key still inside its window
+            while counters:
+                oldest_window, oldest_bucket, _, _ = next(iter(counters.values()))
+                if oldest_bucket >= int(now // oldest_window) - 1:
+                    break
+                counters.popitem(last=False)
+            while len(counters) > self.max_keys:
+                counters.popitem(last=False)
+        return previous, current
+
+    def __len__(self):
+        return sum(len(counters) for _, counters in self._shards)
+
+    def clear(self):
+        for lock, counters in self._shards:
+            with lock:
+                counters.clear()
+
+
+class RedisStore:
+    """Sliding window counters shared by all processes through Redis.
+
+    Works with any client that has the redis-py pipeline interface
+    (incr, expire, get, execute), such as fakeredis.
+    """
+
+    def __init__(self, client, prefix="ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    def incr(self, key, window, now):
+        bucket = int(now // window)
+        current_key = f"{self.prefix}{key}:{bucket}"
+        pipe = self.client.pipeline()
+        pipe.incr(current_key)
+        pipe.expire(current_key, window * 2)
+        pipe.get(f"{self.prefix}{key}:{bucket - 1}")
+        current, _, previous = pipe.execute()
+        return int(previous or 0), int(current)
+
+
+@lru_cache(maxsize=1)
+def get_store():
+    if settings.RATE_LIMIT_STORE == "redis":
+        import redis  # Only needed with RATE_LIMIT_STORE=redis
+
+        return RedisStore(redis.Redis.from_url(settings.RATE_LIMIT_REDIS_URL))
+    return LocalStore()
+
+
+def hit(key, rate, now=None, store=None):
+    """Count one request for key; return seconds to wait, or 0 when allowed.
+
+    The count is a sliding window estimate: the previous window's count,
+    weighted by how much of it still overlaps, plus the current count.
+    """
+    limit, window = parse_rate(rate)
+    now = time.time() if now is None else now
+    previous, current = (store or get_store()).incr(key, window, now)
+    elapsed = (now % window) / window
+    if previous * (1 - elapsed) + current <= limit:
+        return 0
+    return window - (now % window)
+
+
+def check_limits(scope, ip, account):
+    """Count one request against RATE_LIMITS[scope] for the client IP and account.
+
+    Returns the seconds to wait, or 0 when the request is allowed. Shared by
+    the DRF throttle and the async views, which have no DRF request.
+    """
+    limits = settings.RATE_LIMITS.get(scope)
+    if not settings.RATE_LIMIT_ENABLED or not limits:
+        return 0
+
+    retry_after = 0
+    for kind, rate in limits.items():
+        ident = ip if kind == "ip" else account
+        if ident is None:
+            continue
+        try:
+            retry_after = max(retry_after, hit(f"{scope}:{kind}:{ident}", rate))
+        except Exception:
+            # A broken store must not take logins down with it
+            logger.exception("Rate limit store failed")
+            return 0
+
+    if retry_after:
+        metrics.RATE_LIMITED.labels(scope).inc()
+    return retry_after
+
+
+class RateLimitThrottle(BaseThrottle):
+    """Throttle by client IP and by account, using the view's throttle_scope.
+
+    Limits come from RATE_LIMITS[scope], e.g. {"ip": "20/min", "user": "10/min"}.
+    The account is the authenticated user, or the email being logged in to.
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, "throttle_scope", None)
+        if not settings.RATE_LIMIT_ENABLED or scope not in settings.RATE_LIMITS:
+            self.retry_after = 0
+            return True
+        self.retry_after = check_limits(
+            scope, self.get_ident(request), self.get_account(request)
+        )
+        return not self.retry_after
+
+    def get_account(self, request):
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return account_key(user=user)
+        data = request.data if hasattr(request.data, "get") else {}
+        return account_key(email=data.get("email"))
+
+    def wait(self):
+        return self.retry_after or None
+
+
+def account_key(user=None, email=None):
+    if user is not None:
+        return f"id:{user.pk}"
+    if isinstance(email, str) and email.strip():
+        return f"email:{email.strip().lower()}"
+    return None
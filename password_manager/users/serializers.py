@@ -52,6 +52,20 @@ class PasswordSerializer(serializers.ModelSerializer):
             "password",
             "link",
         ]  # Fields for storing passwords and associated info
+        extra_kwargs = {"password": {"max_length": 255}}
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data["password"] = instance.get_password()  # Never expose the ciphertext
+        return data
+
+
+class PasswordSyncSerializer(PasswordSerializer):
+    class Meta(PasswordSerializer.Meta):
+        fields = PasswordSerializer.Meta.fields + [
+            "id",
+            "updated_at",
+        ]  # Clients merge synced entries by id
 
 
 class ImageUploadSerializer(serializers.ModelSerializer):
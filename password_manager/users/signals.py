@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .db_pool import set_tenant_search_path
+from .authentication import forget_user
+from .instrumentation import install_query_counter
+from .models import CustomUser, Image, Password, PasswordTombstone
+
+connection_created.connect(set_tenant_search_path)
+connection_created.connect(install_query_counter)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Password resets, deactivation and profile edits apply to the next request
+    forget_user(instance.pk)
+
+
+@receiver(post_delete, sender=Password)
+def record_password_tombstone(sender, instance, origin=None, **kwargs):
+    # Only deletions of passwords themselves; a deleted user takes its vault along
+    origin_model = getattr(origin, "model", None) or type(origin)
+    if origin_model is not Password:
+        return
+    PasswordTombstone.objects.create(user_id=instance.user_id, password_id=instance.pk)
+
+
+@receiver(post_delete, sender=Image)
+def delete_image_files(sender, instance, **kwargs):
+    # Face images are biometric data and MEDIA_ROOT is served publicly, so the
+    # files go with the row, once the deletion is committed
+    files = [file for file in (instance.image, instance.original) if file]
+
+    def delete_files():
+        for file in files:
+            file.storage.delete(file.name)
+
+    transaction.on_commit(delete_files)
@@ -0,0 +1,81 @@
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+def wants_stream(request):
+    """True when the client asked for an NDJSON stream with ?stream=ndjson."""
+    return request.query_params.get("stream", "").lower() in ("1", "true", "ndjson")
+
+
+def iter_chunks(queryset, chunk_size=None):
+    """Yield lists of rows as they are fetched, VAULT_STREAM_CHUNK_SIZE at a time."""
+    chunk = []
+    chunk_size = chunk_size or settings.VAULT_STREAM_CHUNK_SIZE
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(instance)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_ndjson(queryset, serializer, prepare=None):
+    # Rows are fetched chunk by chunk and written out as soon as they arrive;
+    # prepare(chunk) gets a chance to process each chunk in one pass first
+    for chunk in iter_chunks(queryset):
+        if prepare is not None:
+            prepare(chunk)
+        for instance in chunk:
+            yield json.dumps(
+                serializer.to_representation(instance), cls=DjangoJSONEncoder
+            )
+            yield "\n"
+
+
+def ndjson_response(queryset, serializer, prepare=None, **kwargs):
+    """Stream a queryset as newline-delimited JSON, one serialized row per line."""
+    return StreamingHttpResponse(
+        iter_ndjson(queryset, serializer, prepare),
+        content_type=NDJSON_CONTENT_TYPE,
+        **kwargs,
+    )
+
+
+async def aiter_chunks(queryset, chunk_size=None):
+    """Async iter_chunks(), fetching rows with aiterator()."""
+    chunk = []
+    chunk_size = chunk_size or settings.VAULT_STREAM_CHUNK_SIZE
+    async for instance in queryset.aiterator(chunk_size=chunk_size):
+        chunk.append(instance)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def aiter_ndjson(queryset, serializer, prepare=None):
+    # Like iter_ndjson(), but prepare(chunk) is awaited
+    async for chunk in aiter_chunks(queryset):
+        if prepare is not None:
+            await prepare(chunk)
+        yield "".join(
+            json.dumps(serializer.to_representation(instance), cls=DjangoJSONEncoder)
+            + "\n"
+            for instance in chunk
+        )
+
+
+def async_ndjson_response(queryset, serializer, prepare=None, **kwargs):
+    """ndjson_response() for async views, fetching rows with the async ORM."""
+    return StreamingHttpResponse(
+        aiter_ndjson(queryset, serializer, prepare),
+        content_type=NDJSON_CONTENT_TYPE,
+        **kwargs,
+    )
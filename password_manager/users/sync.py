@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Password, PasswordTombstone
+
+SALT = "users.sync"
+
+
+class InvalidSyncToken(ValueError):
+    """Raised for tokens that are malformed, forged or belong to another user."""
+
+
+class SyncState:
+    """Where a client is in its vault: keyset positions for changes and deletions."""
+
+    def __init__(self, changed_at, changed_id, deleted_at, deleted_id):
+        self.changed_at = changed_at
+        self.changed_id = changed_id
+        self.deleted_at = deleted_at
+        self.deleted_id = deleted_id
+
+    @classmethod
+    def initial(cls, now):
+        # A fresh client needs every entry but none of the past deletions
+        return cls(None, 0, now, 0)
+
+    @classmethod
+    def from_token(cls, token, user_id):
+        try:
+            data = signing.loads(token, salt=SALT)
+            if data["u"] != user_id:
+                raise InvalidSyncToken("Sync token belongs to another user.")
+            changed_at = datetime.fromisoformat(data["c"][0]) if data["c"][0] else None
+            deleted_at = datetime.fromisoformat(data["d"][0])
+            return cls(changed_at, int(data["c"][1]), deleted_at, int(data["d"][1]))
+        except (signing.BadSignature, KeyError, IndexError, TypeError, ValueError) as e:
+            if isinstance(e, InvalidSyncToken):
+                raise
+            raise InvalidSyncToken("Invalid sync token.") from e
+
+    def to_token(self, user_id):
+        return signing.dumps(
+            {
+                "u": user_id,
+                "c": [self.changed_at.isoformat() if self.changed_at else None, self.changed_id],
+                "d": [self.deleted_at.isoformat(), self.deleted_id],
+            },
+            salt=SALT,
+        )
+
+
+def _after(field, moment, pk):
+    # Keyset condition (field, id) > (moment, pk), served by the (user, field, id) indexes
+    return Q(**{f"{field}__gt": moment}) | Q(**{field: moment, "id__gt": pk})
+
+
+def vault_changes(user, token=None, limit=None):
+    """Return entries and deletions a client hasn't seen since its sync token.
+
+    Changes newer than VAULT_SYNC_SETTLE_SECONDS are held back for the next
+    sync, so rows from transactions that are still committing aren't skipped.
+    Longer transactions restamp their rows on commit (restamp_on_commit).
+    Returns a dict with changed (Password queryset slice), deleted ids, the
+    next token, has_more, and reset when the client must start over because
+    the tombstones it needs have been purged.
+    """
+    limit = limit or settings.VAULT_SYNC_MAX_CHANGES
+    now = timezone.now()
+    horizon = now - timedelta(seconds=settings.VAULT_SYNC_SETTLE_SECONDS)
+
+    if token:
+        state = SyncState.from_token(token, user.id)
+        retention = now - timedelta(days=settings.VAULT_TOMBSTONE_RETENTION_DAYS)
+        if state.deleted_at < retention:
+            return {"reset": True}
+    else:
+        state = SyncState.initial(horizon)
+
+    changed = Password.objects.filter(user=user, updated_at__lte=horizon)
+    if state.changed_at is not None:
+        changed = changed.filter(_after("updated_at", state.changed_at, state.changed_id))
+    changed = list(changed.order_by("updated_at", "id")[: limit + 1])
+
+    deleted = PasswordTombstone.objects.filter(
+        _after("deleted_at", state.deleted_at, state.deleted_id),
+        user=user,
+        deleted_at__lte=horizon,
+    )
+    deleted = list(
+        deleted.order_by("deleted_at", "id").values_list("id", "password_id", "deleted_at")[
+            : limit + 1
+        ]
+    )
+
+    more_changed, more_deleted = len(changed) > limit, len(deleted) > limit
+    changed, deleted = changed[:limit], deleted[:limit]
+
+    # Tokens only ever move forward. Once a list is exhausted its position
+    # jumps to the horizon, so idle clients don't age out of tombstone retention.
+    if changed:
+        state.changed_at, state.changed_id = changed[-1].updated_at, changed[-1].id
+    if not more_changed and (state.changed_at is None or state.changed_at < horizon):
+        state.changed_at, state.changed_id = horizon, 0
+    if deleted:
+        state.deleted_at, state.deleted_id = deleted[-1][2], deleted[-1][0]
+    if not more_deleted and state.deleted_at < horizon:
+        state.deleted_at, state.deleted_id = horizon, 0
+
+    return {
+        "reset": False,
+        "changed": changed,
+        "deleted": [password_id for _, password_id, _ in deleted],
+        "token": state.to_token(user.id),
+        "has_more": more_changed or more_deleted,
+    }
+
+
+def restamp_on_commit(user, since):
+    """Move updated_at of the user's entries written since `since` to commit time.
+
+    auto_now stamps a row when it is written, which in a long transaction
+    (an import) can be well before the rows become visible; a client's token
+    may have passed that time by then. Restamped rows show up in the next
+    sync instead of being skipped.
+    """
+
+    def restamp():
+        Password.objects.filter(user=user, updated_at__gte=since).update(
+            updated_at=timezone.now()
+        )
+
+    transaction.on_commit(restamp)
+
+
+def purge_tombstones():
+    """Delete tombstones older than VAULT_TOMBSTONE_RETENTION_DAYS."""
+    cutoff = timezone.now() - timedelta(days=settings.VAULT_TOMBSTONE_RETENTION_DAYS)
+    deleted, _ = PasswordTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
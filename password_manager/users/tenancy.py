@@ -0,0 +1,134 @@
+from contextvars import ContextVar
+from functools import cache, partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from .authentication import CachedJWTAuthentication
+from .lru import TTLCache
+
+DEFAULT_SCHEMA = "public"
+
+# Id of the user the current request acts for, or a function returning it,
+# set by TenantMiddleware
+_current_user_id = ContextVar("current_user_id", default=None)
+
+# Process-local record of which user schemas exist, so routing costs no queries
+_known_schemas = TTLCache(
+    maxsize=settings.TENANT_SCHEMA_CACHE_SIZE, ttl=settings.TENANT_SCHEMA_CACHE_TTL
+)
+
+
+def get_current_user_id():
+    user_id = _current_user_id.get()
+    return user_id() if callable(user_id) else user_id
+
+
+def set_current_user_id(user_id):
+    """Set the tenant for the current context; returns a token for reset.
+
+    user_id may be a function, called the first time the tenant is needed.
+    """
+    return _current_user_id.set(user_id)
+
+
+def reset_current_user_id(token):
+    _current_user_id.reset(token)
+
+
+def schema_name_for(user_id):
+    return f"user_{int(user_id)}_schema"
+
+
+def schema_exists(schema_name):
+    """Check whether a schema exists, asking the database at most once per TTL."""
+    exists = _known_schemas.get(schema_name)
+    if exists is None:
+        connection = connections["default"]
+        if connection.vendor != "postgresql":
+            exists = False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM information_schema.schemata WHERE schema_name = %s",
+                    [schema_name],
+                )
+                exists = cursor.fetchone() is not None
+        _known_schemas.set(schema_name, exists)
+    return exists
+
+
+def provision_user_schema(user):
+    """Create the user's schema. Called once at signup, never while routing."""
+    connection = connections["default"]
+    schema_name = schema_name_for(user.pk)
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE SCHEMA IF NOT EXISTS {connection.ops.quote_name(schema_name)}"
+            )
+        _known_schemas.set(schema_name, True)
+    return schema_name
+
+
+def resolve_schema(user_id=None):
+    """Return the schema for a user (the current one by default), or "public"."""
+    if user_id is None:
+        user_id = get_current_user_id()
+    if user_id is None:
+        return DEFAULT_SCHEMA
+    schema_name = schema_name_for(user_id)
+    return schema_name if schema_exists(schema_name) else DEFAULT_SCHEMA
+
+
+class TenantMiddleware:
+    """Resolve the tenant of each request from its access token.
+
+    The token is only read when a pooled connection is checked out and needs
+    its search_path (users/db_pool.py), at most once per request; requests
+    that never get there pay nothing. Only the token signature and claims
+    are checked, the user row is not fetched. DRF still performs the real
+    authentication in the view, reusing the validated token from the shared
+    token cache.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.authentication = CachedJWTAuthentication()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = set_current_user_id(cache(partial(self.get_user_id, request)))
+        try:
+            return self.get_response(request)
+        finally:
+            reset_current_user_id(token)
+
+    async def __acall__(self, request):
+        token = set_current_user_id(cache(partial(self.get_user_id, request)))
+        try:
+            return await self.get_response(request)
+        finally:
+            reset_current_user_id(token)
+
+    def get_user_id(self, request):
+        header = self.authentication.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.authentication.get_raw_token(header)
+        if raw_token is None:
+            return None
+        try:
+            validated_token = self.authentication.get_validated_token(raw_token)
+        except (InvalidToken, TokenError):
+            return None
+        return validated_token.get(api_settings.USER_ID_CLAIM)
@@ -1,3 +1,1223 @@
-from django.test import TestCase
+import asyncio
+import csv
+import http.client
+import itertools
+import json
+import tempfile
+import threading
+from concurrent.futures import Future
+from io import StringIO
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pyotp
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    PBKDF2PasswordHasher as DjangoPBKDF2PasswordHasher,
+    PBKDF2SHA1PasswordHasher,
+    check_password,
+    get_hashers,
+    make_password,
+)
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .domains import registrable_domain
+from .face import encode_face_bytes, encoding_to_bytes
+from .face_backends import FaceBackendError, RemoteFaceBackend
+from .face_pool import FacePoolBusy, detector_options
+from .db_pool import set_tenant_search_path
+from .face_worker import EncodeBatcher, make_server
+from .async_views import AsyncLoginView
+from .authentication import CachedJWTAuthentication, clear_caches, forget_user
+from .instrumentation import InstrumentationMiddleware, QueryBudgetExceeded
+from .mail import _claim_messages, dispatch_queued_mail, queue_mail
+from .models import CustomUser, Image, OutboundEmail, Password
+from .otp import current_otp, ensure_otp_secret, get_totp, verify_otp
+from .ratelimit import LocalStore, RedisStore, get_store, hit
+from .sync import SyncState, vault_changes
+from .tenancy import (
+    TenantMiddleware,
+    _known_schemas,
+    reset_current_user_id,
+    resolve_schema,
+    schema_name_for,
+    set_current_user_id,
+)
+from .vault_io import import_passwords
+from .vault_crypto import decrypt_many
+from .vault_session import issue_vault_token
+from .views import ImageListView
+
+
+_phones = itertools.count(5550000)
+
+
+def create_user(name="alice", **kwargs):
+    return CustomUser.objects.create_user(
+        username=name,
+        email=f"{name}@example.com",
+        password="correct horse battery",
+        phone=kwargs.pop("phone", str(next(_phones))),
+        **kwargs,
+    )
+
+
+def auth_headers(user):
+    return {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(user).access_token}"}
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionError("SMTP server went away")
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    MAIL_QUEUE_DISPATCH_IN_PROCESS=False,
+)
+class MailQueueTests(TestCase):
+    def queue(self, **kwargs):
+        return queue_mail("Your OTP", "Your OTP is: 123456", "a@example.com", **kwargs)
+
+    def test_locmem_backend_delivers_queued_mail(self):
+        message = self.queue()
+        self.assertEqual(len(mail.outbox), 0)  # Queued, not sent
+
+        self.assertEqual(dispatch_queued_mail(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["a@example.com"])
+
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboundEmail.STATUS_SENT)
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual(message.body, "")
+        self.assertEqual(dispatch_queued_mail(), 0)
+
+    def test_file_backend_delivers_queued_mail(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(
+                EMAIL_BACKEND="django.core.mail.backends.filebased.EmailBackend",
+                EMAIL_FILE_PATH=directory,
+            ):
+                self.queue()
+                self.assertEqual(dispatch_queued_mail(), 1)
+            [path] = Path(directory).iterdir()
+            self.assertIn("Your OTP is: 123456", path.read_text())
+
+    @override_settings(EMAIL_BACKEND="users.tests.FailingEmailBackend")
+    def test_failed_send_is_retried_later(self):
+        message = self.queue()
+        self.assertEqual(dispatch_queued_mail(), 0)
+
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboundEmail.STATUS_PENDING)
+        self.assertEqual(message.attempts, 1)
+        self.assertIn("went away", message.last_error)
+        self.assertGreater(message.next_attempt_at, timezone.now())
+
+    @override_settings(EMAIL_BACKEND="users.tests.FailingEmailBackend")
+    def test_otp_mail_is_not_retried_past_its_expiry(self):
+        message = self.queue(expires_at=timezone.now() + timedelta(seconds=5))
+        dispatch_queued_mail()
+
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboundEmail.STATUS_FAILED)
+        self.assertEqual(message.body, "")
+
+    def test_expired_mail_is_dropped_unsent(self):
+        message = self.queue(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(dispatch_queued_mail(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboundEmail.STATUS_FAILED)
+
+    def test_claim_of_a_dead_dispatcher_is_taken_over(self):
+        message = self.queue()
+        [claimed] = _claim_messages(10, timezone.now())
+        self.assertEqual(claimed.status, OutboundEmail.STATUS_SENDING)
+        # Claimed rows are not handed to another dispatcher...
+        self.assertEqual(dispatch_queued_mail(), 0)
+
+        # ...until the lease runs out
+        OutboundEmail.objects.filter(id=message.id).update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(dispatch_queued_mail(), 1)
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboundEmail.STATUS_SENT)
+        self.assertEqual(message.attempts, 2)
+
+
+class RegistrableDomainTests(TestCase):
+    def test_reduces_to_the_registered_domain(self):
+        self.assertEqual(registrable_domain("https://accounts.google.com/x"), "google.com")
+        self.assertEqual(registrable_domain("login.example.co.uk"), "example.co.uk")
+
+    def test_tenants_of_shared_hosts_are_different_sites(self):
+        for suffix in ("vercel.app", "netlify.app", "myshopify.com", "azurewebsites.net"):
+            self.assertEqual(
+                registrable_domain(f"https://victim.{suffix}/login"), f"victim.{suffix}"
+            )
+        self.assertEqual(
+            registrable_domain("bucket.s3.amazonaws.com"), "bucket.s3.amazonaws.com"
+        )
+
+    def test_hosts_without_a_public_suffix_are_kept_whole(self):
+        self.assertEqual(registrable_domain("http://localhost:8000/"), "localhost")
+        self.assertEqual(registrable_domain("10.0.0.1"), "10.0.0.1")
+        self.assertEqual(registrable_domain(""), "")
+
+
+class VaultEncryptionTests(TestCase):
+    # Plaintext that looks like the "v1:" ciphertext format
+    LOOKALIKES = ["v1:hello", "v1:" + "A" * 40]
+
+    def setUp(self):
+        self.user = create_user()
+
+    def add(self, value):
+        return Password.objects.create(
+            user=self.user, domain_name="site", password=value, link="https://site.com"
+        )
+
+    def test_values_starting_with_the_prefix_are_encrypted(self):
+        for value in self.LOOKALIKES:
+            password = self.add(value)
+            row = Password.objects.get(pk=password.pk)
+            self.assertTrue(row.encrypted)
+            self.assertNotEqual(row.password, value)
+            self.assertEqual(row.get_password(), value)
+            [row] = decrypt_many([Password.objects.get(pk=password.pk)], self.user)
+            self.assertEqual(row.get_password(), value)
+
+    def test_value_assigned_to_a_loaded_row_is_encrypted(self):
+        row = Password.objects.get(pk=self.add("first").pk)
+        row.password = "v1:hello"
+        row.save(update_fields=["password"])
+
+        row = Password.objects.get(pk=row.pk)
+        self.assertTrue(row.encrypted)
+        self.assertEqual(row.get_password(), "v1:hello")
+
+    def test_saving_a_loaded_row_does_not_encrypt_twice(self):
+        row = Password.objects.get(pk=self.add("secret").pk)
+        ciphertext = row.password
+        row.domain_name = "renamed"
+        row.save()
+        self.assertEqual(Password.objects.get(pk=row.pk).password, ciphertext)
+
+    def test_encrypt_vault_encrypts_legacy_lookalikes(self):
+        password = self.add("placeholder")
+        Password.objects.filter(pk=password.pk).update(password="v1:hello", encrypted=False)
+        self.assertEqual(Password.objects.get(pk=password.pk).get_password(), "v1:hello")
+
+        call_command("encrypt_vault", stdout=StringIO())
+        row = Password.objects.get(pk=password.pk)
+        self.assertTrue(row.encrypted)
+        self.assertEqual(row.get_password(), "v1:hello")
+
+    def test_add_and_export_a_lookalike_value(self):
+        headers = auth_headers(self.user)
+        response = self.client.post(
+            "/api/users/add_password/",
+            {"domain_name": "site", "password": "v1:hello", "link": "https://site.com"},
+            content_type="application/json",
+            **headers,
+        )
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get(
+            "/api/users/passwords/export/?file_format=ndjson",
+            HTTP_X_VAULT_TOKEN=issue_vault_token(self.user, "otp"),
+            **headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('"v1:hello"', b"".join(response.streaming_content).decode())
+
+
+@override_settings(
+    QUERY_BUDGET_STRICT=True,
+    INSTRUMENTATION_SERVER_TIMING=True,
+    RATE_LIMIT_ENABLED=False,
+    MAIL_QUEUE_DISPATCH_IN_PROCESS=False,
+)
+class QueryBudgetTests(TestCase):
+    """Budgeted views stay within their budgets; strict mode fails the request."""
+
+    def setUp(self):
+        clear_caches()
+        cache.clear()  # Face templates, keyed on ids the test database reuses
+        self.user = create_user()
+        self.headers = auth_headers(self.user)
+        Password.objects.create(
+            user=self.user, domain_name="site", password="secret", link="https://site.com"
+        )
+
+    def queries(self, response):
+        # Counted by InstrumentationMiddleware: db;dur=..;desc="N queries"
+        timing = response["Server-Timing"]
+        return int(timing.split('desc="', 1)[1].split(" ", 1)[0])
+
+    def assertQueries(self, response, expected, status=200):
+        self.assertEqual(response.status_code, status, response.content)
+        self.assertEqual(self.queries(response), expected)
+
+    def test_login(self):
+        response = self.client.post(
+            "/api/users/login/",
+            {"email": "ALICE@example.com", "password": "correct horse battery"},
+            content_type="application/json",
+        )
+        self.assertQueries(response, 1)
+
+    def test_user_detail(self):
+        self.assertQueries(self.client.get("/api/users/me/", **self.headers), 1)
+        # The user now comes from the authentication cache
+        self.assertQueries(self.client.get("/api/users/me/", **self.headers), 0)
+
+    def test_add_password(self):
+        response = self.client.post(
+            "/api/users/add_password/",
+            {"domain_name": "new", "password": "s3cret", "link": "https://new.com"},
+            content_type="application/json",
+            **self.headers,
+        )
+        self.assertQueries(response, 2, status=201)
+
+    def test_autofill(self):
+        response = self.client.get(
+            "/api/users/passwords/autofill/?host=login.site.com", **self.headers
+        )
+        self.assertQueries(response, 1)
+        self.assertEqual(len(response.json()["results"]), 1)
+
+    def test_verify_otp(self):
+        otp = current_otp(self.user)
+        response = self.client.get(f"/api/users/verify-otp/?otp={otp}", **self.headers)
+        self.assertQueries(response, 3)
+        self.assertEqual(len(response.json()["results"]), 1)
+
+    def test_sync(self):
+        otp = current_otp(self.user)
+        response = self.client.get(f"/api/users/passwords/sync/?otp={otp}", **self.headers)
+        self.assertQueries(response, 4)
+
+    def test_send_otp_email(self):
+        response = self.client.get("/api/users/send-otp-email/", **self.headers)
+        self.assertQueries(response, 3, status=202)
+
+    @override_settings(FACE_POOL_WORKERS=0)
+    def test_verify_face_id(self):
+        data = (settings.MEDIA_ROOT / "images" / "20250331004813_face.png").read_bytes()
+        encoding = encode_face_bytes(data, **detector_options())
+        Image.objects.create(
+            user=self.user, image="images/face.png", encoding=encoding_to_bytes(encoding)
+        )
+
+        def verify():
+            return self.client.post(
+                "/api/users/verify-face-id/",
+                {"image": ContentFile(data, name="face.png")},
+                **self.headers,
+            )
+
+        # User, template version and templates, then the version alone
+        self.assertQueries(verify(), 3)
+        self.assertQueries(verify(), 1)
+
+    @override_settings(QUERY_BUDGETS={"user-detail": 0})
+    def test_over_budget_raises_in_strict_mode(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get("/api/users/me/", **self.headers)
+
+    @override_settings(QUERY_BUDGETS={"user-detail": 0}, QUERY_BUDGET_STRICT=False)
+    def test_over_budget_only_warns_otherwise(self):
+        with self.assertLogs("users.instrumentation", "WARNING"):
+            response = self.client.get("/api/users/me/", **self.headers)
+        self.assertEqual(response.status_code, 200)
+
+    async def test_concurrent_async_requests_count_their_own_queries(self):
+        barrier = asyncio.Barrier(3)
+
+        async def view(request):
+            await barrier.wait()  # All three requests are in flight
+            await CustomUser.objects.filter(pk=self.user.pk).aexists()
+            await barrier.wait()
+            return HttpResponse()
+
+        middleware = InstrumentationMiddleware(view)
+        responses = await asyncio.gather(
+            *(middleware(RequestFactory().get("/")) for _ in range(3))
+        )
+        self.assertEqual([self.queries(response) for response in responses], [1, 1, 1])
+
+
+@override_settings(VAULT_SYNC_SETTLE_SECONDS=0, RATE_LIMIT_ENABLED=False)
+class VaultSyncTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.entries = [
+            Password.objects.create(
+                user=self.user, domain_name=f"site{i}", password="secret", link=f"https://site{i}.com"
+            )
+            for i in range(5)
+        ]
+
+    def sync_all(self, token=None, limit=2):
+        changed, deleted, pages = [], [], 0
+        while True:
+            changes = vault_changes(self.user, token, limit=limit)
+            changed += [entry.id for entry in changes["changed"]]
+            deleted += changes["deleted"]
+            token, pages = changes["token"], pages + 1
+            if not changes["has_more"]:
+                return changed, deleted, token, pages
+
+    def test_pages_cover_every_entry_once(self):
+        changed, deleted, token, pages = self.sync_all()
+        self.assertEqual(changed, [entry.id for entry in self.entries])
+        self.assertEqual((deleted, pages), ([], 3))
+        self.assertEqual(self.sync_all(token)[:2], ([], []))
+
+    def test_only_changes_after_the_token_are_returned(self):
+        token = self.sync_all()[2]
+        entry = self.entries[1]
+        entry.link = "https://changed.com"
+        entry.save()
+        self.assertEqual(self.sync_all(token)[:2], ([entry.id], []))
+
+    def test_deletions_come_back_as_tombstones(self):
+        token = self.sync_all()[2]
+        deleted_id = self.entries[2].id
+        self.entries[2].delete()
+        self.assertEqual(self.sync_all(token)[:2], ([], [deleted_id]))
+        # A fresh client just doesn't get the entry
+        changed, deleted, _, _ = self.sync_all()
+        self.assertNotIn(deleted_id, changed)
+        self.assertEqual(deleted, [])
+
+    def test_tokens_older_than_tombstone_retention_need_a_reset(self):
+        expired = timezone.now() - timedelta(days=settings.VAULT_TOMBSTONE_RETENTION_DAYS + 1)
+        token = SyncState(None, 0, expired, 0).to_token(self.user.id)
+        self.assertEqual(vault_changes(self.user, token), {"reset": True})
+
+        response = self.client.get(
+            "/api/users/passwords/sync/",
+            {"token": token},
+            HTTP_X_VAULT_TOKEN=issue_vault_token(self.user, "otp"),
+            **auth_headers(self.user),
+        )
+        self.assertEqual(response.status_code, 410)
+
+    def test_tokens_of_other_users_are_rejected(self):
+        token = self.sync_all()[2]
+        response = self.client.get(
+            "/api/users/passwords/sync/",
+            {"token": token},
+            HTTP_X_VAULT_TOKEN=issue_vault_token(create_user("bob"), "otp"),
+            **auth_headers(CustomUser.objects.get(username="bob")),
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_imports_committing_late_are_not_skipped(self):
+        records = [{"name": "new", "url": "https://new.com", "password": "pw"}]
+        with self.captureOnCommitCallbacks() as callbacks:
+            import_passwords(self.user, records)
+            # A client syncs past the rows' write time before the import commits
+            token = SyncState(timezone.now(), 0, timezone.now(), 0).to_token(self.user.id)
+        for callback in callbacks:
+            callback()
+
+        imported = Password.objects.get(domain_name="new")
+        self.assertEqual(self.sync_all(token)[0], [imported.id])
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class LoginHashTests(TestCase):
+    PASSWORD = "correct horse battery"
+
+    def setUp(self):
+        self.user = create_user()
+
+    def use_hash(self, hasher, **kwargs):
+        encoded = hasher.encode(self.PASSWORD, hasher.salt(), **kwargs)
+        CustomUser.objects.filter(pk=self.user.pk).update(password=encoded)
+        return encoded
+
+    def login(self, password=PASSWORD, email="alice@example.com"):
+        return self.client.post(
+            "/api/users/login/",
+            {"email": email, "password": password},
+            content_type="application/json",
+        )
+
+    def stored_hash(self):
+        return CustomUser.objects.values_list("password", flat=True).get(pk=self.user.pk)
+
+    def test_old_pbkdf2_hashes_are_rewritten_on_login(self):
+        configured = get_hashers()[0].algorithm
+        for hasher, kwargs in (
+            (DjangoPBKDF2PasswordHasher(), {"iterations": 1000}),
+            (PBKDF2SHA1PasswordHasher(), {}),
+        ):
+            with self.subTest(hasher.algorithm):
+                self.use_hash(hasher, **kwargs)
+                self.assertEqual(self.login().status_code, 200)
+                stored = self.stored_hash()
+                self.assertTrue(stored.startswith(f"{configured}$"), stored)
+                self.assertTrue(check_password(self.PASSWORD, stored))
+
+    async def test_async_login_rewrites_old_hashes_too(self):
+        await sync_to_async(self.use_hash)(DjangoPBKDF2PasswordHasher(), iterations=1000)
+        request = RequestFactory().post(
+            "/api/users/login/",
+            {"email": "alice@example.com", "password": self.PASSWORD},
+            content_type="application/json",
+        )
+        response = await AsyncLoginView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        stored = await sync_to_async(self.stored_hash)()
+        self.assertTrue(stored.startswith(f"{get_hashers()[0].algorithm}$"), stored)
+
+    def test_failed_logins_leave_the_hash_alone(self):
+        encoded = self.use_hash(DjangoPBKDF2PasswordHasher(), iterations=1000)
+        self.assertEqual(self.login("wrong password").status_code, 400)
+        self.assertEqual(self.stored_hash(), encoded)
+
+    def test_unknown_emails_still_run_the_hasher(self):
+        with mock.patch("users.views.make_password", wraps=make_password) as hash_password:
+            response = self.login(email="nobody@example.com")
+        self.assertEqual(response.status_code, 400)
+        hash_password.assert_called_once_with(self.PASSWORD)
+
+        with mock.patch("users.views.make_password", wraps=make_password) as hash_password:
+            self.login()
+        hash_password.assert_not_called()
+
+
+@override_settings(RATE_LIMIT_ENABLED=False, VAULT_PAGE_SIZE=3, VAULT_MAX_PAGE_SIZE=4)
+class VaultListingTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.headers = auth_headers(self.user)
+        for i in range(7):
+            self.add(f"site{i}")
+
+    def add(self, name):
+        return Password.objects.create(
+            user=self.user, domain_name=name, password=f"{name}-pw", link=f"https://{name}.com"
+        )
+
+    def unlock(self, **params):
+        response = self.client.get(
+            "/api/users/verify-otp/", {"otp": current_otp(self.user), **params}, **self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.headers["HTTP_X_VAULT_TOKEN"] = response["X-Vault-Token"]
+        return response
+
+    def follow(self, url):
+        response = self.client.get(url, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_follow_the_cursor_with_the_vault_token(self):
+        page = self.unlock().json()
+        names, sizes = [], []
+        while True:
+            names += [entry["domain_name"] for entry in page["results"]]
+            sizes.append(len(page["results"]))
+            if not page["next"]:
+                break
+            page = self.follow(page["next"])
+        self.assertEqual(names, [f"site{i}" for i in range(7)])
+        self.assertEqual(sizes, [3, 3, 1])
+        self.assertEqual(page["results"][0]["password"], "site6-pw")
+
+    def test_cursor_is_stable_while_the_vault_changes(self):
+        page = self.unlock().json()
+        # An entry already seen is edited and a new one added mid-listing
+        edited = Password.objects.get(domain_name="site0")
+        edited.link = "https://edited.com"
+        edited.save()
+        self.add("new")
+
+        names = []
+        while page["next"]:
+            page = self.follow(page["next"])
+            names += [entry["domain_name"] for entry in page["results"]]
+        # Nothing unseen is skipped or repeated; changes come at the end
+        self.assertEqual(names, [f"site{i}" for i in range(3, 7)] + ["site0", "new"])
+
+    def test_page_size_is_capped(self):
+        page = self.unlock(page_size=100).json()
+        self.assertEqual(len(page["results"]), 4)
+        page = self.follow("/api/users/verify-otp/?page_size=2")
+        self.assertEqual(len(page["results"]), 2)
+
+    def test_stream_returns_the_whole_vault(self):
+        response = self.unlock(stream="ndjson")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [
+                {"domain_name": f"site{i}", "password": f"site{i}-pw", "link": f"https://site{i}.com"}
+                for i in range(7)
+            ],
+        )
+
+    def test_pages_need_an_otp_or_vault_token(self):
+        page = self.unlock().json()
+        del self.headers["HTTP_X_VAULT_TOKEN"]
+        response = self.client.get(page["next"], **self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class VaultImportExportTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.headers = auth_headers(self.user)
+
+    def upload(self, name, content, **data):
+        return self.client.post(
+            "/api/users/passwords/import/",
+            {"file": ContentFile(content.encode(), name=name), **data},
+            **self.headers,
+        )
+
+    def vault(self):
+        return sorted(
+            (p.domain_name, p.link, p.get_password())
+            for p in Password.objects.filter(user=self.user)
+        )
+
+    def test_browser_and_password_manager_exports(self):
+        exports = {
+            "chrome.csv": "name,url,username,password,note\n"
+            "Mail,https://mail.com/login,me,chrome-pw,\n",
+            "firefox.csv": '"url","username","password","httpRealm"\n'
+            '"https://ff.org","me","firefox-pw",""\n',
+            "lastpass.csv": "url,username,password,totp,extra,name,grouping,fav\n"
+            "https://lp.net,me,lastpass-pw,,,LP,,0\n",
+            "1password.csv": "Title,Website,Username,Password,Notes\n"
+            "One,https://one.io,me,onepassword-pw,\n",
+            "bitwarden.json": json.dumps(
+                {
+                    "items": [
+                        {
+                            "name": "BW",
+                            "login": {"uris": [{"uri": "https://bw.com"}], "password": "bitwarden-pw"},
+                        }
+                    ]
+                }
+            ),
+            "vault.ndjson": '{"domain_name": "Nd", "link": "https://nd.dev", "password": "nd-pw"}\n\n',
+        }
+        for name, content in exports.items():
+            with self.subTest(name):
+                response = self.upload(name, content)
+                self.assertEqual(response.status_code, 201, response.content)
+                self.assertEqual(response.json()["imported"], 1)
+
+        self.assertEqual(
+            self.vault(),
+            [
+                ("BW", "https://bw.com", "bitwarden-pw"),
+                ("LP", "https://lp.net", "lastpass-pw"),
+                ("Mail", "https://mail.com/login", "chrome-pw"),
+                ("Nd", "https://nd.dev", "nd-pw"),
+                ("One", "https://one.io", "onepassword-pw"),
+                ("ff.org", "https://ff.org", "firefox-pw"),
+            ],
+        )
+        self.assertTrue(all(p.encrypted for p in Password.objects.filter(user=self.user)))
+
+    def test_bad_rows_are_reported_and_the_rest_imported(self):
+        content = "name,url,password\nGood,https://good.com,pw\nNo password,https://bad.com,\n"
+        response = self.upload("export.csv", content)
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body["imported"], body["failed"]), (1, 1))
+        self.assertEqual(body["errors"][0]["row"], 2)
+        self.assertIn("password", body["errors"][0]["errors"])
+        self.assertEqual(self.vault(), [("Good", "https://good.com", "pw")])
+
+    def test_strict_imports_save_nothing_when_a_row_is_bad(self):
+        content = "name,url,password\nGood,https://good.com,pw\nBad,https://bad.com,\n"
+        response = self.upload("export.csv", content, strict="true")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.json()["imported"], response.json()["failed"]), (0, 1))
+        self.assertEqual(self.vault(), [])
+
+    def test_unreadable_files_are_rejected(self):
+        self.assertEqual(self.upload("export.txt", "x").status_code, 400)
+        self.assertEqual(self.upload("export.json", "{not json").status_code, 400)
+        self.assertEqual(self.upload("export.json", '"a string"').status_code, 400)
+
+    def test_upload_limit_is_read_per_request(self):
+        content = "name,url,password\nGood,https://good.com,pw\n"
+        with override_settings(VAULT_IMPORT_MAX_BYTES=10):
+            self.assertEqual(self.upload("export.csv", content).status_code, 413)
+        self.assertEqual(self.upload("export.csv", content).status_code, 201)
+
+    def test_export_as_csv_and_ndjson(self):
+        for i in range(3):
+            Password.objects.create(
+                user=self.user, domain_name=f"site{i}", password=f"pw,{i}", link=f"https://site{i}.com"
+            )
+        headers = {**self.headers, "HTTP_X_VAULT_TOKEN": issue_vault_token(self.user, "otp")}
+
+        response = self.client.get("/api/users/passwords/export/", **headers)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ["domain_name", "password", "link"])
+        self.assertEqual(rows[1:], [[f"site{i}", f"pw,{i}", f"https://site{i}.com"] for i in range(3)])
+
+        response = self.client.get(
+            "/api/users/passwords/export/", {"file_format": "ndjson"}, **headers
+        )
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [
+                {"domain_name": f"site{i}", "password": f"pw,{i}", "link": f"https://site{i}.com"}
+                for i in range(3)
+            ],
+        )
+
+        # The exported CSV imports back as the same vault
+        other = create_user("bob")
+        self.headers = auth_headers(other)
+        csv_export = "\n".join(",".join(f'"{v}"' for v in row) for row in rows)
+        self.upload("vault.csv", csv_export)
+        self.assertEqual(
+            sorted((p.domain_name, p.get_password()) for p in Password.objects.filter(user=other)),
+            [(f"site{i}", f"pw,{i}") for i in range(3)],
+        )
+
+    def test_export_requires_vault_access(self):
+        response = self.client.get("/api/users/passwords/export/", **self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class TenancyTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.schema = schema_name_for(self.user.id)
+        _known_schemas.clear()
+        self.addCleanup(_known_schemas.clear)
+
+    def search_path_for(self, user_id):
+        """The statements set_tenant_search_path runs on a pooled checkout."""
+        connection = mock.MagicMock(ops=connections["default"].ops)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        token = set_current_user_id(user_id)
+        try:
+            with mock.patch("users.db_pool.is_pooled", return_value=True):
+                set_tenant_search_path(None, connection)
+        finally:
+            reset_current_user_id(token)
+        return [call.args[0] for call in cursor.execute.call_args_list]
+
+    def test_checkouts_use_the_tenant_schema(self):
+        _known_schemas.set(self.schema, True)
+        self.assertEqual(
+            self.search_path_for(self.user.id),
+            [f'SET search_path TO "{self.schema}", public'],
+        )
+
+    def test_checkouts_without_a_tenant_schema_stay_on_public(self):
+        self.assertEqual(self.search_path_for(None), [])
+        _known_schemas.set(self.schema, False)
+        self.assertEqual(self.search_path_for(self.user.id), [])
+
+    def test_middleware_takes_the_tenant_from_the_access_token(self):
+        _known_schemas.set(self.schema, True)
+        schemas = []
+
+        def view(request):
+            schemas.append(resolve_schema())
+            return HttpResponse()
+
+        middleware = TenantMiddleware(view)
+        factory = RequestFactory()
+        middleware(factory.get("/", **auth_headers(self.user)))
+        middleware(factory.get("/"))
+        middleware(factory.get("/", HTTP_AUTHORIZATION="Bearer not-a-token"))
+        self.assertEqual(schemas, [self.schema, "public", "public"])
+        self.assertEqual(resolve_schema(), "public")  # Reset after the request
+
+    def test_middleware_reads_the_token_only_when_needed(self):
+        middleware = TenantMiddleware(lambda request: HttpResponse())
+        with mock.patch.object(
+            middleware.authentication, "get_validated_token"
+        ) as validate:
+            middleware(RequestFactory().get("/", **auth_headers(self.user)))
+        validate.assert_not_called()
+
+
+class FakeRedis:
+    """The part of the redis-py client RedisStore uses, shared like a server."""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, server):
+        self.server = server
+        self.commands = []
+
+    def incr(self, key):
+        self.commands.append(lambda: self._incr(key))
+
+    def expire(self, key, seconds):
+        self.commands.append(lambda: self.server.ttls.__setitem__(key, seconds) or True)
+
+    def get(self, key):
+        self.commands.append(lambda: self.server.data.get(key))
+
+    def _incr(self, key):
+        self.server.data[key] = int(self.server.data.get(key, 0)) + 1
+        return self.server.data[key]
+
+    def execute(self):
+        return [command() for command in self.commands]
+
+
+class RateLimitStoreTests(TestCase):
+    def test_redis_store_is_shared_between_processes(self):
+        server = FakeRedis()
+        worker_a, worker_b = RedisStore(server), RedisStore(server)
+        now = 1_000_000.0
+        for _ in range(2):
+            self.assertEqual(hit("login:ip:1.2.3.4", "3/min", now, worker_a), 0)
+        self.assertEqual(hit("login:ip:1.2.3.4", "3/min", now, worker_b), 0)
+        # The fourth hit is over the limit, whichever worker counts it
+        self.assertGreater(hit("login:ip:1.2.3.4", "3/min", now, worker_a), 0)
+        self.assertEqual(set(server.ttls.values()), {120})
+
+    def test_redis_store_slides_into_the_next_window(self):
+        store = RedisStore(FakeRedis())
+        minute = 60 * 16667
+        for _ in range(3):
+            hit("otp:user:id:1", "3/min", minute + 20, store)
+        # Halfway into the next minute, half of the 3 earlier hits still count
+        self.assertEqual(hit("otp:user:id:1", "3/min", minute + 90, store), 0)
+        self.assertGreater(hit("otp:user:id:1", "3/min", minute + 90, store), 0)
+
+    def test_local_store_drops_keys_past_their_window(self):
+        store = LocalStore(shards=1, max_keys=1000)
+        for i in range(100):
+            store.incr(f"ip:{i}", 60, 0.0)
+        self.assertEqual(len(store), 100)
+        store.incr("ip:new", 60, 600.0)
+        self.assertEqual(len(store), 1)
+
+    def test_local_store_is_bounded(self):
+        store = LocalStore(shards=2, max_keys=10)
+        for i in range(1000):
+            store.incr(f"ip:{i}", 60, 0.0)
+        self.assertLessEqual(len(store), 10)
+        # The most recently hit keys are kept
+        self.assertEqual(store.incr("ip:999", 60, 0.0), (0, 2))
+
+
+@override_settings(RATE_LIMITS={"login": {"ip": "3/min"}})
+class ClientIpTests(TestCase):
+    def setUp(self):
+        get_store().clear()
+
+    def login(self, i, forwarded_for):
+        return self.client.post(
+            "/api/users/login/",
+            {"email": f"user{i}@example.com", "password": "wrong"},
+            content_type="application/json",
+            HTTP_X_FORWARDED_FOR=forwarded_for,
+        )
+
+    def test_forwarded_for_is_ignored_without_proxies(self):
+        statuses = [self.login(i, f"10.0.0.{i}").status_code for i in range(4)]
+        self.assertEqual(statuses, [400, 400, 400, 429])
+
+    def test_forwarded_for_is_trusted_behind_proxies(self):
+        rest_framework = {**settings.REST_FRAMEWORK, "NUM_PROXIES": 1}
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            statuses = [self.login(i, f"10.0.0.{i}").status_code for i in range(4)]
+        self.assertEqual(statuses, [400] * 4)
+
+
+@override_settings(OTP_INTERVAL=30, OTP_VALID_WINDOW=2, OTP_MAX_FAILURES=3)
+class OtpTests(TestCase):
+    NOW = 1_800_000_000.0
+
+    def setUp(self):
+        self.user = create_user()
+        self.totp = get_totp(ensure_otp_secret(self.user))
+
+    def code(self, steps=0):
+        return self.totp.at(self.NOW + steps * 30)
+
+    def wrong_code(self):
+        return "000000" if self.code() != "000000" else "111111"
+
+    def verify(self, code):
+        return verify_otp(self.user, code, now=self.NOW)
+
+    def test_codes_within_the_drift_window_are_accepted(self):
+        self.assertEqual(self.verify(self.code(-2)), "valid")
+        self.assertEqual(self.verify(self.code(-1)), "valid")
+        self.assertEqual(self.verify(self.code(2)), "valid")
+
+    def test_codes_outside_the_drift_window_are_rejected(self):
+        self.assertEqual(self.verify(self.code(-3)), "invalid")
+        self.assertEqual(self.verify(self.code(3)), "invalid")
+
+    def test_a_code_is_accepted_once(self):
+        code = self.code()
+        self.assertEqual(self.verify(code), "valid")
+        self.assertEqual(self.verify(code), "replayed")
+
+    def test_codes_older_than_the_last_accepted_one_are_replays(self):
+        self.assertEqual(self.verify(self.code(1)), "valid")
+        self.assertEqual(self.verify(self.code(-1)), "replayed")
+
+    def test_repeated_failures_lock_out_valid_codes(self):
+        for _ in range(3):
+            self.assertEqual(self.verify(self.wrong_code()), "invalid")
+        self.assertEqual(self.verify(self.code()), "locked")
+
+        # Once the lockout has passed, a right code works again
+        CustomUser.objects.filter(pk=self.user.pk).update(
+            otp_locked_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.verify(self.code()), "valid")
+
+    def test_locked_accounts_do_not_tell_right_codes_from_wrong_ones(self):
+        for _ in range(3):
+            self.verify(self.wrong_code())
+        self.assertEqual(self.verify(self.wrong_code()), "locked")
+        self.assertEqual(self.verify(self.code(1)), "locked")
+
+        # Also when the user object predates the lockout, e.g. from a cache
+        self.user = CustomUser.objects.get(pk=self.user.pk)
+        self.user.otp_locked_until = None
+        self.assertEqual(self.verify(self.wrong_code()), "locked")
+        self.assertEqual(self.verify(self.code(1)), "locked")
+
+    def test_a_valid_code_resets_the_failure_count(self):
+        self.verify(self.wrong_code())
+        self.verify(self.wrong_code())
+        self.assertEqual(self.verify(self.code()), "valid")
+        self.verify(self.wrong_code())
+        self.assertEqual(self.verify(self.code(1)), "valid")
+
+    @override_settings(RATE_LIMIT_ENABLED=False)
+    def test_locked_out_vault_answers_429(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(
+            otp_locked_until=timezone.now() + timedelta(minutes=5)
+        )
+        response = self.client.get(
+            f"/api/users/verify-otp/?otp={current_otp(self.user)}",
+            **auth_headers(self.user),
+        )
+        self.assertEqual(response.status_code, 429)
+
+
+@override_settings(
+    FACE_POOL_WORKERS=0,
+    FACE_UPLOAD_KEEP_ORIGINAL=True,
+    RATE_LIMIT_ENABLED=False,
+)
+class FaceEnrollmentTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        path = settings.MEDIA_ROOT / "images" / "20250331004813_face.png"
+        cls.face = path.read_bytes()
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=Path(media.name))
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        cache.clear()
+        self.user = create_user()
+        self.headers = auth_headers(self.user)
+
+    def enroll(self):
+        return self.client.post(
+            "/api/users/image-upload/",
+            {"image": ContentFile(self.face, name="face.png")},
+            **self.headers,
+        )
+
+    def verify(self):
+        return self.client.post(
+            "/api/users/verify-face-id/",
+            {"image": ContentFile(self.face, name="face.png")},
+            **self.headers,
+        )
+
+    def stored_files(self):
+        return sorted(p for p in Path(settings.MEDIA_ROOT).rglob("*") if p.is_file())
+
+    def test_several_templates_and_deleting_one(self):
+        self.assertEqual(self.enroll().status_code, 201)
+        self.assertEqual(self.enroll().status_code, 201)
+        first, second = Image.objects.filter(user=self.user).order_by("id")
+        self.assertEqual(len(self.stored_files()), 4)  # Image and original each
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f"/api/users/image/{first.pk}/", **self.headers)
+        self.assertEqual(response.status_code, 204)
+
+        self.assertEqual(
+            self.stored_files(),
+            sorted(Path(file.path) for file in (second.image, second.original)),
+        )
+        listing = self.client.get("/api/users/image/", **self.headers).json()
+        self.assertEqual([image["id"] for image in listing], [second.pk])
+        self.assertEqual(self.verify().status_code, 200)
+
+    def test_face_service_errors_are_502(self):
+        error = FaceBackendError("Face recognition service answered 403: Invalid token.")
+        with mock.patch("users.face_backends.encode", side_effect=error):
+            with self.assertLogs("users.views", "ERROR"):
+                self.assertEqual(self.enroll().status_code, 502)
+            Image.objects.create(
+                user=self.user, image="images/face.png", encoding=encoding_to_bytes(np.zeros(128))
+            )
+            with self.assertLogs("users.views", "ERROR"):
+                response = self.verify()
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.json(), {"error": "Face recognition failed, please try again."})
+
+        with mock.patch("users.face_backends.encode_many", side_effect=error):
+            with self.assertLogs("users.views", "ERROR"):
+                response = self.client.post(
+                    "/api/users/verify-face-id/batch/",
+                    {"images": [ContentFile(self.face, name="face.png")]},
+                    **self.headers,
+                )
+        self.assertEqual(response.status_code, 502)
+
+    def test_batch_frames_without_a_face_count_as_misses(self):
+        self.enroll()
+
+        def batch(good, junk):
+            frames = [ContentFile(self.face, name="face.png") for _ in range(good)]
+            frames += [ContentFile(b"junk", name="junk.png") for _ in range(junk)]
+            response = self.client.post(
+                "/api/users/verify-face-id/batch/", {"images": frames}, **self.headers
+            )
+            self.assertEqual(response.status_code, 200)
+            return response
+
+        response = batch(1, 9)
+        self.assertEqual((response.json()["status"], response.json()["matched"]), (False, 1))
+        self.assertNotIn("X-Vault-Token", response)
+        response = batch(2, 1)
+        self.assertTrue(response.json()["status"])
+        self.assertIn("X-Vault-Token", response)
+
+    def test_only_the_owner_can_delete_an_image(self):
+        self.enroll()
+        image = Image.objects.get(user=self.user)
+        other = auth_headers(create_user("bob"))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f"/api/users/image/{image.pk}/", **other)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(self.stored_files()), 2)
+
+
+@override_settings(JWT_LEAN_USERS=True, RATE_LIMIT_ENABLED=False)
+class AuthenticationCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = create_user()
+        self.auth = CachedJWTAuthentication()
+        self.raw_token = str(RefreshToken.for_user(self.user).access_token).encode()
+
+    def get_user(self):
+        return self.auth.get_user(self.auth.get_validated_token(self.raw_token))
+
+    def test_tokens_are_validated_once(self):
+        with mock.patch(
+            "rest_framework_simplejwt.authentication.JWTAuthentication.get_validated_token",
+            wraps=super(CachedJWTAuthentication, self.auth).get_validated_token,
+        ) as validate:
+            self.auth.get_validated_token(self.raw_token)
+            self.auth.get_validated_token(self.raw_token)
+        self.assertEqual(validate.call_count, 1)
+
+    def test_users_are_cached_until_saved(self):
+        with self.assertNumQueries(1):
+            self.get_user()
+        with self.assertNumQueries(0):
+            user = self.get_user()
+        user.first_name = "changed"  # Each request gets its own copy
+        self.assertEqual(self.get_user().first_name, "")
+
+        self.user.first_name = "Alice"
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_user().first_name, "Alice")
+
+    def test_deactivated_users_are_refused(self):
+        self.get_user()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.get_user()
+
+    def test_forget_user_after_update(self):
+        self.get_user()
+        CustomUser.objects.filter(pk=self.user.pk).update(first_name="Bob")
+        self.assertEqual(self.get_user().first_name, "")
+        forget_user(self.user.pk)
+        self.assertEqual(self.get_user().first_name, "Bob")
+
+    def test_reads_get_a_lean_user_without_a_query(self):
+        request = mock.Mock(method="GET", parser_context={"view": ImageListView()})
+        request.META = {"HTTP_AUTHORIZATION": f"Bearer {self.raw_token.decode()}"}
+        with self.assertNumQueries(0):
+            user, _ = self.auth.authenticate(request)
+        self.assertIsInstance(user, TokenUser)
+        self.assertEqual(user.id, self.user.id)
+
+    def test_inactive_users_cannot_write(self):
+        password = Password.objects.create(
+            user=self.user, domain_name="site", password="secret", link="https://site.com"
+        )
+        headers = auth_headers(self.user)
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        clear_caches()
+
+        response = self.client.delete(f"/api/users/passwords/{password.pk}/", **headers)
+        self.assertEqual(response.status_code, 401)
+        response = self.client.patch(
+            f"/api/users/passwords/{password.pk}/",
+            {"link": "https://evil.com"},
+            content_type="application/json",
+            **headers,
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(Password.objects.filter(pk=password.pk).exists())
+
+    def test_otp_secret_created_in_another_process(self):
+        cached = self.get_user()
+        # Another process creates the secret, and its forget_user() can't
+        # reach this process's cache
+        CustomUser.objects.filter(pk=self.user.pk).update(otp_secret=pyotp.random_base32())
+        secret = CustomUser.objects.get(pk=self.user.pk).otp_secret
+        self.assertIsNone(self.get_user().otp_secret)
+
+        self.assertEqual(verify_otp(cached, get_totp(secret).now()), "valid")
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).otp_failures, 0)
+
+
+def fake_encode(data, **options):
+    if data == b"boom":
+        raise RuntimeError("encoder crashed")
+    return np.zeros(128)
+
+
+@override_settings(FACE_POOL_WORKERS=0)
+class FaceWorkerTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.batcher = EncodeBatcher(batch_size=8, batch_wait=0.01)
+        cls.server = make_server(cls.batcher, ("127.0.0.1", 0), token="secret")
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def post(self, query):
+        connection = http.client.HTTPConnection("127.0.0.1", self.server.server_port)
+        connection.request(
+            "POST", f"/encode?{query}", body=b"x", headers={"Authorization": "Bearer secret"}
+        )
+        return connection.getresponse().status
+
+    @mock.patch("users.face.encode_face_bytes", fake_encode)
+    def test_bad_frame_only_fails_its_own_request(self):
+        items = [(None, data, Future()) for data in (b"ok", b"boom", b"ok")]
+        with self.assertLogs("users.face_worker", "ERROR"):
+            self.batcher._encode_batch({}, items)
+
+        ok, boom, ok_too = (future for _, _, future in items)
+        self.assertIsNone(ok.result()[1])
+        self.assertIsNone(ok_too.result()[1])
+        self.assertIsInstance(boom.exception(), RuntimeError)
+
+    @mock.patch("users.face.encode_face_bytes", fake_encode)
+    def test_unexpected_error_is_a_500(self):
+        backend = RemoteFaceBackend(self.url, timeout=5, token="secret")
+        self.assertEqual(backend.encode_many([b"ok"])[0][1], None)
+        with self.assertLogs("users.face_worker", "ERROR"):
+            with self.assertRaisesMessage(FaceBackendError, "500"):
+                backend.encode(b"boom")
+
+    def test_invalid_max_edge_is_rejected(self):
+        self.assertEqual(self.post("max_edge=big"), 400)
+        self.assertEqual(self.post("max_edge=0"), 400)
+        self.assertEqual(self.post("max_edge=-5"), 400)
+
+    def test_negative_content_length_is_rejected(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.server.server_port)
+        connection.putrequest("POST", "/encode")
+        connection.putheader("Content-Length", "-1")
+        connection.putheader("Authorization", "Bearer secret")
+        connection.endheaders()
+        self.assertEqual(connection.getresponse().status, 400)
+
+    def test_saturated_batcher_turns_frames_away(self):
+        taken = 0
+        while self.batcher._slots.acquire(blocking=False):
+            taken += 1
+        try:
+            with self.assertRaises(FacePoolBusy):
+                self.batcher.encode([b"ok"], {})
+        finally:
+            for _ in range(taken):
+                self.batcher._slots.release()
+
+    def test_only_busy_answers_mean_busy(self):
+        with self.assertRaisesMessage(FaceBackendError, "403"):
+            RemoteFaceBackend(self.url, timeout=5, token="wrong").encode(b"ok")
+
+        busy = FacePoolBusy("Face recognition pool is saturated.")
+        with mock.patch.object(self.batcher, "encode", side_effect=busy):
+            with self.assertRaises(FacePoolBusy):
+                RemoteFaceBackend(self.url, timeout=5, token="secret").encode(b"ok")
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from .views import (
@@ -6,22 +7,59 @@ from .views import (
     UserDetailView,
     VerifyOtpView,
     SendOtpEmailView,
+    OtpDeliveryStatusView,
     AddPasswordView,
+    ImportPasswordsView,
+    ExportPasswordsView,
+    PasswordDetailView,
+    AutofillView,
+    SyncPasswordsView,
     ImageUploadView,
     ImageListView,
+    ImageDetailView,
     VerifyFaceId,
+    VerifyFaceIdBatch,
+    DatabasePoolStatsView,
+    RequestMetricsView,
 )
 from rest_framework_simplejwt.views import TokenRefreshView
 
+if settings.ASYNC_VIEWS:
+    # Same URLs and responses, served without a thread per request under ASGI
+    from .async_views import (
+        AsyncLoginView as LoginView,
+        AsyncSendOtpEmailView as SendOtpEmailView,
+        AsyncVerifyFaceId as VerifyFaceId,
+        AsyncVerifyOtpView as VerifyOtpView,
+    )
+
 urlpatterns = [
     path("signup/", SignupView.as_view(), name="signup"),
     path("login/", LoginView.as_view(), name="login"),
     path("me/", UserDetailView.as_view(), name="user-detail"),
+    path("db-pool-stats/", DatabasePoolStatsView.as_view(), name="db_pool_stats"),
+    path("request-metrics/", RequestMetricsView.as_view(), name="request_metrics"),
     path("token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("verify-otp/", VerifyOtpView.as_view(), name="verify_otp"),
     path("send-otp-email/", SendOtpEmailView.as_view(), name="send_otp_email"),
+    path(
+        "send-otp-email/<uuid:delivery_id>/",
+        OtpDeliveryStatusView.as_view(),
+        name="otp_delivery_status",
+    ),
     path("add_password/", AddPasswordView.as_view(), name="add_password"),
+    path("passwords/import/", ImportPasswordsView.as_view(), name="import_passwords"),
+    path("passwords/export/", ExportPasswordsView.as_view(), name="export_passwords"),
+    path("passwords/sync/", SyncPasswordsView.as_view(), name="sync_passwords"),
+    path("passwords/autofill/", AutofillView.as_view(), name="autofill"),
+    path("passwords/<int:pk>/", PasswordDetailView.as_view(), name="password_detail"),
     path("image-upload/", ImageUploadView.as_view(), name="image_upload"),
     path("image/", ImageListView.as_view(), name="view_image"),
+    path("image/<int:pk>/", ImageDetailView.as_view(), name="delete_image"),
     path("verify-face-id/", VerifyFaceId.as_view(), name="verify_face_id"),
+    path(
+        "verify-face-id/batch/",
+        VerifyFaceIdBatch.as_view(),
+        name="verify_face_id_batch",
+    ),
 ]
@@ -0,0 +1,161 @@
+import base64
+import os
+from functools import lru_cache
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from django.conf import settings
+
+from .authentication import forget_user
+from .lru import TTLCache
+
+# Envelope encryption for Password.password:
+#   master key (VAULT_MASTER_KEY, or derived once from SECRET_KEY)
+#     -> wraps one random data key per user (CustomUser.vault_key)
+#       -> encrypts each stored password as "v1:" + base64(nonce + ciphertext)
+# Whether a row is encrypted is kept in Password.encrypted, never guessed
+# from the value: a user's password may well start with "v1:".
+
+PREFIX = "v1:"
+NONCE_SIZE = 12
+KEY_SIZE = 32
+
+# Unwrapped data keys by user id, so a listing never unwraps more than once
+_data_keys = TTLCache(
+    maxsize=settings.VAULT_KEY_CACHE_SIZE, ttl=settings.VAULT_KEY_CACHE_TTL
+)
+
+
+class VaultKeyError(Exception):
+    """Raised when a user's data key cannot be unwrapped with the master key."""
+
+
+def derive_master_key():
+    """Return the master key, running the KDF when none is configured."""
+    if settings.VAULT_MASTER_KEY:
+        key = base64.urlsafe_b64decode(settings.VAULT_MASTER_KEY)
+        if len(key) != KEY_SIZE:
+            raise ValueError("VAULT_MASTER_KEY must be 32 bytes, base64 encoded.")
+        return key
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=KEY_SIZE,
+        salt=b"password-manager-vault-master",
+        iterations=settings.VAULT_KDF_ITERATIONS,
+    )
+    return kdf.derive(settings.SECRET_KEY.encode())
+
+
+@lru_cache(maxsize=1)
+def get_master_key():
+    return derive_master_key()
+
+
+def _user_aad(user_id, purpose):
+    # Binds ciphertext to its owner, so rows can't be moved between users
+    return f"{purpose}:{int(user_id)}".encode()
+
+
+def wrap_key(data_key, user_id, master_key=None):
+    nonce = os.urandom(NONCE_SIZE)
+    aesgcm = AESGCM(master_key or get_master_key())
+    return nonce + aesgcm.encrypt(nonce, data_key, _user_aad(user_id, "vault-key"))
+
+
+def unwrap_key(wrapped, user_id, master_key=None):
+    wrapped = bytes(wrapped)
+    aesgcm = AESGCM(master_key or get_master_key())
+    try:
+        return aesgcm.decrypt(
+            wrapped[:NONCE_SIZE], wrapped[NONCE_SIZE:], _user_aad(user_id, "vault-key")
+        )
+    except InvalidTag as e:
+        raise VaultKeyError(f"Cannot unwrap the vault key of user {user_id}.") from e
+
+
+def _load_wrapped_key(user_id, user=None):
+    """Return the user's wrapped key, creating one the first time it is needed."""
+    from .models import CustomUser
+
+    wrapped = getattr(user, "vault_key", None) if user is not None else None
+    if wrapped is None:
+        wrapped = (
+            CustomUser.objects.filter(pk=user_id)
+            .values_list("vault_key", flat=True)
+            .first()
+        )
+    if wrapped is not None:
+        return bytes(wrapped)
+
+    wrapped = wrap_key(AESGCM.generate_key(bit_length=256), user_id)
+    # Only the first writer wins; a concurrent request reads the stored key back
+    created = CustomUser.objects.filter(pk=user_id, vault_key__isnull=True).update(
+        vault_key=wrapped
+    )
+    if not created:
+        wrapped = bytes(
+            CustomUser.objects.filter(pk=user_id)
+            .values_list("vault_key", flat=True)
+            .get()
+        )
+    forget_user(user_id)  # The cached user has no vault_key yet
+    if user is not None:
+        user.vault_key = wrapped
+    return wrapped
+
+
+def get_data_key(user_id, user=None):
+    """Return the user's unwrapped data key, from the cache when possible."""
+    key = _data_keys.get(user_id)
+    if key is None:
+        key = unwrap_key(_load_wrapped_key(user_id, user), user_id)
+        _data_keys.set(user_id, key)
+    return key
+
+
+def forget_data_key(user_id):
+    _data_keys.delete(user_id)
+
+
+def encrypt_value(plaintext, user_id, key=None):
+    key = key or get_data_key(user_id)
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = AESGCM(key).encrypt(
+        nonce, plaintext.encode(), _user_aad(user_id, "password")
+    )
+    return PREFIX + base64.urlsafe_b64encode(nonce + ciphertext).decode()
+
+
+def decrypt_value(value, user_id, key=None, aesgcm=None):
+    if not value.startswith(PREFIX):
+        raise ValueError("Not an encrypted vault value.")
+    blob = base64.urlsafe_b64decode(value[len(PREFIX):])
+    aesgcm = aesgcm or AESGCM(key or get_data_key(user_id))
+    return aesgcm.decrypt(
+        blob[:NONCE_SIZE], blob[NONCE_SIZE:], _user_aad(user_id, "password")
+    ).decode()
+
+
+def decrypt_many(passwords, user=None):
+    """Decrypt a batch of Password rows in place, fetching each user's key once.
+
+    Sets the plaintext that Password.get_password() returns, so serializing
+    the batch afterwards does no further key work.
+    """
+    ciphers = {}
+    for password in passwords:
+        aesgcm = ciphers.get(password.user_id)
+        if aesgcm is None:
+            owner = user if user is not None and user.pk == password.user_id else None
+            aesgcm = ciphers[password.user_id] = AESGCM(
+                get_data_key(password.user_id, owner)
+            )
+        if password.has_ciphertext():
+            password._plaintext = decrypt_value(
+                password.password, password.user_id, aesgcm=aesgcm
+            )
+        else:
+            password._plaintext = password.password  # Legacy plaintext row
+    return passwords
@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+import os
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .domains import registrable_domain
+from .models import Password
+from .serializers import PasswordSerializer
+from .streaming import iter_chunks
+from .sync import restamp_on_commit
+from .vault_crypto import decrypt_many
+
+# Header names used by common password manager and browser exports
+# (Chrome, Firefox, Safari, Bitwarden, LastPass, 1Password), lowercased
+COLUMN_ALIASES = {
+    "domain_name": ("domain_name", "name", "title"),
+    "password": ("password", "login_password"),
+    "link": ("link", "url", "login_uri", "website"),
+}
+
+EXPORT_FIELDS = ["domain_name", "password", "link"]
+
+
+class ImportFormatError(ValueError):
+    """Raised when an import file cannot be parsed at all."""
+
+
+def detect_format(filename, requested=None):
+    """Pick csv, json or ndjson from an explicit choice or the file extension."""
+    if requested:
+        file_format = requested.lower()
+    else:
+        file_format = os.path.splitext(filename or "")[1].lstrip(".").lower()
+        file_format = {"jsonl": "ndjson"}.get(file_format, file_format)
+    if file_format not in ("csv", "json", "ndjson"):
+        raise ImportFormatError("Unsupported file format, use csv, json or ndjson.")
+    return file_format
+
+
+def _pick(record, field):
+    for alias in COLUMN_ALIASES[field]:
+        value = record.get(alias)
+        if value:
+            return value.strip() if isinstance(value, str) else value
+    return None
+
+
+def normalize_record(record):
+    """Map one exported entry onto the fields of PasswordSerializer."""
+    record = {str(k).strip().lower(): v for k, v in record.items() if k is not None}
+
+    # Bitwarden JSON nests the login data
+    login = record.get("login")
+    if isinstance(login, dict):
+        uris = login.get("uris") or []
+        record.setdefault("password", login.get("password"))
+        if uris and isinstance(uris[0], dict):
+            record.setdefault("url", uris[0].get("uri"))
+
+    entry = {field: _pick(record, field) for field in COLUMN_ALIASES}
+    # Firefox exports have no name column; fall back to the site's host
+    if not entry["domain_name"] and entry["link"]:
+        entry["domain_name"] = urlsplit(entry["link"]).hostname
+    return {field: value for field, value in entry.items() if value is not None}
+
+
+def iter_records(upload, file_format):
+    """Yield raw records from an uploaded file, reading CSV and NDJSON lazily."""
+    text = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+    try:
+        if file_format == "csv":
+            yield from csv.DictReader(text)
+        elif file_format == "ndjson":
+            for line in text:
+                if line.strip():
+                    yield _loads(line)
+        else:
+            data = _loads(text.read())
+            if isinstance(data, dict):
+                data = data.get("items", [])  # Bitwarden JSON export
+            if not isinstance(data, list):
+                raise ImportFormatError("JSON imports must be a list of entries.")
+            yield from data
+    finally:
+        text.detach()  # Leave closing the upload to Django
+
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ImportFormatError(f"Invalid JSON: {e}") from e
+
+
+def import_passwords(user, records, batch_size=None, strict=False):
+    """Validate records one by one and bulk insert the valid ones in batches.
+
+    Everything runs in one transaction, and the imported entries are
+    restamped when it commits so sync clients don't miss them. Returns
+    (imported, errors), where errors lists {"row": n, "errors": {...}} for
+    rejected rows. In strict mode nothing is saved when any row is rejected.
+    """
+    batch_size = batch_size or settings.VAULT_IMPORT_BATCH_SIZE
+    imported = 0
+    errors = []
+    batch = []
+
+    with transaction.atomic():
+        restamp_on_commit(user, timezone.now())
+        for row, record in enumerate(records, start=1):
+            if not isinstance(record, dict):
+                errors.append({"row": row, "errors": {"non_field_errors": ["Not an object."]}})
+                continue
+            serializer = PasswordSerializer(data=normalize_record(record))
+            if not serializer.is_valid():
+                errors.append({"row": row, "errors": serializer.errors})
+                continue
+            if strict and errors:
+                continue  # Keep validating to report every bad row
+            entry = Password(user=user, **serializer.validated_data)
+            # bulk_create skips save(), so do its work here
+            entry.domain = registrable_domain(entry.link)
+            entry.encrypt_password()
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                Password.objects.bulk_create(batch)
+                imported += len(batch)
+                batch = []
+
+        if strict and errors:
+            transaction.set_rollback(True)
+            return 0, errors
+
+        if batch:
+            Password.objects.bulk_create(batch)
+            imported += len(batch)
+
+    return imported, errors
+
+
+class _Echo:
+    # csv.writer target that hands each row back instead of buffering it
+    def write(self, value):
+        return value
+
+
+def iter_csv(queryset, user=None):
+    writer = csv.writer(_Echo())
+    serializer = PasswordSerializer()
+    yield writer.writerow(EXPORT_FIELDS)
+    for chunk in iter_chunks(queryset):
+        for instance in decrypt_many(chunk, user):
+            data = serializer.to_representation(instance)
+            yield writer.writerow([data[field] for field in EXPORT_FIELDS])
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
+
+VAULT_TOKEN_HEADER = "X-Vault-Token"
+
+
+class VaultToken(Token):
+    """Short-lived proof that the user unlocked the vault with an OTP or Face ID.
+
+    Signed like the access tokens but with its own token_type, so neither
+    can be used in place of the other.
+    """
+
+    token_type = "vault"
+    lifetime = timedelta(seconds=settings.VAULT_TOKEN_LIFETIME)
+
+
+def issue_vault_token(user, method):
+    token = VaultToken.for_user(user)
+    token["method"] = method  # "otp" or "face"
+    return str(token)
+
+
+def has_vault_access(request):
+    """True when the request carries a valid vault token for its user.
+
+    Only the signature and claims are checked; no query is made.
+    """
+    raw_token = request.headers.get(VAULT_TOKEN_HEADER)
+    if not raw_token:
+        return False
+    try:
+        token = VaultToken(raw_token)
+    except TokenError:
+        return False
+    return str(token.get(api_settings.USER_ID_CLAIM)) == str(request.user.pk)
@@ -1,36 +1,112 @@
 import os
-import pyotp
-import face_recognition
-from pathlib import Path
-from datetime import datetime
+import csv
+import logging
+import numpy as np
+from functools import partial
 
 from django.conf import settings
+from django.db import connection
 from rest_framework import status
-from django.http import JsonResponse
-from django.core.mail import send_mail
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
 from rest_framework import status, permissions
 from django.template.loader import render_to_string
 from django.utils.http import urlsafe_base64_encode
-from django.contrib.auth.hashers import check_password
+from django.contrib.auth.hashers import make_password
+from django.db.models.functions import Lower
+from django.utils import timezone
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.decorators import login_required
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.decorators import api_view, permission_classes
 
 from .serializers import (
     UserSignupSerializer,
     UserSerializer,
     PasswordSerializer,
+    PasswordSyncSerializer,
     ImageUploadSerializer,
     ImageSerializer,
 )
-from .models import Password, CustomUser, Image
+from .models import Password, CustomUser, Image, OutboundEmail
+from .mail import queue_mail
+from .face import (
+    FaceDetectionError,
+    encoding_to_bytes,
+    face_distances,
+    reduce_distances,
+)
+from .face_templates import get_template_matrix
+from .tenancy import provision_user_schema
+from .db_pool import pool_stats
+from .pagination import VaultCursorPagination
+from .streaming import ndjson_response, wants_stream
+from .sync import InvalidSyncToken, vault_changes
+from .domains import registrable_domain
+from .vault_crypto import decrypt_many
+from .instrumentation import query_budget, view_stats
+from . import metrics
+from .ratelimit import RateLimitThrottle
+from .otp import code_lifetime, current_otp, verify_otp
+from .vault_session import VAULT_TOKEN_HEADER, has_vault_access, issue_vault_token
+from .vault_io import (
+    ImportFormatError,
+    detect_format,
+    import_passwords,
+    iter_csv,
+    iter_records,
+)
+from .face_backends import FaceBackendError
+from .face_pool import FacePoolBusy
+from .imaging import InvalidImage, MaxSizeUploadHandler, normalize_image
+from . import face_backends
 
 User = get_user_model()  # Get custom user model
 
+logger = logging.getLogger(__name__)
+
+
+def face_pool_busy_response():
+    # Ask the client to come back later instead of queueing more dlib work
+    return Response(
+        {"error": "Face recognition is busy, please retry shortly."},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(settings.FACE_POOL_RETRY_AFTER)},
+    )
+
+
+def face_backend_error_response(error):
+    # The face recognition service failed or refused the request
+    logger.error("Face recognition service error: %s", error)
+    return Response(
+        {"error": "Face recognition failed, please try again."},
+        status=status.HTTP_502_BAD_GATEWAY,
+    )
+
+
+class BoundedUploadMixin:
+    """Stop multipart uploads larger than the max_upload_setting while they stream in."""
+
+    max_upload_setting = "FACE_UPLOAD_MAX_BYTES"  # Read per request
+
+    def initialize_request(self, request, *args, **kwargs):
+        max_bytes = getattr(settings, self.max_upload_setting)
+        request.upload_handlers.insert(0, MaxSizeUploadHandler(request, max_bytes))
+        return super().initialize_request(request, *args, **kwargs)
+
+    def missing_image_response(self, request, what="image"):
+        if getattr(request, "upload_too_large", False):
+            return Response(
+                {"error": f"{what.capitalize()} is too large."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        return Response(
+            {"error": f"No {what} provided."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
 
 # Signup API with Face Image Processing & Secure Storage
 class SignupView(APIView):
@@ -51,6 +127,7 @@ class SignupView(APIView):
                 )
 
             user = serializer.save()
+            provision_user_schema(user)  # Schemas are only ever created here
 
             refresh = RefreshToken.for_user(user)
 
@@ -73,33 +150,46 @@ class SignupView(APIView):
 
 
 # Login API (Authenticates User Securely)
+@query_budget(2)
 class LoginView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = "login"
 
     def post(self, request):
         email = request.data.get("email", "").strip().lower()  # Convert to lowercase
         password = request.data.get("password")
 
         if not email or not password:
+            metrics.LOGIN_ATTEMPTS.labels("missing_fields").inc()
             return Response(
                 {"error": "Email and Password are required!"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        try:
-            user = User.objects.get(
-                email__iexact=email
-            )  # Case-insensitive email lookup
-        except User.DoesNotExist:
-            return Response(
-                {"error": "Invalid credentials!"}, status=status.HTTP_400_BAD_REQUEST
-            )
+        # Case-insensitive email lookup through the lower(email) index
+        user = (
+            User.objects.alias(email_lower=Lower("email"))
+            .filter(email_lower=email)
+            .first()
+        )
 
-        if not check_password(password, user.password):  # Verify the hashed password
+        with metrics.LOGIN_PASSWORD_CHECK_SECONDS.time():
+            if user is None:
+                # Hash anyway so unknown emails cost (and take) as long as known ones
+                make_password(password)
+                password_valid = False
+            else:
+                # Also upgrades the stored hash when the hasher settings changed
+                password_valid = user.check_password(password)
+        if not password_valid:  # Verify the hashed password
+            metrics.LOGIN_ATTEMPTS.labels("invalid_credentials").inc()
             return Response(
                 {"error": "Invalid credentials!"}, status=status.HTTP_400_BAD_REQUEST
             )
 
+        metrics.LOGIN_ATTEMPTS.labels("success").inc()
+
         # Generate JWT Token
         refresh = RefreshToken.for_user(user)
 
@@ -120,6 +210,7 @@ class LoginView(APIView):
 
 
 # User Profile API (Fetches Logged-in User Details)
+@query_budget(1)
 class UserDetailView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -150,7 +241,29 @@ class ApiRootView(APIView):
         )
 
 
+# Database pool statistics for this worker process (admins only)
+class DatabasePoolStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        stats = pool_stats()
+        if stats is None:
+            return Response(
+                {"pooled": False, "conn_max_age": connection.settings_dict["CONN_MAX_AGE"]}
+            )
+        return Response({"pooled": True, "pid": os.getpid(), **stats})
+
+
+class RequestMetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        """Per-view query counts and timings collected by this worker process."""
+        return Response({"pid": os.getpid(), "views": view_stats.snapshot()})
+
+
 # ✅ Add Password API (Allow authenticated users to add a password)
+@query_budget(4)
 class AddPasswordView(APIView):
     permission_classes = [
         IsAuthenticated
@@ -186,103 +299,349 @@ class AddPasswordView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class VerifyOtpView(APIView):
+class VaultAccessMixin:
+    """Return the vault token issued during the request in the X-Vault-Token header."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        vault_token = getattr(request, "vault_token", None)
+        if vault_token is not None:
+            response[VAULT_TOKEN_HEADER] = vault_token
+        return response
+
+
+def check_vault_access(request):
+    """Return an error Response unless the request may read the vault.
+
+    A vault token from an earlier unlock is enough. Otherwise the request
+    needs a valid OTP, which also issues a new vault token.
+    """
+    if has_vault_access(request):
+        return None
+
+    otp = request.query_params.get("otp")  # Get OTP from query params
+
+    if not otp:
+        metrics.OTP_VERIFICATIONS.labels("missing").inc()
+        return Response(
+            {"error": "OTP is required"}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Now verify OTP entered by the user; a code can only be used once
+    outcome = verify_otp(request.user, otp)
+    metrics.OTP_VERIFICATIONS.labels(outcome).inc()
+    if outcome == "locked":
+        return Response(
+            {"error": "Too many invalid OTPs, try again later."},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+        )
+    if outcome != "valid":
+        return Response({"error": "Invalid OTP"}, status=status.HTTP_400_BAD_REQUEST)
+
+    request.vault_token = issue_vault_token(request.user, "otp")
+    return None
+
+
+@query_budget(1)
+class AutofillView(APIView):
+    permission_classes = [IsAuthenticated]
+    lean_user = True  # Only request.user.id is used, see users/authentication.py
+
+    def get(self, request, *args, **kwargs):
+        """List the user's entries for a site (?host= or ?url=), without passwords."""
+        domain = registrable_domain(
+            request.query_params.get("host") or request.query_params.get("url")
+        )
+        if not domain:
+            return Response(
+                {"error": "host or url is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Reads only indexed columns, so PostgreSQL can answer with an index-only scan
+        matches = Password.objects.filter(
+            user_id=request.user.id, domain=domain
+        ).values("id", "domain_name", "link")
+        return Response(
+            {"domain": domain, "results": list(matches)}, status=status.HTTP_200_OK
+        )
+
+
+class PasswordDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_object(self, request, pk):
+        return Password.objects.filter(pk=pk, user_id=request.user.id).first()
+
+    def patch(self, request, pk, *args, **kwargs):
+        """Update fields of one of the user's passwords."""
+        password = self.get_object(request, pk)
+        if password is None:
+            return Response(
+                {"error": "Password not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        serializer = PasswordSerializer(password, data=request.data, partial=True)
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def delete(self, request, pk, *args, **kwargs):
+        """Delete one of the user's passwords; sync clients learn of it via a tombstone."""
+        password = self.get_object(request, pk)
+        if password is None:
+            return Response(
+                {"error": "Password not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        password.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@query_budget(4)
+class SyncPasswordsView(VaultAccessMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = "otp"
+
+    def get(self, request, *args, **kwargs):
+        """Return vault changes since the client's sync token (all entries without one)."""
+        otp_error = check_vault_access(request)
+        if otp_error is not None:
+            return otp_error
+
+        try:
+            changes = vault_changes(request.user, request.query_params.get("token"))
+        except InvalidSyncToken as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if changes["reset"]:
+            # Tombstones the client needs are gone; it has to sync from scratch
+            return Response({"reset": True}, status=status.HTTP_410_GONE)
+
+        return Response(
+            {
+                "changed": PasswordSyncSerializer(
+                    decrypt_many(changes["changed"], request.user), many=True
+                ).data,
+                "deleted": changes["deleted"],
+                "token": changes["token"],
+                "has_more": changes["has_more"],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+@query_budget(3)
+class VerifyOtpView(VaultAccessMixin, APIView):
     permission_classes = [
         IsAuthenticated
     ]  # Ensure only authenticated users can access this view
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = "otp"
 
     def get(self, request, *args, **kwargs):
         """Allow authenticated users to verify OTP and fetch passwords."""
 
-        otp = request.query_params.get("otp")  # Get OTP from query params
+        otp_error = check_vault_access(request)
+        if otp_error is not None:
+            return otp_error
 
-        if not otp:
-            return Response(
-                {"error": "OTP is required"}, status=status.HTTP_400_BAD_REQUEST
+        # Fetch passwords if OTP is valid, one page (or a stream) at a time
+        passwords = Password.objects.filter(user=request.user)
+
+        if wants_stream(request):
+            return ndjson_response(
+                passwords.order_by("updated_at", "id"),
+                PasswordSerializer(),
+                prepare=partial(decrypt_many, user=request.user),
             )
 
-        user = request.user
-        print("OTP", otp, user.otp_generated)
+        paginator = VaultCursorPagination()
+        page = paginator.paginate_queryset(passwords, request, view=self)
+        decrypt_many(page, request.user)  # One key lookup for the whole page
+        serializer = PasswordSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class ImportPasswordsView(BoundedUploadMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    max_upload_setting = "VAULT_IMPORT_MAX_BYTES"
+
+    def post(self, request, *args, **kwargs):
+        """Import many passwords from a CSV, JSON or NDJSON export in one request."""
+        if "file" not in request.FILES:
+            return self.missing_image_response(request, what="file")
+
+        upload = request.FILES["file"]
+        strict = str(request.data.get("strict", "")).lower() in ("1", "true")
+
+        try:
+            file_format = detect_format(upload.name, request.data.get("file_format"))
+            imported, errors = import_passwords(
+                request.user, iter_records(upload, file_format), strict=strict
+            )
+        except (ImportFormatError, csv.Error, UnicodeDecodeError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            {
+                "imported": imported,
+                "failed": len(errors),
+                "errors": errors[: settings.VAULT_IMPORT_MAX_ERRORS],
+            },
+            status=(
+                status.HTTP_400_BAD_REQUEST
+                if strict and errors
+                else status.HTTP_201_CREATED
+            ),
+        )
+
 
-        # Generate OTP using the user's OTP secret
-        totp = pyotp.TOTP(user.otp_secret)  # Use the user's OTP secret
+class ExportPasswordsView(VaultAccessMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = "otp"
 
-        # Now verify OTP entered by the user
-        if str(user.otp_generated) != str(otp):
+    def get(self, request, *args, **kwargs):
+        """Stream the whole vault as CSV (default) or NDJSON after an OTP check."""
+        otp_error = check_vault_access(request)
+        if otp_error is not None:
+            return otp_error
+
+        file_format = request.query_params.get("file_format", "csv").lower()
+        passwords = Password.objects.filter(user=request.user).order_by(
+            "updated_at", "id"
+        )
+
+        if file_format == "ndjson":
+            response = ndjson_response(
+                passwords,
+                PasswordSerializer(),
+                prepare=partial(decrypt_many, user=request.user),
+            )
+        elif file_format == "csv":
+            response = StreamingHttpResponse(
+                iter_csv(passwords, request.user), content_type="text/csv"
+            )
+        else:
             return Response(
-                {"error": "Invalid OTP"}, status=status.HTTP_400_BAD_REQUEST
+                {"error": "Unsupported file format, use csv or ndjson."},
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Fetch passwords if OTP is valid
-        passwords = Password.objects.filter(user=request.user)
-        serializer = PasswordSerializer(passwords, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        response["Content-Disposition"] = f'attachment; filename="vault.{file_format}"'
+        return response
 
 
+@query_budget(3)
 class SendOtpEmailView(APIView):
     permission_classes = [
         IsAuthenticated
     ]  # Ensure only authenticated users can access this view
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = "otp_send"
 
     def get(self, request, *args, **kwargs):
         try:
             user = request.user  # Get the logged-in user
 
-            # Generate or fetch OTP secret
-            otp_secret = (
-                user.generate_otp_secret()
-            )  # Generate OTP secret if not already done
-
-            # Generate OTP for the user
-            totp = pyotp.TOTP(otp_secret)
-            generated_otp = totp.now()  # Generate the OTP
+            # Generate the OTP from the user's secret (created on first use);
+            # nothing is stored, verification recomputes it
+            generated_otp = current_otp(user)
 
-            # Store OTP in the user model (or session for simplicity)
-            user.otp_generated = generated_otp  # Save OTP for comparison later
-            user.save()
-
-            # Send the OTP to the user's email
-            send_mail(
+            # Queue the OTP email; the mail dispatcher sends it in the background
+            delivery = queue_mail(
                 "Your OTP for Password Access",
                 f"Your OTP for accessing your passwords is: {generated_otp}",
-                settings.DEFAULT_FROM_EMAIL,  # Sender email (from settings)
-                [user.email],  # Recipient's email
-                fail_silently=False,
+                user.email,  # Recipient's email
+                user=user,
+                expires_at=timezone.now() + code_lifetime(),
             )
+            metrics.OTP_SENT.inc()
 
             return Response(
                 {
-                    "message": "OTP sent successfully to your email!",
+                    "message": "OTP is being sent to your email!",
+                    "delivery_id": str(delivery.id),
                     "user": {"email": user.email},
                 },
-                status=200,
+                status=status.HTTP_202_ACCEPTED,
             )
 
         except Exception as e:
             return Response({"error": str(e)}, status=400)
 
 
-class ImageUploadView(APIView):
+class OtpDeliveryStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+    lean_user = True
+
+    def get(self, request, delivery_id, *args, **kwargs):
+        """Report whether a queued OTP email has been sent."""
+        delivery = (
+            OutboundEmail.objects.filter(id=delivery_id, user_id=request.user.id)
+            .only("id", "status", "attempts", "created_at", "sent_at")
+            .first()
+        )
+        if delivery is None:
+            return Response(
+                {"error": "Delivery not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(
+            {
+                "delivery_id": str(delivery.id),
+                "status": delivery.status,
+                "attempts": delivery.attempts,
+                "created_at": delivery.created_at,
+                "sent_at": delivery.sent_at,
+            }
+        )
+
+
+class ImageUploadView(BoundedUploadMixin, APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = "face"
 
     def post(self, request, *args, **kwargs):
         # Ensure the request includes the image file
         user = request.user
-        print(request.FILES)
 
         if "image" not in request.FILES:
+            return self.missing_image_response(request)
+
+        if Image.objects.filter(user=user).count() >= settings.FACE_MAX_TEMPLATES:
             return Response(
-                {"error": "No image provided."},
+                {"error": f"At most {settings.FACE_MAX_TEMPLATES} face images allowed."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
         file = request.FILES["image"]
 
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        filename = f"{timestamp}_{file.name}"
+        # Decode once, shrink and strip metadata; only this derivative is served
+        try:
+            normalized = normalize_image(file)
+        except InvalidImage as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Encode the face once at enrollment so verification never re-decodes it
+        try:
+            encoding = face_backends.encode(normalized.read())
+        except FacePoolBusy:
+            return face_pool_busy_response()
+        except FaceBackendError as e:
+            return face_backend_error_response(e)
+        except FaceDetectionError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        normalized.seek(0)
 
         # Create an image instance and save the image file
-        image_instance = Image(image=file, user=user)
+        image_instance = Image(
+            image=normalized, user=user, encoding=encoding_to_bytes(encoding)
+        )
+        if settings.FACE_UPLOAD_KEEP_ORIGINAL:
+            file.seek(0)
+            image_instance.original = file
         image_instance.save()  # This will automatically save the image to the server and populate image_url
 
         # Return the image URL in the response
@@ -297,54 +656,148 @@ class ImageUploadView(APIView):
 
 class ImageListView(APIView):
     permission_classes = [IsAuthenticated]
+    lean_user = True
 
     def get(self, request, *args, **kwargs):
-        user = request.user
-        image = Image.objects.get(user=user)
-        if not image:
-            return Response({"status": False, status: 404})
-        serializer = ImageSerializer(image)
+        images = Image.objects.filter(user_id=request.user.id).order_by("id")
+        if not images:
+            return Response({"status": False}, status=status.HTTP_404_NOT_FOUND)
+        serializer = ImageSerializer(images, many=True)
         return Response(serializer.data)
 
 
-class VerifyFaceId(APIView):
+class ImageDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def delete(self, request, pk, *args, **kwargs):
+        """Remove one enrolled face image of the authenticated user."""
+        deleted, _ = Image.objects.filter(pk=pk, user_id=request.user.id).delete()
+        if not deleted:
+            return Response(
+                {"error": "Image not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def no_face_id_response():
+    return Response(
+        {"error": "No face ID enrolled."}, status=status.HTTP_404_NOT_FOUND
+    )
+
+
+@query_budget(3)
+class VerifyFaceId(VaultAccessMixin, BoundedUploadMixin, APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = "face"
 
     def post(self, request, *args, **kwargs):
         user = request.user
         # Get FaceId from server
 
         if "image" not in request.FILES:
-            return Response(
-                {"error": "No image provided."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+            return self.missing_image_response(request)
 
         uploaded_image = request.FILES["image"]
 
-        # Get faceId from DB
-        image = Image.objects.get(user=user)
+        try:
+            # All enrolled faceIds of the user, as one cached encoding matrix
+            templates = get_template_matrix(user.id)
+            if not len(templates):
+                metrics.FACE_VERIFICATIONS.labels("no_face_id").inc()
+                return no_face_id_response()
+
+            # Only the uploaded probe is encoded
+            face_encoding = face_backends.encode(uploaded_image.read())
+        except FacePoolBusy:
+            metrics.FACE_VERIFICATIONS.labels("busy").inc()
+            return face_pool_busy_response()
+        except FaceBackendError as e:
+            metrics.FACE_VERIFICATIONS.labels("backend_error").inc()
+            return face_backend_error_response(e)
+        except FaceDetectionError as e:
+            metrics.FACE_VERIFICATIONS.labels("error").inc()
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        distances = face_distances(templates, face_encoding)
+        distance = reduce_distances(distances, settings.FACE_MATCH_POLICY)[0]
+        metrics.FACE_DISTANCE.observe(distance)
+
+        if distance <= settings.FACE_MATCH_TOLERANCE:
+            metrics.FACE_VERIFICATIONS.labels("match").inc()
+            request.vault_token = issue_vault_token(user, "face")
+            return Response({"status": True})
 
-        image1 = face_recognition.load_image_file(uploaded_image)
-        face_location1 = face_recognition.face_locations(image1)
-        face_encoding1 = face_recognition.face_encodings(image1)[0]
+        metrics.FACE_VERIFICATIONS.labels("no_match").inc()
+        return Response({"status": False}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Process saved faceId image of user
-        user_saved_image_path = self.get_image_path(str(image.image))
-        image2 = face_recognition.load_image_file(user_saved_image_path)
-        face_location2 = face_recognition.face_locations(image2)
-        face_encoding2 = face_recognition.face_encodings(image2)[0]
 
-        results = face_recognition.compare_faces([face_encoding1], face_encoding2)
+class VerifyFaceIdBatch(VaultAccessMixin, BoundedUploadMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [RateLimitThrottle]
+    throttle_scope = "face"
 
-        if results[0]:
-            return Response({"status": True})
+    def post(self, request, *args, **kwargs):
+        """Verify several probe frames of one attempt against the saved faceIds."""
+        user = request.user
+        frames = request.FILES.getlist("images")
 
-        return Response({"status": False, status: 400})
+        if not frames:
+            return self.missing_image_response(request)
 
-    def get_image_path(self, image_path):
-        BASE_DIR = Path(__file__).resolve().parent.parent
-        media_root = os.path.join(BASE_DIR, "media")
+        if len(frames) > settings.FACE_BATCH_MAX_FRAMES:
+            return Response(
+                {"error": f"At most {settings.FACE_BATCH_MAX_FRAMES} images allowed."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        full_image_path = os.path.join(media_root, image_path)
-        return full_image_path
+        try:
+            templates = get_template_matrix(user.id)
+            if not len(templates):
+                metrics.FACE_VERIFICATIONS.labels("no_face_id").inc()
+                return no_face_id_response()
+
+            # All frames are encoded in a single worker call
+            results = face_backends.encode_many([frame.read() for frame in frames])
+        except FacePoolBusy:
+            metrics.FACE_VERIFICATIONS.labels("busy").inc()
+            return face_pool_busy_response()
+        except FaceBackendError as e:
+            metrics.FACE_VERIFICATIONS.labels("backend_error").inc()
+            return face_backend_error_response(e)
+
+        encoded = [i for i, (encoding, error) in enumerate(results) if error is None]
+        frame_results = [
+            {"match": False, "distance": None, "error": error} for _, error in results
+        ]
+
+        matched = 0
+        if encoded:
+            probes = np.stack([results[i][0] for i in encoded])
+            distances = reduce_distances(
+                face_distances(templates, probes), settings.FACE_MATCH_POLICY
+            )
+            for i, distance in zip(encoded, distances):
+                is_match = bool(distance <= settings.FACE_MATCH_TOLERANCE)
+                frame_results[i].update(match=is_match, distance=float(distance))
+                matched += is_match
+                metrics.FACE_DISTANCE.observe(distance)
+
+        # Accept the attempt when enough of the frames match; frames without a
+        # usable face count against it, so junk frames can't pad the ratio
+        verified = bool(encoded) and (
+            matched / len(frames) >= settings.FACE_BATCH_MIN_MATCH_RATIO
+        )
+        if not encoded:
+            metrics.FACE_VERIFICATIONS.labels("error").inc()
+        else:
+            metrics.FACE_VERIFICATIONS.labels("match" if verified else "no_match").inc()
+
+        data = {
+            "status": verified,
+            "matched": matched,
+            "frames": frame_results,
+        }
+        if verified:
+            request.vault_token = issue_vault_token(user, "face")
+        return Response(data, status=status.HTTP_200_OK)